@@ -4,10 +4,10 @@
 # Name:             0.21_Sentinel-2_Level-1C_Batch_Download_Unzip_and_Composite_by_Area_of_Interest.py 
 # Author:           Kelly Meehan, USBR
 # Created:          20200406
-# Updated:          20200612 
+# Updated:          20261018 
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro license and sentinelsat Python package download
+# Requires:         ArcGIS Pro license, sentinelsat Python package download, sentinel_download.py, sentinel_catalog.py, sentinel_query.py, sentinel_safe.py, sentinel_composite.py, sentinel_manifest.py, sentinel_band_cache.py, sentinel_pipeline.py, and sentinel_ingest.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script 
 
@@ -26,6 +26,19 @@
 #                           Cloud_Range_End                 String (Data Type) > Required (Type) > Direction (Input)
 #                           Composite Bands?                Boolean (Data Type) > Optional (Type) > Direction (Input)                           
 #                           Bands                           String-Multiple Values (Data Type) > Optional (Type) > Direction (Input) > Value List of 01 through 12 (Filter)
+#                           Concurrent_Downloads            Long (Data Type) > Optional (Type) > Direction (Input) > Default 4
+#                           Downloads_per_Host              Long (Data Type) > Optional (Type) > Direction (Input) > Default 2
+#                           Offline_Wait_Hours              Double (Data Type) > Optional (Type) > Direction (Input) > Default 0
+#                           Composite_From_Zip              Boolean (Data Type) > Optional (Type) > Direction (Input) > Default False
+#                           Composite_Workers               Long (Data Type) > Optional (Type) > Direction (Input) > Default 1
+#                           Worker_Memory_MB                Long (Data Type) > Optional (Type) > Direction (Input) > Default 2048
+#                           Dry_Run                         Boolean (Data Type) > Optional (Type) > Direction (Input) > Default False
+#                           Composite_Format                String (Data Type) > Optional (Type) > Direction (Input) > Value List of IMG, COG (Filter) > Default IMG
+#                           Composite_Resolution            Long (Data Type) > Optional (Type) > Direction (Input) > Value List of 10, 20, 60 (Filter) > Default 10
+#                           Resampling_Method               String (Data Type) > Optional (Type) > Direction (Input) > Value List of NEAREST, BILINEAR, AVERAGE (Filter) > Default NEAREST
+#                           Crop_to_AOI                     Boolean (Data Type) > Optional (Type) > Direction (Input) > Default False
+#                           Crop_Buffer_Pixels              Long (Data Type) > Optional (Type) > Direction (Input) > Default 10
+#                           Band_Cache_MB                   Long (Data Type) > Optional (Type) > Direction (Input) > Default 20480
 
 ###############################################################################################
 ###############################################################################################
@@ -37,7 +50,7 @@
 # 2. Run query and store resultant list of products as an ordered dictionary
 # 3. Cull query results by keeping only one file per date with the smallest size
 # 4. Generate csv of downloaded product metadata
-# 5. Download culled products to output directory
+# 5. Download culled products to output directory (extracting and compositing each product as soon as it is downloaded, if user selected to composite bands)
 # 6. Iterate through Sentinel-2 product Level-1C product zip files, unzip files to retreive .SAFE if necessary, and composite user-selected bands (if user selected to composite bands)
 
 #----------------------------------------------------------------------------------------------
@@ -45,7 +58,7 @@
 # 0. Set-up
 
 # 0.0 Import necessary packages
-import os, arcpy, sentinelsat, zipfile, glob, fnmatch
+import os, sys, arcpy, sentinelsat, time, sentinel_download, sentinel_catalog, sentinel_query, sentinel_composite, sentinel_band_cache, sentinel_pipeline, sentinel_ingest
 
 #--------------------------------------------
 
@@ -81,6 +94,45 @@ composite_is_checked = arcpy.GetParameterAsText(8)
 # User selects bands to be composited 
 bands = arcpy.GetParameterAsText(9) # NOTE: multi-value string is returned as string with semi-colon delimiter (e.g. '02;03;04;08')
 
+# User specifies maximum number of products downloaded at once (defaults to 4)
+concurrent_downloads = int(arcpy.GetParameterAsText(10) or sentinel_download.DEFAULT_MAX_WORKERS)
+
+# User specifies maximum number of products downloaded at once from any one host (defaults to 2, the Copernicus Open Access Hub limit per user)
+downloads_per_host = int(arcpy.GetParameterAsText(11) or sentinel_download.DEFAULT_MAX_PER_HOST)
+
+# User specifies number of hours to wait for offline products to be retrieved from the Long Term Archive (defaults to 0, in which case retrieval is requested and products still offline are picked up on the next run)
+offline_wait_hours = float(arcpy.GetParameterAsText(12) or 0)
+
+# User specifies whether to composite bands straight from zip files without extracting SAFE directory (requires GDAL Python bindings; defaults to false)
+composite_from_zip = str(arcpy.GetParameterAsText(13)) == 'true'
+
+# User specifies number of products composited at once, each in its own worker process (defaults to 1, compositing products one after another)
+composite_workers = int(arcpy.GetParameterAsText(14) or sentinel_composite.DEFAULT_COMPOSITE_WORKERS)
+
+# User specifies memory cap, in megabytes, of each worker process, within which each composite is written a window at a time (defaults to 2048)
+worker_memory_mb = int(arcpy.GetParameterAsText(15) or sentinel_composite.DEFAULT_WORKER_MEMORY_MB)
+
+# User specifies whether to print plan of remaining work (queries, downloads, extractions, and composites, with bytes and estimated processing time) and stop without downloading or compositing (defaults to false)
+dry_run = str(arcpy.GetParameterAsText(16)) == 'true'
+
+# User specifies format of composite rasters: ERDAS IMAGINE (IMG) or tiled, compressed Cloud-Optimized GeoTIFF with overviews, statistics, and histograms (COG, requires GDAL Python bindings; defaults to IMG)
+composite_format = arcpy.GetParameterAsText(17) or sentinel_composite.DEFAULT_OUTPUT_FORMAT
+
+# User specifies cell size (m) of composite rasters' common grid, onto which bands of other resolutions are resampled (20 m: 05, 06, 07, 11, 12; 60 m: 01, 09, 10; defaults to 10)
+composite_resolution = int(arcpy.GetParameterAsText(18) or sentinel_composite.DEFAULT_RESOLUTION)
+
+# User specifies method of resampling bands onto common grid: NEAREST, BILINEAR, or AVERAGE (of finer bands' pixels within each cell; defaults to NEAREST)
+resampling_method = arcpy.GetParameterAsText(19) or sentinel_composite.DEFAULT_RESAMPLING
+
+# User specifies whether to crop composites to window around AOI (plus buffer), decoding only band file tiles that intersect it (requires GDAL Python bindings; defaults to false)
+crop_to_aoi = str(arcpy.GetParameterAsText(20)) == 'true'
+
+# User specifies buffer, in pixels of composite grid, kept around cropped window (defaults to 10)
+crop_buffer = int(arcpy.GetParameterAsText(21) or sentinel_composite.DEFAULT_CROP_BUFFER)
+
+# User specifies disk quota, in megabytes, of cache of decoded band files within output directory, from which products are re-composited (e.g. with a different band set) without decoding JPEG2000 again (requires GDAL Python bindings; 0 turns cache off; defaults to 20480)
+band_cache_mb = int(arcpy.GetParameterAsText(22) or sentinel_band_cache.DEFAULT_BAND_CACHE_MB)
+
 #--------------------------------------------
 
 # 0.2 Set environment settings
@@ -96,6 +148,43 @@ arcpy.env.overwriteOuptut = True
 # 0.3 Change working directory to output directory
 os.chdir(output_directory)
 
+#--------------------------------------------
+
+# 0.4 Organize user-selected bands (if user selected to composite bands)
+bands_list = []
+band_nomenclature = None
+crop = None
+
+if str(composite_is_checked) == 'true':
+    
+    # Create list of strings out of user selected band numbers (e.g. ['02', '03', '04', '08'])
+    bands_list = bands.split(';')
+    
+    # Convert list of band numbers into organized string for naming convention of final composite rasters (e.g. '2-4_8')
+    band_nomenclature = sentinel_ingest.band_set_name(bands_list)
+    
+    # Print list of bands to be composited by tool
+    arcpy.AddMessage('This script will composite only Sentinel bands: ' + bands)
+
+    # Composite straight from zip files only where GDAL is available
+    if composite_from_zip and not sentinel_composite.zip_native_available():
+        arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, band files will be extracted from zip files instead')
+        composite_from_zip = False
+
+    # Write Cloud-Optimized GeoTIFF composites only where GDAL is available
+    if composite_format == 'COG' and not sentinel_composite.zip_native_available():
+        arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, composites will be written as ERDAS IMAGINE (.img) instead')
+        composite_format = 'IMG'
+
+    # Resample bands of differing resolution explicitly only where GDAL is available; otherwise ArcGIS composites them as they are
+    if sentinel_composite.needs_resampling(bands_list, composite_resolution) and not sentinel_composite.zip_native_available():
+        arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, bands of differing resolution will not be resampled onto a common {} m grid'.format(composite_resolution))
+
+    # Crop composites to AOI only where GDAL is available
+    if crop_to_aoi and not sentinel_composite.zip_native_available():
+        arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, composites will cover whole tiles rather than AOI')
+        crop_to_aoi = False
+
 #---------------------------------------------------------------------------------------------
 
 # 1. Authenticate credentials to Copernicus Open Access Hub 
@@ -116,8 +205,13 @@ arcpy.FeaturesToJSON_conversion(in_features = aoi_polygon, out_json_file = os.pa
 # Read GeoJSON file into a GeoJSON object and then convert to Well-Known Text
 footprint = sentinelsat.geojson_to_wkt(sentinelsat.read_geojson(os.path.join(output_directory, 'aoi.geojson')))
 
-# Search SciHub for Sentinel-2, Level 1C products for which the AOI is completely inside the footprint of the image
-products = api.query(area = footprint, area_relation = 'Contains', date = (date_range_begin, date_range_end), platformname = 'Sentinel-2', producttype = 'S2MSI1C', cloudcoverpercentage = (cloud_range_begin, cloud_range_end))
+# Assign variable to bounds of AOI (plus buffer) to which composites are cropped, if user selected to crop composites to AOI
+if crop_to_aoi and str(composite_is_checked) == 'true':
+    crop = sentinel_composite.aoi_crop(sentinelsat.read_geojson(os.path.join(output_directory, 'aoi.geojson')), crop_buffer)
+
+# Search SciHub for Sentinel-2, Level 1C products for which the AOI is completely inside the footprint of the image, reusing response cached within output directory
+query_stats = {}
+products = sentinel_query.query_products(api = api, area = footprint, area_relation = 'Contains', date_range_begin = date_range_begin, date_range_end = date_range_end, cloud_range_begin = cloud_range_begin, cloud_range_end = cloud_range_end, cache_directory = os.path.join(output_directory, sentinel_query.CACHE_FOLDER), stats = query_stats, messages = arcpy.AddMessage)
 
 # Print initial number of products returned from query 
 arcpy.AddMessage('Initial number of products returned from query: ' + str(len(products)))
@@ -156,138 +250,84 @@ products_df_unduplicated.to_csv('Sentinel-2_Level-1C_Query_by_AOI_' + date_range
 
 arcpy.AddMessage('Generated csv with metadata from products returned by query')
 
+# Open catalog of products within output directory (recording any zip files added to it since the last run, e.g. downloaded by hand or copied in) and record products returned from query
+catalog = sentinel_catalog.ProductCatalog(output_directory)
+catalog.import_local_products()
+
+catalog.record_products(products_df_unduplicated)
+
 #----------------------------------------------------------------------------------------------
 
-# 5. Download culled products to output directory
+# 5. Download culled products to output directory (extracting and compositing each product as soon as it is downloaded, if user selected to composite bands)
 
-for p in products_df_unduplicated.index:
-    product_info = api.get_product_odata(p)
-    arcpy.AddMessage(product_info)
-    if product_info['Online']:
-        arcpy.AddMessage('Product {} is online. Starting download.'.format(p))
-        api.download(p)
-    else:
-        arcpy.AddMessage('Product {} is not online.'.format(p))
+# Plan remaining work (downloads, extractions, and composites) from catalog and output directory in a single pass, and print it with bytes and estimated processing time
+ingest_plan = sentinel_ingest.plan_ingest(catalog = catalog, directory_path = output_directory, product_ids = products_df_unduplicated.index, bands_list = bands_list, band_set = band_nomenclature, from_zip = composite_from_zip, query_stats = query_stats, output_format = composite_format, resolution = composite_resolution, resampling = resampling_method, crop = crop)
+ingest_plan.report(composite_workers = composite_workers, messages = arcpy.AddMessage)
 
-#----------------------------------------------------------------------------------------------
+# Assign variable to products that have not yet been downloaded and verified
+products_to_download = ingest_plan.downloads
 
-# 6. Iterate through Sentinel-2 product Level-1C product zip files, unzip files to retreive .SAFE if necessary, and composite user-selected bands (if user selected to composite bands)
+arcpy.AddMessage('Number of products already downloaded: ' + str(len(products_df_unduplicated.index) - len(products_to_download)))
 
-# Create list of Sentinel-2 Level-1C zip files present in output directory 
+# Stop after printing plan if user requested a dry run
+if dry_run:
+    arcpy.AddMessage('Dry run: no products were downloaded, extracted, or composited')
+    catalog.close()
+    sys.exit(0)
+
+# Download products with a pool of workers, skipping those that are not online
+download_start = time.time()
+
+# If user selected to composite bands, run downloading, band extraction, and compositing as overlapping stages so that each product is composited as soon as it is downloaded (products already downloaded but not yet composited go first);
+#   pipeline records each product in catalog as it goes and prints throughput and utilisation of each stage
 if str(composite_is_checked) == 'true':
+    download_results = sentinel_pipeline.run_pipeline(api = api, catalog = catalog, product_ids = products_to_download, directory_path = output_directory, bands_list = bands_list, band_set = band_nomenclature, from_zip = composite_from_zip, max_workers = concurrent_downloads, max_per_host = downloads_per_host, composite_workers = composite_workers, memory_cap_mb = worker_memory_mb, output_format = composite_format, resolution = composite_resolution, resampling = resampling_method, crop = crop, band_cache_mb = band_cache_mb, messages = arcpy.AddMessage)
+
+# Otherwise download products alone
+else:
+    download_results = sentinel_download.download_products(api = api, product_ids = products_to_download, directory_path = output_directory, max_workers = concurrent_downloads, max_per_host = downloads_per_host, messages = arcpy.AddMessage)
     
-    # Create list of strings out of user selected band numbers (e.g. ['02', '03', '04', '08'])
-    bands_list = bands.split(';')
-    
-    # 0.2 Convert user-passed argument string of bands into organized string for naming convention
-    
-    # Convert bands string of numbers into list of integers (e.g. [2, 3, 4, 8])
-    bands_integer_list = sorted(list(map(int,(bands.split(';')))))
-    
-    # Function to convert list of numbers into a string that more elegantly expresses instances of consecutive sequences
-    #   Adapted from: https://stackoverflow.com/questions/29418693/write-ranges-of-numbers-with-dashes
-    
-    def organize_list_of_integers(band_numbers):
-        seq = []
-        final = []
-        last = 0
-    
-        for index, val in enumerate(band_numbers):
-            # Check to see if current value is either the first in list or a consecutive number from the previous
-           
-            # If element is either first element or consecutive number, add value to sequence list
-            if last + 1 == val or index == 0:
-                seq.append(val)
-                last = val
-            # If element is not consecutive number
-            else:
-                # Either add string of first-last in the case of a sequence
-                if len(seq) > 1:
-                   final.append(str(seq[0]) + '-' + str(seq[len(seq)-1]))
-                # Or just add previous single value to final
-                else:
-                   final.append(str(seq[0]))
-                seq = []
-                seq.append(val)
-                last = val
-            
-            # Check to see if loop is on last number in list (seq gets converted during the next index's turn, which doesn't exist for last index)
-            if index == len(band_numbers) - 1:
-                # Either add string of first-last in the case of a sequence
-                if len(seq) > 1:
-                    final.append(str(seq[0]) + '-' + str(seq[-1]))
-                # Or just add single value to final
-                else:
-                    final.append(str(seq[0]))
-        # Concatenate list of string elements in final list into one string using '_' in between elements
-        final_str = '_'.join(final)
-        return final_str
-    
-    # Call function and assign variable to resultant string (for use at end of script in naming convention of final composite rasters)
-    band_nomenclature = organize_list_of_integers(bands_integer_list)
+    # Print throughput of each downloaded product
+    sentinel_download.summarize_downloads(results = download_results, wall_seconds = time.time() - download_start, messages = arcpy.AddMessage)
     
-    # Print list of bands to be composited by tool
-    arcpy.AddMessage('This script will composite only Sentinel bands: ' + bands)
+    # Record download status and checksum of each product in catalog
+    catalog.record_downloads(results = download_results)
 
-#--------------------------------------------
+# Queue offline products for retrieval from the Long Term Archive and start scheduler that downloads each one as soon as it comes online (products queued by earlier runs are picked up too)
+lta_scheduler = sentinel_download.LongTermArchiveScheduler(api = api, directory_path = output_directory, max_workers = concurrent_downloads, max_per_host = downloads_per_host, messages = arcpy.AddMessage)
+lta_scheduler.add([r['id'] for r in download_results if r['status'] == 'offline'])
+lta_scheduler.start()
 
-# Create list of Sentinel-2 Level-1C zip files present in output directory by checking for zip files downloaded from Copernicus Open Data Hub or USGS Earth Explorer (respectively)
-zip_list = glob.glob('S2?_MSIL1C*.zip') + glob.glob('L1C_T*.zip')
+# Assign variable to time after which tool stops waiting for offline products
+lta_deadline = time.time() + offline_wait_hours * 3600
 
-for z in zip_list:
+#----------------------------------------------------------------------------------------------
 
-    # Identify the unique path of zip file
-    zip_path = os.path.abspath(z)
-    # Unzip to folder with same name as zip file within path directory
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref: 
-        zip_ref.extractall(output_directory)
+# 6. Iterate through Sentinel-2 product Level-1C product zip files, unzip files to retreive .SAFE if necessary, and composite user-selected bands (if user selected to composite bands)
 
-arcpy.AddMessage('Unzipped zip files')
+# Create list of Sentinel-2 Level-1C zip files present in output directory 
+if str(composite_is_checked) == 'true':
+    
+    # Composite any products the pipeline left behind while scheduler retrieves offline products, then composite each retrieved product as it arrives
+    while True:
+        
+        # Composite downloaded products (recorded in catalog) that do not yet have a composite raster for user-selected bands
+        sentinel_ingest.composite_missing(catalog = catalog, directory_path = output_directory, bands_list = bands_list, band_set = band_nomenclature, from_zip = composite_from_zip, composite_workers = composite_workers, memory_cap_mb = worker_memory_mb, output_format = composite_format, resolution = composite_resolution, resampling = resampling_method, crop = crop, band_cache_mb = band_cache_mb, messages = arcpy.AddMessage)
+        
+        # Stop once no offline products remain queued or wait time has run out; otherwise wait for next retrieved product to finish downloading
+        if not lta_scheduler.is_alive() or time.time() >= lta_deadline:
+            break
+        
+        lta_scheduler.wait_for_download(timeout = lta_deadline - time.time())
 
 #--------------------------------------------
-    
-# Assign variable to composite raster name using using the following nomenclature:      
-#   S2_MSIL1C_YYYYMMDD_Rxxx_Txxxxx_Bx_.img 
-#   (i.e. S2_ProductLevel1C_SensingDate_RelativeOrbitNumber_TileNumber_BandsComposited.img)
-    
-# Create list of Sentinel-SAFE files     
-safe_list = glob.glob('S2?_MSIL1C*.SAFE')
 
-for safe_directory in safe_list:
-    
-    composite_raster_name = safe_directory.split('_')[0][:-1] + '_' + safe_directory.split('_')[1] + '_' + safe_directory.split('_')[2][:8] + '_' + safe_directory.split('_')[4] + '_' + safe_directory.split('_')[5] + '_B' + band_nomenclature + '.img' 
-    
-    # Check to see if composite raster (associated with SAFE file and based on user-selected bands) already exists
-    if os.path.isfile(composite_raster_name):
-        arcpy.AddMessage(composite_raster_name + ' already exists, continuing to next SAFE file')
-        
-        # If composite exists, continue to next SAFE file
-        continue
-    
-    # Otherwise, if composite raster does not exist, create it
-    else:
-        arcpy.AddMessage(composite_raster_name + ' does not already exist, proceeding')
-            
-        # Composite rasters within IMG_DATA directory (within GRANULE directory of SAFE directory) that match user-selected bands
-
-        granule_folder_path = os.path.join(safe_directory, 'GRANULE')
-        level_1C_folder_list = os.listdir(granule_folder_path)
-        for k in level_1C_folder_list:
-            level_1C_folder_path = os.path.join(granule_folder_path, k)
-            img_folder_path = os.path.join(level_1C_folder_path, 'IMG_DATA')
-            raster_list = os.listdir(img_folder_path)
-            all_bands_of_interest_path_list = []
-            for r in raster_list:
-                raster_path = os.path.join(img_folder_path, r)
-                for b in bands_list:
-                    match_string = '*' + str(b) + '.jp2'
-                    if fnmatch.fnmatch(r, match_string):
-                        all_bands_of_interest_path_list.append(raster_path)
-            
-            # Generate ERDAS IMAGINE, .img composite of rasters matching user-selected bands
-            
-            composite_raster = os.path.join(output_directory, composite_raster_name)
-            arcpy.CompositeBands_management(in_rasters = all_bands_of_interest_path_list, out_raster = composite_raster)
-            arcpy.AddMessage('Finished compositing ' + composite_raster_name)
-    
-   
\ No newline at end of file
+# Wait for offline products (if user chose to wait), then stop scheduler; products still offline stay queued in catalog for next run
+while lta_scheduler.is_alive() and time.time() < lta_deadline:
+    lta_scheduler.wait_for_download(timeout = lta_deadline - time.time())
+
+lta_scheduler.stop()
+
+# Close catalog
+catalog.close()
+
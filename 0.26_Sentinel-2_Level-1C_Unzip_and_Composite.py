@@ -4,10 +4,10 @@
 # Name:             0.26_Sentinel-2_Level-1C_Unzip_and_Copmosite.py
 # Author:           Kelly Meehan, USBR
 # Created:          20200423
-# Updated:          20200618
+# Updated:          20261018
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro license and sentinelsat Python package
+# Requires:         ArcGIS Pro license, sentinelsat Python package, sentinel_catalog.py, sentinel_safe.py, sentinel_composite.py, sentinel_manifest.py, sentinel_band_cache.py, and sentinel_ingest.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script 
 
@@ -17,6 +17,14 @@
 #                       Parameters tab:    
 #                           Output_Directory: Workspace (Data Type) > Required (Type) > Direction (Input) 
 #                           Bands: String-Multiple Values (Data Type) > Required (Type) > Direction (Input) > Value List of 01 through 12 (Filter)
+#                           Composite_From_Zip: Boolean (Data Type) > Optional (Type) > Direction (Input) > Default False
+#                           Composite_Workers: Long (Data Type) > Optional (Type) > Direction (Input) > Default 1
+#                           Worker_Memory_MB: Long (Data Type) > Optional (Type) > Direction (Input) > Default 2048
+#                           Dry_Run: Boolean (Data Type) > Optional (Type) > Direction (Input) > Default False
+#                           Composite_Format: String (Data Type) > Optional (Type) > Direction (Input) > Value List of IMG, COG (Filter) > Default IMG
+#                           Composite_Resolution: Long (Data Type) > Optional (Type) > Direction (Input) > Value List of 10, 20, 60 (Filter) > Default 10
+#                           Resampling_Method: String (Data Type) > Optional (Type) > Direction (Input) > Value List of NEAREST, BILINEAR, AVERAGE (Filter) > Default NEAREST
+#                           Band_Cache_MB: Long (Data Type) > Optional (Type) > Direction (Input) > Default 20480
 
 ###############################################################################################
 ###############################################################################################
@@ -24,14 +32,14 @@
 # This script will:
 
 # 0. Set-up
-# 1. Iterate through Sentinel-2 product Level-1C product zip files, unzip files to retreive .SAFE file, and composite user-selected bands
+# 1. Iterate through Sentinel-2 product Level-1C product zip files without a composite recorded in catalog, unzip files to retreive .SAFE file if necessary, and composite user-selected bands
 
 #----------------------------------------------------------------------------------------------
 
 # 0. Set-up
 
 # 0.0 Import necessary packages
-import os, arcpy, zipfile, glob, fnmatch
+import os, sys, arcpy, glob, sentinel_catalog, sentinel_composite, sentinel_band_cache, sentinel_ingest
 
 # 0.1 Assign variables to tool parameters
 
@@ -41,6 +49,30 @@ output_directory = arcpy.GetParameterAsText(0)
 # User selects bands to be composited 
 bands = arcpy.GetParameterAsText(1) # NOTE: multi-value string is returned as string with semi-colon delimiter (e.g. '02;03;04;08')
 
+# User specifies whether to composite bands straight from zip files without extracting SAFE directory (requires GDAL Python bindings; defaults to false)
+composite_from_zip = str(arcpy.GetParameterAsText(2)) == 'true'
+
+# User specifies number of products composited at once, each in its own worker process (defaults to 1, compositing products one after another)
+composite_workers = int(arcpy.GetParameterAsText(3) or sentinel_composite.DEFAULT_COMPOSITE_WORKERS)
+
+# User specifies memory cap, in megabytes, of each worker process, within which each composite is written a window at a time (defaults to 2048)
+worker_memory_mb = int(arcpy.GetParameterAsText(4) or sentinel_composite.DEFAULT_WORKER_MEMORY_MB)
+
+# User specifies whether to only report the extractions and composites remaining, with their size and estimated processing time, without running them (defaults to false)
+dry_run = str(arcpy.GetParameterAsText(5)) == 'true'
+
+# User specifies format of composite rasters: ERDAS IMAGINE (IMG) or tiled, compressed Cloud-Optimized GeoTIFF with overviews, statistics, and histograms (COG, requires GDAL Python bindings; defaults to IMG)
+composite_format = arcpy.GetParameterAsText(6) or sentinel_composite.DEFAULT_OUTPUT_FORMAT
+
+# User specifies cell size (m) of composite rasters' common grid, onto which bands of other resolutions are resampled (20 m: 05, 06, 07, 11, 12; 60 m: 01, 09, 10; defaults to 10)
+composite_resolution = int(arcpy.GetParameterAsText(7) or sentinel_composite.DEFAULT_RESOLUTION)
+
+# User specifies method of resampling bands onto common grid: NEAREST, BILINEAR, or AVERAGE (of finer bands' pixels within each cell; defaults to NEAREST)
+resampling_method = arcpy.GetParameterAsText(8) or sentinel_composite.DEFAULT_RESAMPLING
+
+# User specifies disk quota, in megabytes, of cache of decoded band files within output directory, from which products are re-composited (e.g. with a different band set) without decoding JPEG2000 again (requires GDAL Python bindings; 0 turns cache off; defaults to 20480)
+band_cache_mb = int(arcpy.GetParameterAsText(9) or sentinel_band_cache.DEFAULT_BAND_CACHE_MB)
+
 # 0.2 Set environment settings
 
 # Set workspace to output directory
@@ -54,120 +86,60 @@ os.chdir(output_directory)
 
 #----------------------------------------------------------------------------------------------
 
-# 1. Iterate through Sentinel-2 product Level-1C product zip files, unzip files to retreive .SAFE file, and composite user-selected bands
+# 1. Iterate through Sentinel-2 product Level-1C product zip files without a composite recorded in catalog, unzip files to retreive .SAFE file if necessary, and composite user-selected bands
 
 # Create list of strings out of user selected band numbers (e.g. ['02', '03', '04', '08'])
 bands_list = bands.split(';')
 
 # 0.2 Convert user-passed argument string of bands into organized string for naming convention
 
-# Convert bands string of numbers into list of integers (e.g. [2, 3, 4, 8])
-bands_integer_list = sorted(list(map(int,(bands.split(';')))))
- 
-# Function to convert list of numbers into a string that more elegantly expresses instances of consecutive sequences
-#   Adapted from: https://stackoverflow.com/questions/29418693/write-ranges-of-numbers-with-dashes
-
-def organize_list_of_integers(band_numbers):
-    seq = []
-    final = []
-    last = 0
-
-    for index, val in enumerate(band_numbers):
-        # Check to see if current value is either the first in list or a consecutive number from the previous
-       
-        # If element is either first element or consecutive number, add value to sequence list
-        if last + 1 == val or index == 0:
-            seq.append(val)
-            last = val
-        # If element is not consecutive number
-        else:
-            # Either add string of first-last in the case of a sequence
-            if len(seq) > 1:
-               final.append(str(seq[0]) + '-' + str(seq[len(seq)-1]))
-            # Or just add previous single value to final
-            else:
-               final.append(str(seq[0]))
-            seq = []
-            seq.append(val)
-            last = val
-        
-        # Check to see if loop is on last number in list (seq gets converted during the next index's turn, which doesn't exist for last index)
-        if index == len(band_numbers) - 1:
-            # Either add string of first-last in the case of a sequence
-            if len(seq) > 1:
-                final.append(str(seq[0]) + '-' + str(seq[-1]))
-            # Or just add single value to final
-            else:
-                final.append(str(seq[0]))
-    # Concatenate list of string elements in final list into one string using '_' in between elements
-    final_str = '_'.join(final)
-    return final_str
-
-# Call function and assign variable to resultant string (for use at end of script in naming convention of final composite rasters)
-band_nomenclature = organize_list_of_integers(bands_integer_list)
+# Call function and assign variable to resultant string (for use at end of script in naming convention of final composite rasters, e.g. '2-4_8')
+band_nomenclature = sentinel_ingest.band_set_name(bands_list)
 
 # Print list of bands to be composited by tool
 arcpy.AddMessage('This script will composite only Sentinel bands: ' + bands)
 
 #--------------------------------------------
 
-# Create list of Sentinel-2 Level-1C zip files present in output directory by checking for zip files downloaded from Copernicus Open Data Hub or USGS Earth Explorer (respectively)
-zip_list = glob.glob('S2?_MSIL1C*.zip') + glob.glob('L1C_T*.zip')
+# Open catalog of products within output directory
+catalog = sentinel_catalog.ProductCatalog(output_directory)
 
-for z in zip_list:
+# Record Sentinel-2 Level-1C zip files present in output directory, downloaded from Copernicus Open Data Hub or USGS Earth Explorer (respectively); those already recorded keep their extraction and composite history
+for z in glob.glob('S2?_MSIL1C*.zip') + glob.glob('L1C_T*.zip'):
+    catalog.record_local_product(os.path.abspath(z))
 
-    # Identify the unique path of zip file
-    zip_path = os.path.abspath(z)
-    # Unzip to folder with same name as zip file within path directory
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref: 
-        zip_ref.extractall(output_directory)
+#--------------------------------------------
+
+# Composite straight from zip files only where GDAL is available
+if composite_from_zip and not sentinel_composite.zip_native_available():
+    arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, band files will be extracted from zip files instead')
+    composite_from_zip = False
+
+# Write Cloud-Optimized GeoTIFF composites only where GDAL is available
+if composite_format == 'COG' and not sentinel_composite.zip_native_available():
+    arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, composites will be written as ERDAS IMAGINE (.img) instead')
+    composite_format = 'IMG'
 
-arcpy.AddMessage('Unzipped zip files')
+# Resample bands of differing resolution explicitly only where GDAL is available; otherwise ArcGIS composites them as they are
+if sentinel_composite.needs_resampling(bands_list, composite_resolution) and not sentinel_composite.zip_native_available():
+    arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, bands of differing resolution will not be resampled onto a common {} m grid'.format(composite_resolution))
 
 #--------------------------------------------
-    
-# Assign variable to composite raster name using using the following nomenclature:      
-#   S2_MSIL1C_YYYYMMDD_Rxxx_Txxxxx_Bx_.img 
-#   (i.e. S2_ProductLevel1C_SensingDate_RelativeOrbitNumber_TileNumber_BandsComposited.img)
-    
-# Create list of Sentinel-SAFE files     
-safe_list = glob.glob('S2?_MSIL1C*.SAFE')
-
-for safe_directory in safe_list:
-    
-    composite_raster_name = safe_directory.split('_')[0][:-1] + '_' + safe_directory.split('_')[1] + '_' + safe_directory.split('_')[2][:8] + '_' + safe_directory.split('_')[4] + '_' + safe_directory.split('_')[5] + '_B' + band_nomenclature + '.img' 
-    
-    # Check to see if composite raster (associated with SAFE file and based on user-selected bands) already exists
-    if os.path.isfile(composite_raster_name):
-        arcpy.AddMessage(composite_raster_name + ' already exists, continuing to next SAFE file')
-        
-        # If composite exists, continue to next SAFE file
-        continue
-    
-    # Otherwise, if composite raster does not exist, create it
-    else:
-        arcpy.AddMessage(composite_raster_name + ' does not already exist, proceeding')
-            
-        # Composite rasters within IMG_DATA directory (within GRANULE directory of SAFE directory) that match user-selected bands
-
-        granule_folder_path = os.path.join(safe_directory, 'GRANULE')
-        level_1C_folder_list = os.listdir(granule_folder_path)
-        for k in level_1C_folder_list:
-            level_1C_folder_path = os.path.join(granule_folder_path, k)
-            img_folder_path = os.path.join(level_1C_folder_path, 'IMG_DATA')
-            raster_list = os.listdir(img_folder_path)
-            all_bands_of_interest_path_list = []
-            for r in raster_list:
-                raster_path = os.path.join(img_folder_path, r)
-                for b in bands_list:
-                    match_string = '*' + str(b) + '.jp2'
-                    if fnmatch.fnmatch(r, match_string):
-                        all_bands_of_interest_path_list.append(raster_path)
-            
-            # Generate ERDAS IMAGINE, .img composite of rasters matching user-selected bands
-            
-            composite_raster = os.path.join(output_directory, composite_raster_name)
-            arcpy.CompositeBands_management(in_rasters = all_bands_of_interest_path_list, out_raster = composite_raster)
-            arcpy.AddMessage('Finished compositing ' + composite_raster_name)
-    
-        
+
+# Plan extractions and composites remaining, with their size and estimated processing time
+ingest_plan = sentinel_ingest.plan_ingest(catalog = catalog, directory_path = output_directory, bands_list = bands_list, band_set = band_nomenclature, from_zip = composite_from_zip, output_format = composite_format, resolution = composite_resolution, resampling = resampling_method)
+ingest_plan.report(composite_workers = composite_workers, messages = arcpy.AddMessage)
+
+# Stop here if user only requested plan
+if dry_run:
+    arcpy.AddMessage('Dry run requested, no products will be extracted or composited')
+    catalog.close()
+    sys.exit(0)
+
+#--------------------------------------------
+
+# Extract and composite user-selected bands of each product (recorded in catalog) that does not yet have a composite raster for them, recording composites in catalog so that they are skipped on subsequent runs
+sentinel_ingest.composite_missing(catalog = catalog, directory_path = output_directory, bands_list = bands_list, band_set = band_nomenclature, from_zip = composite_from_zip, composite_workers = composite_workers, memory_cap_mb = worker_memory_mb, output_format = composite_format, resolution = composite_resolution, resampling = resampling_method, band_cache_mb = band_cache_mb, messages = arcpy.AddMessage)
+
+# Close catalog
+catalog.close()
@@ -0,0 +1,65 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             0.27_Build_Imagery_Cube.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         ArcGIS Pro license, GDAL Python bindings (osgeo), sentinel_composite.py, sentinel_ingest.py, and sentinel_cube.py (in same directory as this script)
+
+# Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script
+
+# Description:      This tool aligns the composite rasters within an imagery directory onto a common grid and writes them to an imagery cube (one per band set, and one per crop, resolution, or resampling method for products only composited so),
+#                   stored in spatial chunks with each date's cloud masks, from which later tools (0.30 and 0.40) read windows without reading each composite again; rerunning it after new composites arrive only adds their dates
+
+# Tool setup:       The script tool's properties can be set as follows (label does not matter, only the order):
+#                       Parameters tab:
+#                           Imagery_Directory: Workspace (Data Type) > Required (Type) > Direction (Input)
+#                           Bands: String-Multiple Values (Data Type) > Optional (Type) > Direction (Input) > Value List of 01 through 12 (Filter) > Default every band set within Imagery_Directory
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Build or update imagery cube of each band set from composite rasters within imagery directory
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import sys, arcpy, sentinel_composite, sentinel_ingest, sentinel_cube
+
+# 0.1 Assign variables to tool parameters
+
+# User specifies folder holding composite rasters (written by 0.2x tools)
+imagery_directory = arcpy.GetParameterAsText(0)
+
+# User selects bands of composites to add to cube (e.g. '02;03;04;08'; defaults to every band set of composites within imagery directory)
+bands = arcpy.GetParameterAsText(1)
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Build or update imagery cube of each band set from composite rasters within imagery directory
+
+# Stop if GDAL is not available, as composites are read and aligned with it
+if sentinel_cube.gdal is None:
+    arcpy.AddError('GDAL Python bindings (osgeo) are required to build an imagery cube')
+    sys.exit(0)
+
+# Find composites within imagery directory, grouped by band set (composites cropped to an area of interest, or at another resolution or resampling, where no full-tile composite of their product
+#   at default resolution and resampling exists, go into a cube of their own)
+band_sets = sentinel_cube.find_composites(imagery_directory)
+
+# Keep only band set of user-selected bands (at any resolution, resampling, or crop), if any were selected
+if bands:
+    band_nomenclature = sentinel_ingest.band_set_name(bands.split(';'))
+    band_sets = {k: v for k, v in band_sets.items() if sentinel_composite.band_set_bands(k) == sentinel_composite.band_set_bands(band_nomenclature)} or {band_nomenclature: []}
+
+for band_set, composite_paths in sorted(band_sets.items()):
+    arcpy.AddMessage('Adding {} composites of bands {} to imagery cube'.format(len(composite_paths), band_set))
+    sentinel_cube.update_cube(imagery_directory = imagery_directory, band_set = band_set, composite_paths = composite_paths, messages = arcpy.AddMessage)
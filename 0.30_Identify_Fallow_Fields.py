@@ -4,14 +4,21 @@
 # Name:             Identify_Fallow_Fields.py
 # Author:           Kelly Meehan, USBR
 # Created:          20200501
-# Updated:          20210127 
+# Updated:          20261018
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro 
+# Requires:         ArcGIS Pro; sentinel_manifest.py, sentinel_catalog.py, sentinel_cube.py, field_ndvi.py, field_zones.py, ndvi_store.py, and fallow_rules.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script.
 
-# Description:      This tool calculates the following for each agricultural field: 1) NDVI for each image, 2) delta NDVI between each image, 3) most recent harvest date, and 4) fallow status. There is an assumption imagery is a composited ERDAS IMAGINE raster.
+# Description:      This tool calculates the following for each agricultural field: 1) NDVI for each image, 2) delta NDVI between each image, 3) most recent harvest date, and 4) fallow status. There is an assumption imagery is a composited ERDAS IMAGINE raster (or a Cloud-Optimized GeoTIFF composite, read in its place) named by the 0.2x tools.
+#                   Where a composite has a cloud mask written alongside it by the 0.2x tools (*_cloudmask.tif), each field's cloud fraction is calculated with its NDVI; fields above the maximum
+#                   cloud fraction are left without NDVI (cloudy pixels within clear fields are excluded from their mean), and cloudy field-dates are skipped by delta NDVI, harvest, and fallow rules.
+#                   NDVI is calculated by default with NumPy (field_ndvi.py), reading each image's Red and NIR bands once and reducing them to every field's mean in memory;
+#                   the ArcGIS engine instead runs a single zonal statistics pass for each image, over zones of each field's clear and cloudy pixels, and writes its fields with one update cursor.
+#                   The NumPy engine keeps each field's NDVI by date in a store within the imagery directory (ndvi_store.py), so that a run only calculates NDVI (and only writes NDVI fields)
+#                   for dates new to the store, then re-evaluates harvest dates and fallow status from the whole stored time series. Images can be reduced several at once in worker processes.
+#                   Where an imagery cube (0.27) holds an image as it is now, the NumPy engine reads that date from the cube's chunks (and cloud mask) rather than from the image itself.
 
 ################################################################################################
 ################################################################################################
@@ -29,7 +36,7 @@
 # 0. Set up 
 
 # 0.0 Import necessary packages
-import arcpy, os, glob, pandas, numpy, fnmatch
+import arcpy, os, pandas, numpy, fnmatch, sentinel_manifest, sentinel_cube, field_ndvi, ndvi_store, fallow_rules
 from datetime import datetime, timedelta
 
 #--------------------------------------------
@@ -60,6 +67,19 @@ red_band = arcpy.GetParameterAsText(6)
 # User selects NIR Band
 nir_band = arcpy.GetParameterAsText(7)
 
+# User sets maximum cloud fraction (float between 0 and 1.0; share of field's pixels flagged as opaque cloud or cirrus) above which a field's NDVI is not calculated for an image
+max_cloud_fraction = arcpy.GetParameterAsText(8) or '0.1'
+
+# User selects engine calculating NDVI: NUMPY (each image read once, every field's mean calculated in memory) or ARCPY (zonal statistics per image; defaults to NUMPY)
+ndvi_engine = arcpy.GetParameterAsText(9) or field_ndvi.DEFAULT_NDVI_ENGINE
+
+# User chooses whether to recalculate NDVI of every date rather than only dates missing from NDVI store (NUMPY engine only; defaults to false)
+rebuild_ndvi_store = str(arcpy.GetParameterAsText(10)) == 'true'
+
+# User sets number of images whose NDVI is calculated at once in worker processes (NUMPY engine with GDAL only; defaults to 1, one image after another), and number of images handed to a worker at a time
+ndvi_workers = int(arcpy.GetParameterAsText(11) or field_ndvi.DEFAULT_NDVI_WORKERS)
+ndvi_chunk_size = int(arcpy.GetParameterAsText(12) or field_ndvi.DEFAULT_NDVI_CHUNK_SIZE)
+
 #--------------------------------------------
 
 # 0.2 Set environment settings
@@ -82,16 +102,54 @@ arcpy.CheckOutExtension('Spatial')
 
 # 1. Calculate NDVI
 
-# Create list of all files in Imagery Directory
-file_list = os.listdir()
+# Create list of composite rasters, one per product (a product composited as both ERDAS IMAGINE and Cloud-Optimized GeoTIFF is read from the latter, so that its date is not counted twice),
+# leaving out rasters not named as composites by 0.2x tools (cloud masks, 5.00 mosaics)
+imagery_list = sentinel_cube.list_composites(imagery_directory)
 
-# Assign variable to empty list (to which .img files to be iterated through will be added)
-imagery_list = []
+# Read index of manifests written alongside composites by 0.2x tools, from which sensing date and bands of each composite are taken without opening it
+imagery_index = sentinel_manifest.update_index(imagery_directory)
 
-# Create list of composite rasters
-imagery_list = glob.glob('*.img')
+# Function to rasterise object IDs of agricultural fields (at cell centres, as zonal statistics does) onto snap grid of image, once per coordinate system and cell size, returning zone raster
+
+field_zone_rasters = {}
+
+def field_zone_raster(image):
+    
+    description = arcpy.Describe(image)
+    grid_key = (description.spatialReference.name, description.meanCellWidth)
+    
+    if grid_key not in field_zone_rasters:
+        
+        # Assign variable to zone raster
+        zone_raster = r'in_memory/field_zones_' + str(len(field_zone_rasters))
+        
+        # Check for pre-existing raster and delete
+        if arcpy.Exists(zone_raster):
+            arcpy.Delete_management(in_data = zone_raster)
+        
+        with arcpy.EnvManager(outputCoordinateSystem = image, snapRaster = image, cellSize = image):
+            arcpy.PolygonToRaster_conversion(in_features = ground_truth_feature_class, value_field = arcpy.Describe(ground_truth_feature_class).OIDFieldName, out_rasterdataset = zone_raster, cell_assignment = 'CELL_CENTER', cellsize = description.meanCellWidth)
+        
+        field_zone_rasters[grid_key] = zone_raster
+    
+    return field_zone_rasters[grid_key]
 
-# Function to calculate zonal mean NDVI per agricultural field
+# Function to write values of an image (dictionaries of values by object ID) to attribute table fields of agricultural fields in one pass, replacing any pre-existing fields of the same name
+
+def write_image_fields(field_values):
+    
+    # Check for pre-existing attribute table fields and delete
+    existing_fields = [field.name for field in arcpy.ListFields(ground_truth_feature_class)]
+    for field_name, values in field_values:
+        if field_name in existing_fields:
+            arcpy.DeleteField_management(in_table = ground_truth_feature_class, drop_field = field_name)
+        arcpy.AddField_management(in_table = ground_truth_feature_class, field_name = field_name, field_type = 'DOUBLE')
+    
+    with arcpy.da.UpdateCursor(ground_truth_feature_class, ['OID@'] + [f[0] for f in field_values]) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0]] + [values.get(row[0]) for field_name, values in field_values])
+
+# Function to calculate zonal mean NDVI and cloud fraction per agricultural field, both from a single zonal statistics pass per image
 
 def calculate_ndvi():
 
@@ -100,27 +158,29 @@ def calculate_ndvi():
     
     for i in imagery_list:
         
-        # Extract date from image file name
+        # Extract date from manifest of image, or else from image file name
         image_name = os.path.basename(i) 
         image_name_chunks = image_name.split('_')
-        image_date = image_name_chunks[2]
+        manifest = imagery_index.get(image_name)
+        image_date = (manifest or {}).get('sensing_date') or image_name_chunks[2]
         
-        # Clip image by subset area of interest      
-        outExtractByMask = arcpy.sa.ExtractByMask(in_raster = i, in_mask_data = ground_truth_feature_class)
+        # Skip image whose manifest shows it lacks Red or NIR band
+        if manifest is not None and max(int(red_band), int(nir_band)) > len(manifest['bands']):
+            arcpy.AddWarning('Skipped {}: composite of bands {} has no band {}'.format(image_name, ', '.join(manifest['bands']), max(int(red_band), int(nir_band))))
+            continue
         
-        # Assign variable to clipped image
-        output = r'in_memory\subset_raster_' + image_date
+        # Generate zones of each field's clear and cloudy pixels (object ID x 2, plus 1 where cloud mask flags opaque cloud or cirrus), so that a single zonal statistics pass
+        # yields both each field's mean NDVI over its clear pixels and the counts of its clear and cloudy pixels, from which its cloud fraction is calculated
+        zone_raster = arcpy.sa.Raster(field_zone_raster(i)) * 2
         
-        # Check for pre-existing raster and delete
-        if arcpy.Exists(output):
-            arcpy.Delete_management(in_data = output)
+        # Cloud mask (0 clear, 1 opaque cloud, 2 cirrus) written alongside composite by 0.2x tools, if any
+        cloud_mask = sentinel_cube.composite_cloud_mask(i)
+        if cloud_mask is not None:
+            zone_raster = zone_raster + arcpy.sa.Con(arcpy.sa.Raster(cloud_mask) > 0, 1, 0)
         
-        # Save extracted image to memory        
-        outExtractByMask.save(output)
-       
         # Read in NIR and Red bands
-        nir_raster = arcpy.Raster(output + '\\Band_' + str(nir_band))
-        red_raster = arcpy.Raster(output + '\\Band_' + str(red_band))
+        nir_raster = arcpy.Raster(os.path.join(i, 'Band_' + str(nir_band)))
+        red_raster = arcpy.Raster(os.path.join(i, 'Band_' + str(red_band)))
         
         # Generate two new rasters, the first as the top of the ndvi calculation, the second the bottom
         # NOTE: arcpy.sa.Raster function required to read in layer as a raster object and Float function is used to avoid integer outputs
@@ -130,9 +190,6 @@ def calculate_ndvi():
         # Generate a third raster (in memory) of ndvi (numerator divided by denominator)
         ndvi_output = arcpy.sa.Divide(numerator, denominator)
         
-        # Extract date from file name and append to list
-        date_list.append(image_date)
-        
         # Assign variable to zonal statistics table
         majority_table = r'in_memory/ndvi_' + image_date
     
@@ -140,50 +197,120 @@ def calculate_ndvi():
         if arcpy.Exists(majority_table):
             arcpy.Delete_management(in_data = majority_table)
         
-        # Generat zonal statistics (mean) table
-        arcpy.sa.ZonalStatisticsAsTable(in_zone_data = ground_truth_feature_class, zone_field = 'FIELD_ID', in_value_raster = ndvi_output, out_table = majority_table, statistics_type = 'MEAN')
-
-        # Check for pre-existing attribute table field and delete        
-        if 'ndvi_' + image_date in [field.name for field in arcpy.ListFields(ground_truth_feature_class)]:
-            arcpy.DeleteField_management(in_table = ground_truth_feature_class, drop_field = 'ndvi_' + image_date)
+        # Generate zonal statistics (mean) table of clear and cloudy zones of fields (fields outside image have no zones)
+        arcpy.sa.ZonalStatisticsAsTable(in_zone_data = zone_raster, zone_field = 'Value', in_value_raster = ndvi_output, out_table = majority_table, statistics_type = 'MEAN')
+        zone_field = [field.name for field in arcpy.ListFields(majority_table) if field.name.lower() == 'value'][0]
+        zone_array = arcpy.da.TableToNumPyArray(in_table = majority_table, field_names = [zone_field, 'COUNT', 'MEAN'])
+        
+        # Split zones into object ID of field and cloudy flag, and calculate cloud fraction of each field within image (fields outside cloud mask are treated as clear)
+        object_ids = (zone_array[zone_field] // 2).tolist()
+        cloudy_zones = (zone_array[zone_field] % 2 == 1).tolist()
+        clear_ndvi = {o: float(m) for o, c, m in zip(object_ids, cloudy_zones, zone_array['MEAN']) if not c}
+        pixel_counts = {}
+        cloudy_counts = {}
+        for o, c, n in zip(object_ids, cloudy_zones, zone_array['COUNT']):
+            pixel_counts[o] = pixel_counts.get(o, 0) + int(n)
+            if c:
+                cloudy_counts[o] = int(n)
+        cloud_fraction = {o: cloudy_counts.get(o, 0) / n for o, n in pixel_counts.items()}
+        
+        # Leave fields above maximum cloud fraction without NDVI (cloudy pixels within clear fields are already excluded from their mean), skipping image altogether where every field is
+        cloudy_fields = [o for o, f in cloud_fraction.items() if f > float(max_cloud_fraction)]
+        field_values = []
+        
+        if cloud_mask is not None:
+            if cloud_fraction and len(cloudy_fields) == len(cloud_fraction):
+                arcpy.AddMessage('Skipped {}: every field above maximum cloud fraction of {}'.format(image_name, max_cloud_fraction))
+                write_image_fields([('cloud_' + image_date, cloud_fraction)])
+                continue
             
-        # Join table to area of interest subset
-        arcpy.JoinField_management(in_data = ground_truth_feature_class, in_field = 'FIELD_ID', join_table = majority_table, join_field  = 'FIELD_ID', fields = 'MEAN')
+            if cloudy_fields:
+                arcpy.AddMessage('{}: {} fields above maximum cloud fraction of {} left without NDVI'.format(image_name, len(cloudy_fields), max_cloud_fraction))
+            field_values.append(('cloud_' + image_date, cloud_fraction))
         
-        # Change name of joined attribute table field 
-        arcpy.AlterField_management(in_table = ground_truth_feature_class, field = 'MEAN', new_field_name = 'ndvi_' + image_date, new_field_alias = 'ndvi_' + image_date)
+        for o in cloudy_fields:
+            clear_ndvi.pop(o, None)
         
-        # Check for lingering MEAN attribute table field and delete
-        if 'MEAN' in [field.name for field in arcpy.ListFields(ground_truth_feature_class)]:
-            arcpy.DeleteField_management(in_table = ground_truth_feature_class, drop_field = 'MEAN')
-    
-calculate_ndvi()
-
-#--------------------------------------------------------------------------
+        # Extract date from file name and append to list
+        date_list.append(image_date)
+        
+        # Write NDVI (and cloud fraction) of image to attribute table fields of agricultural fields, by object ID
+        write_image_fields([('ndvi_' + image_date, clear_ndvi)] + field_values)
 
-# 2. Calculate delta NDVI for time periods (excluding first date)
+# Function to calculate mean NDVI per agricultural field with NumPy for dates missing from NDVI store, returning fields x dates matrices of NDVI and cloud fraction of every date from store,
+#   and dates calculated by this run (nothing is written to feature class until section 5)
 
-# Create list of attribute table fields to include in numpy array (ndvi, FIELD_ID, Crop_Type)
-include_fields = [field.name for field in arcpy.ListFields(dataset = ground_truth_feature_class, wild_card = 'ndvi*')]
+def calculate_ndvi_numpy():
+    
+    # Create list of images (with date and cloud mask, if any) from which to calculate NDVI, and of imagery cube dates already listed
+    composites = []
+    cube_files = []
+    
+    for i in imagery_list:
+        
+        # Extract date from manifest of image, or else from image file name
+        image_name = os.path.basename(i)
+        manifest = imagery_index.get(image_name)
+        image_date = (manifest or {}).get('sensing_date') or image_name.split('_')[2]
+        
+        # Skip image whose manifest shows it lacks Red or NIR band
+        if manifest is not None and max(int(red_band), int(nir_band)) > len(manifest['bands']):
+            arcpy.AddWarning('Skipped {}: composite of bands {} has no band {}'.format(image_name, ', '.join(manifest['bands']), max(int(red_band), int(nir_band))))
+            continue
+        
+        # Read image from imagery cube (0.27) where a cube holds it as it is now, a window of chunks at a time, listing each cube date (every image of that date mosaicked) once
+        image_cube_files = sentinel_cube.cube_files_of_composite(os.path.join(imagery_directory, i))
+        if image_cube_files is not None:
+            if image_cube_files[0] not in cube_files:
+                cube_files.append(image_cube_files[0])
+                composites.append((image_cube_files[0], image_date, image_cube_files[1]))
+            continue
+        
+        composites.append((os.path.join(imagery_directory, i), image_date, sentinel_cube.composite_cloud_mask(os.path.join(imagery_directory, i))))
+    
+    store_directory = os.path.join(imagery_directory, ndvi_store.NDVI_STORE_DIRECTORY)
+    return ndvi_store.stored_field_ndvi_matrix(composites = composites, feature_class = ground_truth_feature_class, red_band = red_band, nir_band = nir_band, store_directory = store_directory, max_cloud_fraction = max_cloud_fraction, rebuild = rebuild_ndvi_store, max_workers = ndvi_workers, chunk_size = ndvi_chunk_size, messages = arcpy.AddMessage)
 
-include_fields.insert(0, 'FIELD_ID')
+if ndvi_engine == 'NUMPY':
+    field_ids, ndvi_dates, ndvi_matrix, cloud_matrix, new_ndvi_dates = calculate_ndvi_numpy()
+else:
+    calculate_ndvi()
 
-include_fields.append('Crop_Type')
+#--------------------------------------------------------------------------
 
-# Create numpy array from Training Label Signame Geodatabase Table
-array_ndvi = arcpy.da.TableToNumPyArray(in_table = ground_truth_feature_class, field_names = include_fields)
+# 2. Calculate delta NDVI for time periods (excluding first date)
 
-# Create pandas data frame from numpy array
-df_ndvi = pandas.DataFrame(data = array_ndvi)
+if ndvi_engine == 'NUMPY':
+    
+    # Create pandas data frames from NDVI and cloud fraction matrices (fields x dates), indexed by FIELD_ID, and join Crop_Type of each field
+    df_ndvi = pandas.DataFrame(data = ndvi_matrix, index = pandas.Index(field_ids, name = 'FIELD_ID'), columns = ['ndvi_' + d for d in ndvi_dates])
+    df_cloud = pandas.DataFrame(data = cloud_matrix, index = df_ndvi.index, columns = ['cloud_' + d for d in ndvi_dates]).dropna(axis = 1, how = 'all')
+    df_crop = pandas.DataFrame(data = arcpy.da.TableToNumPyArray(in_table = ground_truth_feature_class, field_names = ['FIELD_ID', 'Crop_Type'])).set_index('FIELD_ID')
+    df_ndvi = df_ndvi.join(df_crop)
 
-# Set FIELD_ID column as index
-df_ndvi.set_index('FIELD_ID', inplace = True)
+else:
+    
+    # Create list of attribute table fields to include in numpy array (ndvi, FIELD_ID, Crop_Type)
+    include_fields = [field.name for field in arcpy.ListFields(dataset = ground_truth_feature_class, wild_card = 'ndvi*')]
+    
+    include_fields.insert(0, 'FIELD_ID')
+    
+    include_fields.append('Crop_Type')
+    
+    # Create numpy array from Training Label Signame Geodatabase Table
+    array_ndvi = arcpy.da.TableToNumPyArray(in_table = ground_truth_feature_class, field_names = include_fields)
+    
+    # Create pandas data frame from numpy array
+    df_ndvi = pandas.DataFrame(data = array_ndvi)
+    
+    # Set FIELD_ID column as index
+    df_ndvi.set_index('FIELD_ID', inplace = True)
 
 # Create copy of NDVI dataframe without Crop_Type
 df_ndvi_no_crop = df_ndvi.loc[:,df_ndvi.columns != 'Crop_Type']
 
-# Calculate delta NDVI 
-df_delta_ndvi = df_ndvi_no_crop.diff(axis = 1)
+# Calculate delta NDVI from each field's previous clear NDVI, leaving cloudy field-dates (without NDVI) without delta NDVI
+df_delta_ndvi = df_ndvi_no_crop.ffill(axis = 1).diff(axis = 1).where(df_ndvi_no_crop.notna())
 
 # Delete first delta NDVI column with no data
 df_delta_ndvi.dropna(axis = 1, how = 'all', inplace = True)
@@ -195,13 +322,8 @@ df_delta_ndvi.columns = [col.replace('ndvi', 'delta') for col in df_delta_ndvi.c
 
 # 3. Identify most recent harvest date
 
-# Function to identify most recent harvest date, using -9999 in lieu NA   
-def get_recent_harvest(v):
-    s = pandas.Series(v < float(harvest_value_threshold))
-    array = s.where(s == True).last_valid_index()
-    return '-9999' if array is None else array[6:]
-
-df_delta_ndvi['Harvest_Date'] = df_delta_ndvi.apply(lambda x: get_recent_harvest(x), axis = 1)
+# Identify most recent harvest date of every field at once (last date whose delta NDVI is below harvest threshold), using -9999 in lieu NA
+df_delta_ndvi['Harvest_Date'] = fallow_rules.recent_harvest_dates(df_delta_ndvi, harvest_value_threshold)
 
 # Join delta NDVI dataframe
 df_ndvi = df_ndvi.join(df_delta_ndvi, how = 'outer')
@@ -241,20 +363,21 @@ columns_ndvi_recent = ['ndvi_' + str(n) for n in dates_recent]
 # Identify columns with delta NDVI dates within fallow analysis timeframe
 columns_delta_recent = ['delta_' + str(c) for c in dates_recent]
 
-# Label fields as fallow if NDVI was less than user defined NDVI fallow threshold for the entirety of the fallow analysis timeframe
+# Label fields as fallow if NDVI was less than user defined NDVI fallow threshold for the entirety of the fallow analysis timeframe (ignoring cloudy field-dates, but requiring at least one clear date)
 
-df_ndvi['Fallow_Status'] = numpy.where((df_ndvi[columns_ndvi_recent] < float(ndvi_fallow_threshold)).all(axis = 1), 'Fallow', 'Not_Fallow')
+df_ndvi_recent = df_ndvi[columns_ndvi_recent]
+df_ndvi['Fallow_Status'] = numpy.where(((df_ndvi_recent < float(ndvi_fallow_threshold)) | df_ndvi_recent.isna()).all(axis = 1) & df_ndvi_recent.notna().any(axis = 1), 'Fallow', 'Not_Fallow')
+
+# Assign variable to most recent clear NDVI of each field
+ultima_ndvi_clear = df_ndvi[columns_ndvi].ffill(axis = 1)[ultima_ndvi]
 
 # Create column with sum values of delta NDVI values within required fallow analysis time range
 df_ndvi['recent_delta_sum'] = df_ndvi[columns_delta_recent].sum(axis=1)
 
 # Override fallow label for those fields: 1) whose sum delta NDVI over the required fallow time range was >= 0.01 and the most recent NDVI was >= 0.10 or 2) that had a recent harvest (within the fallow analysis timeframe) which was not previously captured (i.e. crop type is fallow)
 
-for index, row in df_ndvi.iterrows():
-    if df_ndvi.loc[index, 'recent_delta_sum'] >= 0.01 and df_ndvi.loc[index, ultima_ndvi] >= 0.10:
-        df_ndvi.loc[index, 'Fallow_Status'] = 'Not_Fallow'
-    if df_ndvi.loc[index, 'Harvest_Date'] != '-9999' and int(df_ndvi.loc[index, 'Harvest_Date']) <= date_required_fallow and df_ndvi.loc[index, 'Crop_Type'] == 1403:
-        df_ndvi.loc[index, 'Fallow_Status'] = 'Not_Fallow'   
+not_fallow = fallow_rules.not_fallow_overrides(recent_delta_sum = df_ndvi['recent_delta_sum'], ultima_ndvi_clear = ultima_ndvi_clear, harvest_dates = df_ndvi['Harvest_Date'], crop_types = df_ndvi['Crop_Type'], date_required_fallow = date_required_fallow)
+df_ndvi.loc[not_fallow, 'Fallow_Status'] = 'Not_Fallow'
 
 # Delete column Crop_Type to avoid issues with upcoming merge 
 del df_ndvi['Crop_Type']
@@ -263,11 +386,24 @@ del df_ndvi['Crop_Type']
 
 # 5. Join pandas dataframe to Ground Truth feature class
 
+# Join cloud fraction columns calculated with NumPy engine (ArcGIS engine joined them to feature class as it went)
+if ndvi_engine == 'NUMPY':
+    df_ndvi = df_ndvi.join(df_cloud)
+
 # Create list of all pandas dataframe columns
 columns_all = list(df_ndvi.columns.values)
 
-# Create list of column to join (i.e. exclude NDVI columns as already pre-existing in feature class)
-columns_non_ndvi = [c for c in columns_all if c not in columns_ndvi]
+# Create list of column to join (i.e. exclude NDVI columns as already pre-existing in feature class, unless calculated with NumPy engine, which only writes NDVI and cloud fraction of dates new to NDVI store, or missing from feature class)
+if ndvi_engine == 'NUMPY':
+    existing_fields = [field.name for field in arcpy.ListFields(ground_truth_feature_class)]
+    columns_non_ndvi = [c for c in columns_all if not c.startswith(('ndvi_', 'cloud_')) or c.split('_', 1)[1] in new_ndvi_dates or c not in existing_fields]
+    
+    # Check for pre-existing attribute table fields of columns to join (e.g. NDVI of recalculated dates, delta NDVI, harvest date, and fallow status of an earlier run) and delete
+    stale_fields = [f for f in existing_fields if f in columns_non_ndvi and f != 'FIELD_ID']
+    if stale_fields:
+        arcpy.DeleteField_management(in_table = ground_truth_feature_class, drop_field = stale_fields)
+else:
+    columns_non_ndvi = [c for c in columns_all if c not in columns_ndvi]
 
 # Create copy of NDVI dataframe, keeping only those to join
 df_join = df_ndvi[columns_non_ndvi]
@@ -5,14 +5,15 @@
 # Name:             0.30_Rank_Fields_by_Heterogeneity.py
 # Author:           Kelly Meehan, USBR
 # Created:          20200629
-# Updated:          20200701 
+# Updated:          20261018 
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro and Spatial Analyst Extension
+# Requires:         ArcGIS Pro and Spatial Analyst Extension; field_zones.py and sentinel_cube.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script.
 
 # Description       This tool assigns all fields a rank heterogeneity value, where 1 is the field with the greatest heterogeneity.
+#                   Where Raw Raster is a composite held by an imagery cube (0.27) as it is now, the NUMPY engine reads its bands from the cube's chunks (every composite of its date mosaicked).
 
 #----------------------------------------------------------------------------------------------
 
@@ -25,6 +26,7 @@
 #                           Green Band                      String (Data Type) > Required (Type) > Input (Direction) 
 #                           Red Band                        String (Data Type) > Required (Type) > Input (Direction) 
 #                           NIR Band                        String (Data Type) > Required (Type) > Input (Direction) 
+#                           Zonal Statistics Engine         String (Data Type) > Optional (Type) > Input (Direction) > Value List Filter: NUMPY, ARCPY (Default: NUMPY)
 
 #                       Validation tab:
 
@@ -85,7 +87,7 @@
 # 0. Set-up
 
 # 0.0 Install necessary packages
-import arcpy, os
+import arcpy, os, field_zones, sentinel_cube
 
 #--------------------------------------------
 
@@ -112,6 +114,9 @@ red_layer = arcpy.GetParameterAsText(5)
 # User selects layer corresponding to near infrared layer
 nir_layer = arcpy.GetParameterAsText(6)
 
+# User selects engine calculating standard deviations: grouped reductions over cached zone index of fields (NUMPY) or Zonal Statistics as Table (ARCPY)
+zonal_engine = arcpy.GetParameterAsText(7) or field_zones.DEFAULT_ZONAL_ENGINE
+
 #--------------------------------------------
 
 # 0.2 Set environment settings
@@ -123,7 +128,7 @@ arcpy.env.overwriteOutput = True
 
 # 1. Calculate for each field the standard deviation for the blue, green, red, and nir bands 
 
-def calculate_band_standard_deviation(feature_class, raster, blue, green, red, nir):
+def calculate_band_standard_deviation(feature_class, raster, blue, green, red, nir, engine = field_zones.DEFAULT_ZONAL_ENGINE):
     
     # Create dictionary with key, value pair: names of bands, raster layer 
     
@@ -134,22 +139,44 @@ def calculate_band_standard_deviation(feature_class, raster, blue, green, red, n
     # Iterate through dictionary and calculate for each field, the standard deviation for each band
     
     sd_fields_list = []
-    for key, value in layer_dict.items():
-        layer = os.path.join(raster, value)
-        arcpy.AddMessage('Layer: ' + layer)
-        sd_table_name = key + '_sd_table'
-        sd_table = os.path.join(project_geodatabase, sd_table_name)
-        arcpy.sa.ZonalStatisticsAsTable(in_zone_data = feature_class, zone_field = 'FIELD_ID', in_value_raster = layer, out_table = sd_table, statistics_type = 'STD')
+    
+    # Read zone index of fields on snap grid of raster (rasterised once per grid and cached beside geodatabase), and reduce each band to per-field standard deviations over it,
+    # reading bands from imagery cube where one holds raster as it is now
+    
+    if engine == 'NUMPY':
+        zone_cache = field_zones.FieldZoneCache(feature_class = feature_class, messages = arcpy.AddMessage)
+        cube_files = sentinel_cube.cube_files_of_composite(raster)
+        if cube_files is not None:
+            arcpy.AddMessage('Reading bands of {} from imagery cube: {}'.format(os.path.basename(raster), cube_files[0]))
+        raster_bands = field_zones.RasterBands(raster if cube_files is None else cube_files[0])
+        zone_index = zone_cache.zone_index(raster_bands)
+        
+        for key, value in layer_dict.items():
+            arcpy.AddMessage('Layer: ' + os.path.join(raster, value))
+            new_sd_field = key + '_sd'
+            sd_values = field_zones.zonal_statistics(zone_index = zone_index, raster = raster_bands, band = field_zones.band_number(value), statistics_type = 'STD')
+            field_zones.write_field_values(feature_class = feature_class, zone_index = zone_index, field_name = new_sd_field, values = sd_values)
+            sd_fields_list.append(new_sd_field)
+        
+        raster_bands.close()
+    
+    else:
+        for key, value in layer_dict.items():
+            layer = os.path.join(raster, value)
+            arcpy.AddMessage('Layer: ' + layer)
+            sd_table_name = key + '_sd_table'
+            sd_table = os.path.join(project_geodatabase, sd_table_name)
+            arcpy.sa.ZonalStatisticsAsTable(in_zone_data = feature_class, zone_field = 'FIELD_ID', in_value_raster = layer, out_table = sd_table, statistics_type = 'STD')
         
-        # Join standard deviation values to Field Borders Feature Class
+            # Join standard deviation values to Field Borders Feature Class
         
-        arcpy.JoinField_management(in_data = feature_class, in_field = 'FIELD_ID', join_table = sd_table, join_field = 'FIELD_ID', fields = 'STD')
-        new_sd_field = key + '_sd'
-        sd_fields_list.append(new_sd_field)
-        if arcpy.ListFields(dataset = field_borders_feature_class, wild_card = new_sd_field):
-            arcpy.DeleteField_management(in_table = feature_class, drop_field = new_sd_field)
-        arcpy.AlterField_management(in_table = feature_class, field = 'STD', new_field_name = new_sd_field, new_field_alias = new_sd_field)  
-        arcpy.DeleteField_management(in_table = feature_class, drop_field = 'STD')
+            arcpy.JoinField_management(in_data = feature_class, in_field = 'FIELD_ID', join_table = sd_table, join_field = 'FIELD_ID', fields = 'STD')
+            new_sd_field = key + '_sd'
+            sd_fields_list.append(new_sd_field)
+            if arcpy.ListFields(dataset = field_borders_feature_class, wild_card = new_sd_field):
+                arcpy.DeleteField_management(in_table = feature_class, drop_field = new_sd_field)
+            arcpy.AlterField_management(in_table = feature_class, field = 'STD', new_field_name = new_sd_field, new_field_alias = new_sd_field)  
+            arcpy.DeleteField_management(in_table = feature_class, drop_field = 'STD')
 
         
     # Generate field calculating sum of blue, green, red, and nir standard deviation values
@@ -196,7 +223,7 @@ def calculate_heterogeneity(features): # Adapted from: https://arcpy.wordpress.c
 
 if __name__ == '__main__':
     
-    calculate_band_standard_deviation(feature_class = field_borders_feature_class, raster = raw_raster, blue = blue_layer, green = green_layer, red = red_layer, nir = nir_layer)
+    calculate_band_standard_deviation(feature_class = field_borders_feature_class, raster = raw_raster, blue = blue_layer, green = green_layer, red = red_layer, nir = nir_layer, engine = zonal_engine)
     
     calculate_heterogeneity(features = field_borders_feature_class)
     
@@ -5,15 +5,16 @@
 # Name:             0.50_Reshape_Field_Borders.py
 # Author:           Kelly Meehan, USBR
 # Created:          20181212
-# Updated:          20200521 
+# Updated:          20261018 
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro 
+# Requires:         ArcGIS Pro; field_zones.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script.
 
 # Description:      This tool allows a user to use selected features within a Reshape Fields feature class to update the geometries of two sets of feature classes, each with differing unique IDs (i.e. earlier and later FIELD_IDs). 
 #                   User should have a Reshaped Fields feature class with the following attribute table fields complete: earlier_field_id, later_field_id, and REGION
+#                   Cached zone indexes of each reshaped feature class (see field_zones.py) are deleted, so that zonal statistics tools rasterise its new borders.
                     
 #----------------------------------------------------------------------------------------------
  
@@ -39,7 +40,7 @@
 # 0. Set-up
 
 # 0.0 Install necessary packages
-import arcpy
+import arcpy, field_zones
 
 # 0.1 Read in tool parameters
 
@@ -100,6 +101,9 @@ def update_earlier_feature_classes():
             # Update ACRES in attribute table for Earlier Feature Class
             arcpy.CalculateField_management(in_table = i, field = 'ACRES', expression = '!shape.area@ACRES!', expression_type = 'PYTHON3')
             arcpy.AddMessage('Updated ACRES in Earlier Feature Class: ' + str(i))
+            
+            # Delete cached zone indexes of Earlier Feature Class rasterised from its former borders
+            field_zones.invalidate(feature_class = i, messages = arcpy.AddMessage)
     else:
         arcpy.AddMessage('No Earlier Feature Classes inputted.')
         
@@ -144,6 +148,9 @@ def update_later_feature_classes():
             # Update ACRES in attribute table for Later Feature Class
             arcpy.CalculateField_management(in_table = k, field = 'ACRES', expression = '!shape.area@ACRES!', expression_type = 'PYTHON3')
             arcpy.AddMessage('Updated ACRES in Later Feature Class: ' + str(k))
+            
+            # Delete cached zone indexes of Later Feature Class rasterised from its former borders
+            field_zones.invalidate(feature_class = k, messages = arcpy.AddMessage)
     else:
         arcpy.AddMessage('No Later Feature Classes inputted.')
     
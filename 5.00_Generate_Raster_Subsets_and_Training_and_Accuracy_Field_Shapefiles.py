@@ -5,14 +5,19 @@
 # Name:             5.00_Generate_Raster_Subsets_and _Training_and_Accuracy_Field_Shapefiles.py
 # Author:           Kelly Meehan, USBR
 # Created:          20190724
-# Updated:          20200701 
+# Updated:          20261018
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro 
+# Requires:         ArcGIS Pro; raster_mosaic.py, reprojection_cache.py, sentinel_cube.py, sentinel_composite.py, sentinel_safe.py, sentinel_manifest.py, and sentinel_catalog.py (in same directory as this script), and GDAL Python bindings (osgeo), optional, for mosaicking block by block or writing a virtual mosaic 
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script.
 
 # Description:      This tool generates shapefile and raster subsets of a field border shapefile and satellite image(s), respectively.  
+#                   Images are reprojected onto the field borders' coordinate system only once, kept in a cache keyed by their content and how they were reprojected.
+#                   Several images are mosaicked in priority order into a new raster (or a virtual mosaic referencing them), leaving the images themselves untouched.
+#                   Where the images are composites of a single date in the field borders' coordinate system, held as they are now by an imagery cube (0.27) that contains the field borders,
+#                   the AOI subset is written from the cube's window over the field borders instead (only the chunks overlapping it are read), and the other subsets are extracted from it;
+#                   neither reprojection nor mosaicking is needed, as the cube's array of that date already mosaics every composite of the date (the first valid pixel, in the cube's order, winning).
 
 #----------------------------------------------------------------------------------------------
 
@@ -23,6 +28,10 @@
 #                           Raw Image(s) (priority order)   Raster Dataset-Multivalue (Data Type) > Required (Type) > Input (Direction)                  
 #                           Image Directory                 Workspace (Data Type) > Required (Type) > Input (Direction)                    
 #                           Shapefile Directory             Workspace (Data Type) > Required (Type) > Input (Direction)                    
+#                           Mosaic Format                   String (Data Type) > Optional (Type) > Input (Direction) > Value List of IMG, VRT (Filter) > Default IMG
+#                           Resampling Method               String (Data Type) > Optional (Type) > Input (Direction) > Value List of NEAREST, BILINEAR, CUBIC, MAJORITY (Filter) > Default NEAREST
+#                           Reprojection Workers            Long (Data Type) > Optional (Type) > Input (Direction) > Default 1
+#                           Reprojection Cache Quota MB     Long (Data Type) > Optional (Type) > Input (Direction) > Default 20480
 #
 #                       Validation tab:
 #
@@ -82,7 +91,7 @@
 # 0. Set up
  
 # 0.0 Import necessary packages 
-import arcpy, os, sys
+import arcpy, os, sys, raster_mosaic, reprojection_cache, sentinel_cube, sentinel_manifest
 from arcpy.sa import ExtractByMask
 
 #--------------------------------------------
@@ -101,6 +110,18 @@ img_path = arcpy.GetParameterAsText(2)
 # User selects Coverage Directory
 covs_path = arcpy.GetParameterAsText(3)
 
+# User selects format of mosaic of several images: ERDAS IMAGINE raster (IMG) or virtual mosaic referencing images without copying them (VRT, requires GDAL Python bindings and no raster needing reprojection; defaults to IMG)
+mosaic_format = arcpy.GetParameterAsText(4) or raster_mosaic.DEFAULT_MOSAIC_FORMAT
+
+# User selects method of resampling rasters reprojected onto coordinate system of Edited Field Borders Shapefile (defaults to NEAREST)
+resampling_method = arcpy.GetParameterAsText(5) or reprojection_cache.DEFAULT_RESAMPLING
+
+# User specifies number of rasters reprojected at once, each in its own worker process (requires GDAL Python bindings; defaults to 1)
+reprojection_workers = int(arcpy.GetParameterAsText(6) or reprojection_cache.DEFAULT_REPROJECT_WORKERS)
+
+# User specifies disk quota, in megabytes, of cache of reprojected rasters, beyond which those used least recently are deleted (defaults to 20480)
+reprojection_cache_quota_mb = int(arcpy.GetParameterAsText(7) or reprojection_cache.DEFAULT_CACHE_QUOTA_MB)
+
 #--------------------------------------------
 
 # 0.2 Set environment settings
@@ -157,36 +178,77 @@ arcpy.AddMessage('Generated Training Fields Mask: ' + str(training_fields_mask)
 
 # 3. Reproject rasters 
 
-# Assign variable to name of spatial reference of Edited Field Borders Shapefile
-borders_spatial_reference = arcpy.Describe(edited_field_borders_shapefile).spatialReference.name
+# Assign variable to name (and EPSG code) of spatial reference of Edited Field Borders Shapefile
+borders_describe_spatial_reference = arcpy.Describe(edited_field_borders_shapefile).spatialReference
+borders_spatial_reference = borders_describe_spatial_reference.name
+borders_epsg = borders_describe_spatial_reference.factoryCode
 
 arcpy.AddMessage('Edited Field Borders Shapefile has a projection of: ' + borders_spatial_reference)
 
-# Create a list (used for mosaicing in next step) originally comprised of raw rasters that are replaced if necessary with reprojected ones 
-raster_list = raw_raster_list
+# Create a list (used for mosaicing in next step) originally comprised of raw rasters that are replaced if necessary with reprojected ones (a copy, so that raw rasters remain listed to name mosaic by)
+raster_list = list(raw_raster_list)
+
+# Create list of rasters whose projection differs from that of Edited Field Borders Shapefile
+rasters_to_reproject = []
 
 for (i, raster) in enumerate(raster_list):
-    arcpy.AddMessage(raster + ' has a projection of: ' + arcpy.Describe(raster).spatialReference.name)
     
-    # If the raster has a projection other than that of Edited Field Borders Shapefile, replace itself with a reprojected version 
-    if arcpy.Describe(raster).spatialReference.name != borders_spatial_reference:
-        arcpy.AddMessage('Projection of ' + raster + ' does not match that of Edited Field Borders Shapefile; reprojecting.')
-        reprojected_raster = os.path.splitext(raster)[0] + '_' + borders_spatial_reference + '.img'
-        
-        # Check if pre-existing raster exists and delete if so
-        if arcpy.Exists(reprojected_raster):
-            arcpy.Delete_management(in_data = reprojected_raster)
-            arcpy.AddMessage('Deleted pre-existing reprojected raster: ' + reprojected_raster)
-        
-        # Reproject raster
-        arcpy.ProjectRaster_management(in_raster = raster, out_raster = reprojected_raster, out_coor_system = edited_field_borders_shapefile)
-        arcpy.AddMessage('Generated: ' + reprojected_raster)
-        
-        # Replace original raster with that of reprojected raster
-        raster_list[i] = reprojected_raster
+    # Compare EPSG code recorded in manifest written alongside composite by 0.2x tools, if any, rather than describing raster
+    manifest = sentinel_manifest.read_manifest(raster)
+    if manifest is not None and manifest['crs']['epsg'] is not None and borders_epsg:
+        arcpy.AddMessage(raster + ' has a projection of: EPSG ' + str(manifest['crs']['epsg']))
+        projection_differs = manifest['crs']['epsg'] != borders_epsg
+    else:
+        raster_spatial_reference = arcpy.Describe(raster).spatialReference.name
+        arcpy.AddMessage(raster + ' has a projection of: ' + raster_spatial_reference)
+        projection_differs = raster_spatial_reference != borders_spatial_reference
     
+    if projection_differs:
+        arcpy.AddMessage('Projection of ' + raster + ' does not match that of Edited Field Borders Shapefile; reprojecting.')
+        rasters_to_reproject.append(i)
     else:
         arcpy.AddMessage(raster + ' projection matches that of Edited Field Border Shapefile; reprojection not necessary.')
+
+# Read rasters from imagery cube (0.27) where none needs reprojecting and they are all composites of one date held by the cube as they are now, and cube contains Edited Field Borders Shapefile
+cube = None
+cube_files = [sentinel_cube.cube_files_of_composite(r) for r in raster_list]
+if not rasters_to_reproject and None not in cube_files and len(set(f[0] for f in cube_files)) == 1:
+    candidate_cube, cube_date, cube_mask = sentinel_cube.open_cube_file(cube_files[0][0])
+    cube_extent = arcpy.Extent(candidate_cube.geotransform[0], candidate_cube.geotransform[3] + candidate_cube.y_size * candidate_cube.geotransform[5], candidate_cube.geotransform[0] + candidate_cube.x_size * candidate_cube.geotransform[1], candidate_cube.geotransform[3])
+    if cube_extent.contains(arcpy.Describe(edited_field_borders_shapefile).extent):
+        cube = candidate_cube
+        arcpy.AddMessage('Reading raster(s) from imagery cube: ' + cube_files[0][0] + '; reprojection and mosaicking not necessary.')
+    else:
+        candidate_cube.close()
+
+# Replace rasters with a projection other than that of Edited Field Borders Shapefile with reprojected versions, taken from reprojection cache where the same raster was already reprojected the same way
+if rasters_to_reproject:
+    
+    # Identify coordinate system of Edited Field Borders Shapefile by EPSG code where it has one, otherwise by its well-known text
+    target_crs = 'EPSG:' + str(borders_epsg) if borders_epsg else borders_describe_spatial_reference.exportToString().split(';')[0]
+    
+    # Snap reprojected rasters to grid of cell size of first (priority) raster already in coordinate system of Edited Field Borders Shapefile, so that they can be mosaicked together;
+    #   where every raster is reprojected, take cell size of first raster only if its coordinate system shares linear unit with that of Edited Field Borders Shapefile (a cell size in degrees, or in feet,
+    #   is not one in meters), and otherwise leave cell size of each reprojected raster to GDAL (or ArcGIS)
+    snap_cell_size = None
+    snap_rasters = [r for (i, r) in enumerate(raster_list) if i not in rasters_to_reproject]
+    if snap_rasters:
+        snap_source = snap_rasters[0]
+    else:
+        priority_spatial_reference = arcpy.Describe(raster_list[0]).spatialReference
+        shares_linear_unit = priority_spatial_reference.type == 'Projected' and borders_describe_spatial_reference.type == 'Projected' and priority_spatial_reference.linearUnitName == borders_describe_spatial_reference.linearUnitName
+        snap_source = raster_list[0] if shares_linear_unit else None
+    
+    if snap_source is not None:
+        snap_manifest = sentinel_manifest.read_manifest(snap_source)
+        snap_cell_size = snap_manifest['resolution'] if snap_manifest is not None else arcpy.Describe(snap_source).meanCellWidth
+    else:
+        arcpy.AddMessage('Coordinate system of ' + raster_list[0] + ' does not share linear unit with that of Edited Field Borders Shapefile; leaving cell size of reprojected rasters unsnapped.')
+    
+    reprojected_rasters = reprojection_cache.reproject_rasters(raster_paths = [raster_list[i] for i in rasters_to_reproject], target_crs = target_crs, cache_directory = os.path.join(img_path, reprojection_cache.CACHE_DIRECTORY), resampling = resampling_method, cell_size = snap_cell_size, max_workers = reprojection_workers, quota_mb = reprojection_cache_quota_mb, messages = arcpy.AddMessage)
+    
+    for i, reprojected_raster in zip(rasters_to_reproject, reprojected_rasters):
+        raster_list[i] = reprojected_raster
         
 #--------------------------------------------------------------------------
 
@@ -194,67 +256,55 @@ for (i, raster) in enumerate(raster_list):
 
 arcpy.env.snapRaster = raster_list[0]
 
-# If there is more than one passed through GUI by user in Raw Image(s) multi-value parameter:
-if len(raster_list) > 1:
+# If there is more than one passed through GUI by user in Raw Image(s) multi-value parameter (and they are not read from imagery cube, whose date already mosaics them):
+if cube is None and len(raster_list) > 1:
 
-    # Set Mosaiced Raw Image(s) name and path 
-    mosaic_raster_name = os.path.splitext(raster_list[0])[0] + '_mosaic.img'
-    mosaic_raster = os.path.join(img_path, mosaic_raster_name) 
+    # Virtual mosaic can only be written where GDAL is available
+    if mosaic_format == 'VRT' and raster_mosaic.gdal is None:
+        arcpy.AddWarning('GDAL Python bindings (osgeo) are not available, mosaic will be written as ERDAS IMAGINE (.img) instead of a virtual mosaic')
+        mosaic_format = 'IMG'
 
-    # Check for previously existing mosaic raster and delete if so as cannot be overwritten even with overwrite set to True
-    
-    if arcpy.Exists(mosaic_raster):
-        arcpy.Delete_management(in_data = mosaic_raster)
-        arcpy.AddMessage('Deleted pre-existing mosaic raster')
+    # Virtual mosaic would reference reprojected rasters within reprojection cache, which may evict them, so reprojected rasters are always mosaicked into a new raster
+    if mosaic_format == 'VRT' and rasters_to_reproject:
+        arcpy.AddWarning('Some rasters were reprojected, mosaic will be written as ERDAS IMAGINE (.img) instead of a virtual mosaic referencing reprojection cache')
+        mosaic_format = 'IMG'
 
-    # Check that all rasters to be mosaiced have same no data value
-    
-    # Create list comprehension of no data value of reprojected rasters
-    no_data_list = [arcpy.Raster(b).noDataValue for b in raster_list]
-    
-    # If all no data values match, assign variable to this consistent no data value
-    if len(set(no_data_list)) == 1:
-        no_data_value = no_data_list[0]
-        
-        # Mosaic rasters if there is more than one
-        arcpy.Mosaic_management(inputs = raster_list, target = raster_list[0], mosaic_type = 'FIRST', colormap = 'FIRST', nodata_value = no_data_value)
-    
-        # Try to rename first input raster as this is the file all others have been mosaiced to
-        try:
-            arcpy.Rename_management(in_data = raster_list[0], out_data = mosaic_raster_name)
-        
-        # If an exception is raised (ExecuteError: ERROR 000012: *mosaic.img already exists), and first input raster cannot be renamed, execute the following
-        except Exception:
-            
-            arcpy.AddWarning('Cannot rename first input raster which is now a mosaic. After tool has completed running, please manually rename ' + raster_list[0] + ' to ' + mosaic_raster)
-            
-            for a in raster_list[1:]:
-                
-                # Keep first input raster so user can manually rename it; delete all other reprojected rasters
-                arcpy.Delete_management(in_data = a)
-                arcpy.AddMessage('Deleted intermediary raster: ' + a)
-                
-            # Assign variable to first input raster so that it is used as base for subsequent subsets
-            raster = raster_list[0]
-        
-        # If an exception is not raised, execute the following
+    # Set Mosaiced Raw Image(s) name (after first raw raster, never a reprojected raster in reprojection cache) and path within Image Directory
+    mosaic_raster_name = os.path.splitext(os.path.basename(raw_raster_list[0]))[0] + '_mosaic' + ('.vrt' if mosaic_format == 'VRT' else '.img')
+    mosaic_raster = os.path.join(img_path, mosaic_raster_name) 
+
+    # Mosaic rasters with GDAL into a new raster (or virtual mosaic), block by block in priority order, mapping no data value of each raster onto that of the first; input rasters are never altered or deleted, so a rerun finds them intact
+    if raster_mosaic.gdal is not None:
+        if mosaic_format == 'VRT':
+            raster_mosaic.write_virtual_mosaic(raster_paths = raster_list, mosaic_raster = mosaic_raster, messages = arcpy.AddMessage)
         else:
-            arcpy.AddMessage('Generated new mosaic raster: ' + mosaic_raster_name)
-            
-            for r in raster_list:
-                
-                # Delete all intermediary rasters
-                arcpy.Delete_management(in_data = r)
-                arcpy.AddMessage('Deleted intermediary raster: ' + r)
-                
-        # Assign variable to mosaic raster
-        raster = mosaic_raster 
-    
+            raster_mosaic.write_mosaic(raster_paths = raster_list, mosaic_raster = mosaic_raster, messages = arcpy.AddMessage)
+
+    # Otherwise mosaic rasters with ArcGIS into a new raster, which requires all rasters to share a no data value
     else:
-        arcpy.AddError('No data values for input rasters were not consistent, please examine no data values of input rasters to ensure consistency before mosaicing')
-        sys.exit(0)   
+
+        # Create list comprehension of no data value of reprojected rasters
+        no_data_list = [arcpy.Raster(b).noDataValue for b in raster_list]
+
+        if len(set(no_data_list)) != 1:
+            arcpy.AddError('No data values for input rasters were not consistent, please examine no data values of input rasters to ensure consistency before mosaicing')
+            sys.exit(0)
+
+        # Check for previously existing mosaic raster and delete if so as cannot be overwritten even with overwrite set to True
+        if arcpy.Exists(mosaic_raster):
+            arcpy.Delete_management(in_data = mosaic_raster)
+            arcpy.AddMessage('Deleted pre-existing mosaic raster')
+
+        # Mosaic rasters into a new raster with pixel type and number of bands of first raster
+        pixel_types = {'U8': '8_BIT_UNSIGNED', 'S8': '8_BIT_SIGNED', 'U16': '16_BIT_UNSIGNED', 'S16': '16_BIT_SIGNED', 'U32': '32_BIT_UNSIGNED', 'S32': '32_BIT_SIGNED', 'F32': '32_BIT_FLOAT', 'F64': '64_BIT'}
+        first_raster = arcpy.Raster(raster_list[0])
+        arcpy.MosaicToNewRaster_management(input_rasters = raster_list, output_location = os.path.dirname(mosaic_raster), raster_dataset_name_with_extension = os.path.basename(mosaic_raster), pixel_type = pixel_types[first_raster.pixelType], number_of_bands = first_raster.bandCount, mosaic_method = 'FIRST', mosaic_colormap_mode = 'FIRST')
+        arcpy.AddMessage('Generated new mosaic raster: ' + mosaic_raster)
+
+    # Assign variable to mosaic raster
+    raster = mosaic_raster 
     
-# If user only passes one raster, assign variable to the reprojected raster so that it is used as base for subsequent subsets 
+# If user only passes one raster (or rasters are read from imagery cube), assign variable to the reprojected raster so that it is used as base for subsequent subsets (or snapped to) 
 else: 
     raster = raster_list[0] 
     
@@ -274,8 +324,15 @@ arcpy.MinimumBoundingGeometry_management(in_features = edited_field_borders_shap
 describe_box = arcpy.Describe(bounding_box)
 extent_box = describe_box.extent
 
-describe_raster = arcpy.Describe(raster)
-extent_raster = describe_raster.extent
+# Take extent of raster from imagery cube, if read from one, or from its manifest (written alongside composites by 0.2x tools), if any, rather than describing raster
+manifest = sentinel_manifest.read_manifest(raster)
+if cube is not None:
+    extent_raster = cube_extent
+elif manifest is not None:
+    extent_raster = arcpy.Extent(manifest['extent']['xmin'], manifest['extent']['ymin'], manifest['extent']['xmax'], manifest['extent']['ymax'])
+else:
+    describe_raster = arcpy.Describe(raster)
+    extent_raster = describe_raster.extent
 
 box_contains_raster = extent_raster.contains(extent_box)
 
@@ -285,11 +342,24 @@ if box_contains_raster == True:
     # Set path name and file name for AOI Subset Raster
     aoi_subset = os.path.join(img_path, region_and_time + '_AOI_subset.img')
     
-    # Create AOI Subset Raster   
-    arcpy.env.mask = bounding_box
-    out_aoi_raster = ExtractByMask(in_raster = raster, in_mask_data = bounding_box)
-    out_aoi_raster.save(aoi_subset)    
-    del out_aoi_raster
+    # Create AOI Subset Raster from window of imagery cube over bounding box, if rasters are read from one, and extract remaining subsets from it
+    if cube is not None:
+        x, y, columns, rows = cube.extent_window(extent_box.XMin, extent_box.YMin, extent_box.XMax, extent_box.YMax)
+        window_geotransform = cube.window_geotransform(x, y)
+        out_aoi_raster = arcpy.NumPyArrayToRaster(in_array = cube.window(cube_date, x = x, y = y, columns = columns, rows = rows), lower_left_corner = arcpy.Point(window_geotransform[0], window_geotransform[3] + rows * window_geotransform[5]), x_cell_size = window_geotransform[1], y_cell_size = -window_geotransform[5], value_to_nodata = cube.nodata)
+        out_aoi_raster.save(aoi_subset)
+        del out_aoi_raster
+        cube.close()
+        arcpy.DefineProjection_management(in_dataset = aoi_subset, coor_system = borders_describe_spatial_reference)
+        raster = aoi_subset
+        arcpy.env.snapRaster = raster
+
+    # Otherwise create AOI Subset Raster by extracting it from raster
+    else:
+        arcpy.env.mask = bounding_box
+        out_aoi_raster = ExtractByMask(in_raster = raster, in_mask_data = bounding_box)
+        out_aoi_raster.save(aoi_subset)    
+        del out_aoi_raster
     
     arcpy.AddMessage('Generated AOI Subset Raster: ' + aoi_subset)
 
@@ -5,10 +5,10 @@
 # Name:             7.50_Recode_through_BadLabel.py
 # Author:           Kelly Meehan, USBR
 # Created:          20180618
-# Updated:          20200825 
+# Updated:          20261018 
 # Version:          Created using Python 3.6.8 
 
-# Requires:         ArcGIS Pro 
+# Requires:         ArcGIS Pro; field_zones.py (in same directory as this script)
 
 # Notes:            This script is intended to be used for a Script Tool within ArcGIS Pro; it is not intended as a stand-alone script.
 
@@ -27,6 +27,7 @@
 #                           Documents Directory             Workspace (Data Type) > Required (Type) > Input (Direction)                    
 #                           Geodatabase                     Workspace (Data Type) > Required (Type) > Input (Direction)
 #                           Iteration Number                String (Data Type) > Required (Type) > Input (Direction)
+#                           Zonal Statistics Engine         String (Data Type) > Optional (Type) > Input (Direction) > Value List Filter: NUMPY, ARCPY (Default: NUMPY)
 #
 #                       Validation tab:
 #
@@ -128,7 +129,7 @@
 
 # 0.0 Install necessary packages
 
-import arcpy, os, pandas, re, sys, psutil, time
+import arcpy, os, pandas, re, sys, psutil, time, field_zones
 from arcpy.sa import RemapValue, Reclassify, ZonalStatisticsAsTable, TabulateArea 
 
 #--------------------------------------------
@@ -156,6 +157,9 @@ gdb_path = arcpy.GetParameterAsText(5)
 # User selects two digit classification iteration number
 iteration_number = arcpy.GetParameterAsText(6)
 
+# User selects engine calculating majority of each field: grouped reduction over cached zone index of fields (NUMPY) or Zonal Statistics as Table (ARCPY)
+zonal_engine = arcpy.GetParameterAsText(7) or field_zones.DEFAULT_ZONAL_ENGINE
+
 #--------------------------------------------
 
 # 0.2 Set environment settings
@@ -249,15 +253,16 @@ del out_reclassify
 
 # 6. In Edited Field Borders Shapefile attribute table field, MAJORITY, assign each field a classification value based on what the majority of pixels were assigned to  
 
-# Create Zonal Statistics Majority Table 
+# Create Zonal Statistics Majority Table (ARCPY engine only)
 
 edited_field_borders_shapefile_name = os.path.basename(edited_field_borders_shapefile)
 majority_table_name = region_and_time_caps + '_majority_' + iteration_number + '.dbf'
 majority_table = os.path.join(docs_path, majority_table_name)
 
-ZonalStatisticsAsTable(in_zone_data = edited_field_borders_shapefile, zone_field = 'FIELD_ID', in_value_raster = reclassified_raster, out_table = majority_table, ignore_nodata = 'DATA', statistics_type = 'MAJORITY')
+if zonal_engine == 'ARCPY':
+    ZonalStatisticsAsTable(in_zone_data = edited_field_borders_shapefile, zone_field = 'FIELD_ID', in_value_raster = reclassified_raster, out_table = majority_table, ignore_nodata = 'DATA', statistics_type = 'MAJORITY')
 
-arcpy.AddMessage('Generated Zonal Statistics Majority Table: ' + majority_table)
+    arcpy.AddMessage('Generated Zonal Statistics Majority Table: ' + majority_table)
 
 # Delete attribute table fields: MAJORITY or MAJORITY** (where ** corresponds to this iteration) in case user needs to re-run this same iteration
 
@@ -269,9 +274,23 @@ for d in delete_fields_list:
 
 # Join the majority values from the output table of Zonal Statistics as Table to the Edited Field Borders Shapefile
 
-arcpy.JoinField_management(in_data = edited_field_borders_shapefile, in_field = 'FIELD_ID', join_table = majority_table, join_field  = 'FIELD_ID', fields = 'MAJORITY')
+if zonal_engine == 'ARCPY':
+    arcpy.JoinField_management(in_data = edited_field_borders_shapefile, in_field = 'FIELD_ID', join_table = majority_table, join_field  = 'FIELD_ID', fields = 'MAJORITY')
+
+    arcpy.AddMessage('Joined MAJORITY field from Zonal Statistics Table to Edited Field Borders Shapefile') 
+
+# Otherwise calculate majority of each field from zone index of Edited Field Borders Shapefile on snap grid of Reclassified Raster (rasterised once per grid and cached beside shapefile), and write it to MAJORITY
+
+else:
+    zone_cache = field_zones.FieldZoneCache(feature_class = edited_field_borders_shapefile, messages = arcpy.AddMessage)
+    reclassified_bands = field_zones.RasterBands(reclassified_raster)
+    zone_index = zone_cache.zone_index(reclassified_bands)
+    majority_values = field_zones.zonal_statistics(zone_index = zone_index, raster = reclassified_bands, band = 1, statistics_type = 'MAJORITY')
+    reclassified_bands.close()
+
+    field_zones.write_field_values(feature_class = edited_field_borders_shapefile, zone_index = zone_index, field_name = 'MAJORITY', values = majority_values, field_type = 'LONG')
 
-arcpy.AddMessage('Joined MAJORITY field from Zonal Statistics Table to Edited Field Borders Shapefile') 
+    arcpy.AddMessage('Calculated MAJORITY field of Edited Field Borders Shapefile from its zone index') 
 
 #----------------------------------------------------------------------------------------------
 
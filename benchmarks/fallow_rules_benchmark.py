@@ -0,0 +1,145 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             fallow_rules_benchmark.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; pandas; fallow_rules.py (in parent directory of this script)
+
+# Notes:            This script is run stand-alone (e.g. python benchmarks/fallow_rules_benchmark.py --fields 100000 --dates 20); it is not a Script Tool.
+
+# Description:      This script compares the harvest and fallow rules of 0.30 as they were applied field by field (DataFrame.apply building a pandas Series per field, and a DataFrame.iterrows loop
+#                   of scalar overrides) with their whole-array form (fallow_rules.py), on a synthetic fields x dates matrix of NDVI with cloudy field-dates left without NDVI.
+#                   Both are timed, and the script fails unless harvest dates and fallow status are identical.
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Generate synthetic NDVI and delta NDVI
+# 2. Time row-wise rules
+# 3. Time whole-array rules
+# 4. Compare and report
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, sys, time, argparse, numpy, pandas
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fallow_rules
+
+# 0.1 Read in arguments
+parser = argparse.ArgumentParser(description = 'Compare row-wise and whole-array harvest and fallow rules of 0.30 on synthetic NDVI')
+parser.add_argument('--fields', type = int, default = 20000, help = 'number of agricultural fields')
+parser.add_argument('--dates', type = int, default = 12, help = 'number of imagery dates (every 5 days from 1 March 2020; more than 7, so that first date precedes fallow analysis timeframe, as 0.30 requires)')
+parser.add_argument('--cloudy', type = float, default = 0.1, help = 'share of field-dates left without NDVI as cloudy')
+parser.add_argument('--seed', type = int, default = 0)
+arguments = parser.parse_args()
+
+# 0.2 Assign default values (as set in 0.30 tool parameters)
+days_required_fallow = 30
+ndvi_fallow_threshold = 0.2
+harvest_value_threshold = -0.2
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Generate synthetic NDVI and delta NDVI
+
+random = numpy.random.RandomState(arguments.seed)
+dates = [(datetime(2020, 3, 1) + timedelta(5 * d)).strftime('%Y%m%d') for d in range(arguments.dates)]
+
+# NDVI of each field and date (a third of fields bare, the rest cropped), rounded so that some fields reach thresholds exactly, with cloudy field-dates as NaN
+bare = random.uniform(size = (arguments.fields, 1)) < 1 / 3
+ndvi_matrix = numpy.round(numpy.where(bare, random.uniform(0.0, 0.25, (arguments.fields, len(dates))), random.uniform(0.1, 0.9, (arguments.fields, len(dates)))), 2)
+ndvi_matrix[random.uniform(size = ndvi_matrix.shape) < arguments.cloudy] = numpy.nan
+
+df_ndvi = pandas.DataFrame(data = ndvi_matrix, index = pandas.Index(numpy.arange(1, arguments.fields + 1), name = 'FIELD_ID'), columns = ['ndvi_' + d for d in dates])
+df_ndvi['Crop_Type'] = random.choice([1403, 1403, 101, 302, 2001], arguments.fields)
+
+# Delta NDVI, recent dates, and fallow status before overrides, as in sections 2 and 4 of 0.30
+df_ndvi_no_crop = df_ndvi.loc[:, df_ndvi.columns != 'Crop_Type']
+df_delta_ndvi = df_ndvi_no_crop.ffill(axis = 1).diff(axis = 1).where(df_ndvi_no_crop.notna())
+df_delta_ndvi.dropna(axis = 1, how = 'all', inplace = True)
+df_delta_ndvi.columns = [col.replace('ndvi', 'delta') for col in df_delta_ndvi.columns]
+
+date_required_fallow = int((datetime.strptime(dates[-1], '%Y%m%d') - timedelta(days_required_fallow)).strftime('%Y%m%d'))
+columns_ndvi = ['ndvi_' + d for d in dates]
+columns_ndvi_recent = ['ndvi_' + d for d in dates if int(d) >= date_required_fallow]
+columns_delta_recent = ['delta_' + d for d in dates if int(d) >= date_required_fallow]
+
+df_ndvi_recent = df_ndvi[columns_ndvi_recent]
+fallow_status = numpy.where(((df_ndvi_recent < ndvi_fallow_threshold) | df_ndvi_recent.isna()).all(axis = 1) & df_ndvi_recent.notna().any(axis = 1), 'Fallow', 'Not_Fallow')
+ultima_ndvi_clear = df_ndvi[columns_ndvi].ffill(axis = 1)[columns_ndvi[-1]]
+recent_delta_sum = df_delta_ndvi[columns_delta_recent].sum(axis = 1)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Time row-wise rules (as 0.30 applied them before fallow_rules.py)
+
+def get_recent_harvest(v):
+    s = pandas.Series(v < float(harvest_value_threshold))
+    array = s.where(s == True).last_valid_index()
+    return '-9999' if array is None else array[6:]
+
+df_rows = df_ndvi.copy()
+df_delta_rows = df_delta_ndvi.copy()
+
+rows_start = time.time()
+
+df_delta_rows['Harvest_Date'] = df_delta_rows.apply(lambda x: get_recent_harvest(x), axis = 1)
+df_rows = df_rows.join(df_delta_rows, how = 'outer')
+df_rows['Fallow_Status'] = fallow_status
+df_rows['recent_delta_sum'] = recent_delta_sum
+
+for index, row in df_rows.iterrows():
+    if df_rows.loc[index, 'recent_delta_sum'] >= 0.01 and ultima_ndvi_clear[index] >= 0.10:
+        df_rows.loc[index, 'Fallow_Status'] = 'Not_Fallow'
+    if df_rows.loc[index, 'Harvest_Date'] != '-9999' and int(df_rows.loc[index, 'Harvest_Date']) <= date_required_fallow and df_rows.loc[index, 'Crop_Type'] == 1403:
+        df_rows.loc[index, 'Fallow_Status'] = 'Not_Fallow'
+
+rows_seconds = time.time() - rows_start
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Time whole-array rules
+
+df_arrays = df_ndvi.copy()
+df_delta_arrays = df_delta_ndvi.copy()
+
+arrays_start = time.time()
+
+df_delta_arrays['Harvest_Date'] = fallow_rules.recent_harvest_dates(df_delta_arrays, harvest_value_threshold)
+df_arrays = df_arrays.join(df_delta_arrays, how = 'outer')
+df_arrays['Fallow_Status'] = fallow_status
+df_arrays['recent_delta_sum'] = recent_delta_sum
+
+not_fallow = fallow_rules.not_fallow_overrides(recent_delta_sum = df_arrays['recent_delta_sum'], ultima_ndvi_clear = ultima_ndvi_clear, harvest_dates = df_arrays['Harvest_Date'], crop_types = df_arrays['Crop_Type'], date_required_fallow = date_required_fallow)
+df_arrays.loc[not_fallow, 'Fallow_Status'] = 'Not_Fallow'
+
+arrays_seconds = time.time() - arrays_start
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Compare and report
+
+harvest_identical = df_rows['Harvest_Date'].equals(df_arrays['Harvest_Date'])
+fallow_identical = df_rows['Fallow_Status'].equals(df_arrays['Fallow_Status'])
+
+print('{} fields, {} dates ({:.0%} of field-dates cloudy)'.format(arguments.fields, len(dates), arguments.cloudy))
+print('Row-wise rules: {:.2f} s'.format(rows_seconds))
+print('Whole-array rules: {:.3f} s'.format(arrays_seconds))
+print('Speed-up: {:.0f}x'.format(rows_seconds / arrays_seconds if arrays_seconds else float('inf')))
+print('Fields harvested: {}; overridden as not fallow: {}; fallow: {}'.format(int((df_arrays['Harvest_Date'] != '-9999').sum()), int(not_fallow.sum()), int((df_arrays['Fallow_Status'] == 'Fallow').sum())))
+print('Harvest dates identical: {}; fallow status identical: {}'.format(harvest_identical, fallow_identical))
+
+if not (harvest_identical and fallow_identical):
+    sys.exit(1)
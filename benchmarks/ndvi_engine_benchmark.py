@@ -0,0 +1,195 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             ndvi_engine_benchmark.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; field_ndvi.py and field_zones.py (in parent directory of this script); GDAL Python bindings (osgeo), optional, to read synthetic composites from disk; ArcGIS Pro license with Spatial Analyst, optional, to time the ArcGIS engine
+
+# Notes:            This script is run stand-alone (e.g. python benchmarks/ndvi_engine_benchmark.py --fields 10000 --dates 10); it is not a Script Tool.
+
+# Description:      This script compares the engines calculating mean NDVI of agricultural fields in 0.30 on synthetic rasters: square fields laid out on a grid, each with its own Red and NIR reflectance
+#                   (plus noise) on every date. The NumPy engine (field_ndvi.py) is timed reading each date's composite once and reducing it with numpy.bincount over a zone index of the fields; where ArcGIS is available,
+#                   the ArcGIS engine (Extract by Mask, raster algebra, Zonal Statistics as Table, Join Field, Alter Field, Delete Field per date) is timed on the same rasters and its means compared.
+#                   Without ArcGIS, a per-field NumPy loop (one masked mean per field and date) stands in as the baseline.
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Generate synthetic fields and composites
+# 2. Time NumPy engine
+# 3. Time ArcGIS engine, or else per-field NumPy loop
+# 4. Report
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, sys, time, argparse, tempfile, numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import field_ndvi, field_zones
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+# 0.1 Read in arguments
+parser = argparse.ArgumentParser(description = 'Compare NDVI engines of 0.30 on synthetic rasters')
+parser.add_argument('--fields', type = int, default = 10000, help = 'number of agricultural fields (rounded down to a square number)')
+parser.add_argument('--field-size', type = int, default = 20, help = 'width of each field in pixels')
+parser.add_argument('--dates', type = int, default = 5, help = 'number of composites (dates)')
+parser.add_argument('--seed', type = int, default = 0)
+arguments = parser.parse_args()
+
+# 0.2 Assign default values
+
+# Red and NIR bands of synthetic composites (bands 2, 3, 4, 8 composited in that order), and their cell size (m) and origin (UTM zone 11N)
+RED_BAND, NIR_BAND = 3, 4
+CELL_SIZE = 10.0
+ORIGIN = (600000.0, 3700000.0)
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Generate synthetic fields and composites
+
+class SyntheticComposite(object):
+    """Composite held in memory, read a window at a time like field_zones.RasterBands (used where GDAL is unavailable to write it to disk)."""
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.geotransform = (ORIGIN[0], CELL_SIZE, 0.0, ORIGIN[1], 0.0, -CELL_SIZE)
+        self.y_size, self.x_size = bands[0].shape
+
+    def read(self, band, x, y, columns, rows):
+        return self.bands[band - 1][y:y + rows, x:x + columns].astype(numpy.float64)
+
+    def close(self):
+        pass
+
+random = numpy.random.RandomState(arguments.seed)
+fields_per_side = int(arguments.fields ** 0.5)
+field_count = fields_per_side ** 2
+side = fields_per_side * arguments.field_size
+
+# Zone raster of object IDs (1 through field count), each field a square block of pixels
+zones = (numpy.arange(fields_per_side).repeat(arguments.field_size)[:, None] * fields_per_side + numpy.arange(fields_per_side).repeat(arguments.field_size)[None, :] + 1).astype(numpy.int32)
+object_ids = list(range(1, field_count + 1))
+
+# Red and NIR of each field and date (digital numbers, scaled by 10000), plus per-pixel noise
+composites = []
+for d in range(arguments.dates):
+    field_red = random.randint(300, 1500, field_count)
+    field_nir = random.randint(1000, 5000, field_count)
+    red = (field_red[zones - 1] + random.randint(-50, 50, zones.shape)).astype(numpy.uint16)
+    nir = (field_nir[zones - 1] + random.randint(-50, 50, zones.shape)).astype(numpy.uint16)
+    blue_green = numpy.zeros_like(red)
+    composites.append([blue_green, blue_green, red, nir])
+
+scratch_directory = tempfile.mkdtemp(prefix = 'ndvi_benchmark_')
+
+# Write composites to disk (ERDAS IMAGINE, like those of the 0.2x tools) where GDAL is available, so that NumPy engine is timed reading them
+composite_paths = []
+if field_zones.gdal is not None:
+    from osgeo import osr
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(32611)
+    for d, bands in enumerate(composites):
+        composite_path = os.path.join(scratch_directory, 'S2_MSIL1C_202006{:02d}_R113_T11SPS_B2-4_8.img'.format(d + 1))
+        dataset = field_zones.gdal.GetDriverByName('HFA').Create(composite_path, side, side, 4, field_zones.gdal.GDT_UInt16)
+        dataset.SetGeoTransform((ORIGIN[0], CELL_SIZE, 0.0, ORIGIN[1], 0.0, -CELL_SIZE))
+        dataset.SetProjection(spatial_reference.ExportToWkt())
+        for b, band in enumerate(bands):
+            dataset.GetRasterBand(b + 1).WriteArray(band)
+        dataset = None
+        composite_paths.append(composite_path)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Time NumPy engine
+
+numpy_start = time.time()
+
+# Zone index as a cached one is read (rasterising fields is timed by neither engine)
+zone_index = field_zones.ZoneIndex(zones, (ORIGIN[0], CELL_SIZE, 0.0, ORIGIN[1], 0.0, -CELL_SIZE), object_ids, object_ids)
+numpy_columns = []
+for d, bands in enumerate(composites):
+    composite = field_zones.RasterBands(composite_paths[d]) if composite_paths else SyntheticComposite(bands)
+    numpy_columns.append(field_ndvi.composite_field_ndvi(composite, zone_index, RED_BAND, NIR_BAND)[0])
+    composite.close()
+numpy_matrix = numpy.column_stack(numpy_columns)
+
+numpy_seconds = time.time() - numpy_start
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Time ArcGIS engine, or else per-field NumPy loop
+
+baseline_name = None
+baseline_seconds = None
+baseline_matrix = None
+
+if arcpy is not None and composite_paths and arcpy.CheckExtension('Spatial') == 'Available':
+    baseline_name = 'ArcGIS engine'
+    arcpy.CheckOutExtension('Spatial')
+    arcpy.env.overwriteOutput = True
+
+    # Polygons of synthetic fields, with FIELD_ID equal to object ID of zone raster
+    geodatabase = arcpy.CreateFileGDB_management(scratch_directory, 'benchmark.gdb').getOutput(0)
+    zone_raster = arcpy.NumPyArrayToRaster(zones, arcpy.Point(ORIGIN[0], ORIGIN[1] - side * CELL_SIZE), CELL_SIZE, CELL_SIZE)
+    arcpy.DefineProjection_management(zone_raster, arcpy.SpatialReference(32611))
+    fields = arcpy.RasterToPolygon_conversion(zone_raster, os.path.join(geodatabase, 'fields'), 'NO_SIMPLIFY', 'Value').getOutput(0)
+    arcpy.AddField_management(fields, 'FIELD_ID', 'LONG')
+    arcpy.CalculateField_management(fields, 'FIELD_ID', '!gridcode!', 'PYTHON3')
+
+    baseline_start = time.time()
+    for d, composite_path in enumerate(composite_paths):
+        image_date = '202006{:02d}'.format(d + 1)
+        subset = arcpy.sa.ExtractByMask(in_raster = composite_path, in_mask_data = fields)
+        subset.save(os.path.join(geodatabase, 'subset_' + image_date))
+        nir_raster = arcpy.Raster(os.path.join(geodatabase, 'subset_' + image_date, 'Band_' + str(NIR_BAND)))
+        red_raster = arcpy.Raster(os.path.join(geodatabase, 'subset_' + image_date, 'Band_' + str(RED_BAND)))
+        ndvi_output = arcpy.sa.Divide(arcpy.sa.Float(nir_raster - red_raster), arcpy.sa.Float(nir_raster + red_raster))
+        table = os.path.join(geodatabase, 'ndvi_table_' + image_date)
+        arcpy.sa.ZonalStatisticsAsTable(in_zone_data = fields, zone_field = 'FIELD_ID', in_value_raster = ndvi_output, out_table = table, statistics_type = 'MEAN')
+        arcpy.JoinField_management(in_data = fields, in_field = 'FIELD_ID', join_table = table, join_field = 'FIELD_ID', fields = 'MEAN')
+        arcpy.AlterField_management(in_table = fields, field = 'MEAN', new_field_name = 'ndvi_' + image_date, new_field_alias = 'ndvi_' + image_date)
+    baseline_seconds = time.time() - baseline_start
+
+    ndvi_fields = ['ndvi_202006{:02d}'.format(d + 1) for d in range(len(composite_paths))]
+    baseline_array = arcpy.da.TableToNumPyArray(fields, ['FIELD_ID'] + ndvi_fields, null_value = numpy.nan)
+    baseline_array.sort(order = 'FIELD_ID')
+    baseline_matrix = numpy.column_stack([baseline_array[f] for f in ndvi_fields])
+
+else:
+    baseline_name = 'per-field NumPy loop'
+
+    # Pixels of each field, found before timing starts
+    field_pixels = [numpy.nonzero(zones == o) for o in object_ids]
+
+    # One masked mean per field and date, as a zonal statistics tool does without a grouped reduction
+    baseline_start = time.time()
+    baseline_matrix = numpy.full((field_count, len(composites)), numpy.nan)
+    for d, bands in enumerate(composites):
+        field_values = field_ndvi.ndvi(bands[RED_BAND - 1].astype(numpy.float64), bands[NIR_BAND - 1].astype(numpy.float64))
+        for f, pixels in enumerate(field_pixels):
+            baseline_matrix[f, d] = numpy.nanmean(field_values[pixels])
+    baseline_seconds = time.time() - baseline_start
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Report
+
+print('{} fields of {} x {} pixels ({} x {} pixel rasters), {} dates'.format(field_count, arguments.field_size, arguments.field_size, side, side, len(composites)))
+print('NumPy engine: {:.2f} s ({} composites {})'.format(numpy_seconds, len(composites), 'read from disk' if composite_paths else 'held in memory'))
+print('{}: {:.2f} s'.format(baseline_name, baseline_seconds))
+print('Speed-up: {:.1f}x'.format(baseline_seconds / numpy_seconds if numpy_seconds else float('inf')))
+print('Largest difference in mean NDVI between engines: {:.2e}'.format(numpy.nanmax(numpy.abs(numpy_matrix - baseline_matrix))))
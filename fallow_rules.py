@@ -0,0 +1,77 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             fallow_rules.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; pandas
+
+# Notes:            This module is imported by the 0.30 Script Tool (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module applies the harvest and fallow rules of 0.30 to every agricultural field at once, as whole-array operations over the fields x dates matrices of NDVI and delta NDVI,
+#                   in place of building a pandas Series per field (DataFrame.apply) and overriding fallow status one field at a time (DataFrame.iterrows). Results are identical to the row-wise rules.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Identify most recent harvest date
+# 2. Override fallow status
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import numpy, pandas
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Harvest date of fields never harvested (in lieu of NA)
+NO_HARVEST_DATE = '-9999'
+
+# Sum of delta NDVI over fallow analysis timeframe, and most recent clear NDVI, at or above which a field is not fallow
+RECENT_DELTA_SUM_THRESHOLD = 0.01
+ULTIMA_NDVI_THRESHOLD = 0.10
+
+# Crop type of fallow fields
+FALLOW_CROP_TYPE = 1403
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Identify most recent harvest date
+
+# Return most recent harvest date (YYYYMMDD, from name of delta NDVI column, e.g. delta_20200601) of each field: last date whose delta NDVI is below harvest threshold (cloudy field-dates never are),
+#   found as first such date of columns reversed; fields never harvested are given no harvest date (-9999)
+def recent_harvest_dates(df_delta_ndvi, harvest_value_threshold):
+    with numpy.errstate(invalid = 'ignore'):
+        harvested = df_delta_ndvi.values.astype(numpy.float64) < float(harvest_value_threshold)
+
+    column_count = harvested.shape[1]
+    last_harvest = column_count - 1 - numpy.argmax(harvested[:, ::-1], axis = 1) if column_count else numpy.zeros(len(harvested), dtype = numpy.int64)
+
+    # Harvest date of each column, followed by no harvest date for fields never harvested
+    harvest_dates = numpy.array([c[6:] for c in df_delta_ndvi.columns] + [NO_HARVEST_DATE], dtype = object)
+    return pandas.Series(harvest_dates[numpy.where(harvested.any(axis = 1), last_harvest, column_count)], index = df_delta_ndvi.index)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Override fallow status
+
+# Return whether each field's fallow status is overridden as not fallow, where 1) its sum delta NDVI over the fallow analysis timeframe is at or above 0.01 and its most recent clear NDVI is at or above 0.10,
+#   or 2) it was harvested on or before the start of the fallow analysis timeframe and its crop type is fallow (NaN fails every comparison, as it does field by field)
+def not_fallow_overrides(recent_delta_sum, ultima_ndvi_clear, harvest_dates, crop_types, date_required_fallow):
+    growing = (recent_delta_sum >= RECENT_DELTA_SUM_THRESHOLD) & (ultima_ndvi_clear >= ULTIMA_NDVI_THRESHOLD)
+
+    harvested = harvest_dates != NO_HARVEST_DATE
+    harvest_integers = pandas.to_numeric(harvest_dates.where(harvested))
+    harvested_fallow = harvested & (harvest_integers <= date_required_fallow) & (crop_types == FALLOW_CROP_TYPE)
+
+    return growing | harvested_fallow
@@ -0,0 +1,173 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             field_ndvi.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; ArcGIS Pro license (to rasterise agricultural fields); GDAL Python bindings (osgeo), optional, to reduce composites in worker processes; field_zones.py and sentinel_composite.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.30 Script Tool (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module calculates mean NDVI of every agricultural field for every composite in a single pass over each composite, in place of a geoprocessing chain
+#                   (Extract by Mask, raster algebra, Zonal Statistics as Table, Join Field, Alter Field, Delete Field) per image. Fields are rasterised into a zone index once per snap grid
+#                   (and cached across runs; see field_zones.py); each composite's Red and NIR bands (and its cloud mask, if any) are then read once,
+#                   a strip of rows at a time, NDVI is calculated per pixel, and per-field sums and counts are accumulated with a grouped reduction (numpy.bincount).
+#                   The result is a fields x dates matrix of mean NDVI held in memory, with each field's cloud fraction alongside it.
+#                   Composites are independent of one another, so they can be reduced several at once in worker processes (GDAL only), which attach to the cached zone index (memory-mapped, so shared
+#                   rather than copied) and stream their columns back in order; the matrix is bit for bit the same as when composites are reduced one after another.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Calculate NDVI of pixels
+# 2. Calculate mean NDVI of fields within each composite, one after another or in worker processes
+# 3. Calculate fields x dates matrix of mean NDVI
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, numpy, field_zones, sentinel_composite
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Engines calculating NDVI of agricultural fields in 0.30: NumPy (this module) or ArcGIS geoprocessing, one image at a time
+NDVI_ENGINES = ['NUMPY', 'ARCPY']
+DEFAULT_NDVI_ENGINE = 'NUMPY'
+
+# Maximum share of field's pixels flagged as opaque cloud or cirrus for its NDVI to be calculated
+DEFAULT_MAX_CLOUD_FRACTION = 0.1
+
+# Number of composites reduced at once (1 reduces composites one after another within the tool's own process), and number of composites handed to a worker process at a time
+DEFAULT_NDVI_WORKERS = 1
+DEFAULT_NDVI_CHUNK_SIZE = 1
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Calculate NDVI of pixels
+
+# Return NDVI of Red and NIR values, NaN where either is nodata or both are 0 (as ArcGIS Divide leaves NoData where denominator is 0)
+def ndvi(red, nir):
+    denominator = nir + red
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        return numpy.where(denominator != 0, (nir - red) / denominator, numpy.nan)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Calculate mean NDVI of fields within each composite, one after another or in worker processes
+
+# Return mean NDVI and cloud fraction (NaN where composite has no cloud mask) of each field within a single composite, reading its bands (and cloud mask) once, a strip of rows at a time
+#   over its window overlapping zone index; cloudy pixels are excluded from mean NDVI
+def composite_field_ndvi(composite, zone_index, red_band, nir_band, cloud_mask = None):
+    ndvi_accumulator = field_zones.ZonalAccumulator(zone_index.field_count)
+    cloud_accumulator = field_zones.ZonalAccumulator(zone_index.field_count)
+
+    window = zone_index.window(composite)
+    mask = field_zones.RasterBands(cloud_mask) if cloud_mask is not None else None
+    try:
+        for y, rows, codes in (window.strips() if window is not None else []):
+            raster_window = window.raster_window(y, rows)
+            strip_ndvi = ndvi(composite.read(int(red_band), *raster_window), composite.read(int(nir_band), *raster_window))
+
+            if mask is not None:
+                cloudy = mask.read(1, *raster_window) > 0
+                cloud_accumulator.add(codes, cloudy.astype(numpy.float64))
+                strip_ndvi[cloudy] = numpy.nan
+
+            ndvi_accumulator.add(codes, strip_ndvi)
+    finally:
+        if mask is not None:
+            mask.close()
+
+    cloud_fraction = cloud_accumulator.mean() if mask is not None else numpy.full(zone_index.field_count, numpy.nan)
+    return ndvi_accumulator.mean(), cloud_fraction
+
+# Return mean NDVI and cloud fraction of fields within composite, in a worker process attached to zone index and lookup of fields (files memory-mapped rather than copied)
+def composite_field_ndvi_job(composite_path, cloud_mask, zones_path, geotransform, object_ids_path, lookup_path, red_band, nir_band):
+    zone_index = field_zones.attach_zone_index(zones_path, geotransform, object_ids_path, lookup_path)
+    composite = field_zones.RasterBands(composite_path)
+    try:
+        return composite_field_ndvi(composite, zone_index, red_band, nir_band, cloud_mask)
+    finally:
+        composite.close()
+
+# Yield mean NDVI and cloud fraction of fields within each composite (list of (composite_path, date, cloud_mask or None)), in order given, as each is calculated: one after another within tool's own process,
+#   or fanned out over worker processes (GDAL only), chunk size composites at a time
+def composite_results(composites, zone_cache, red_band, nir_band, max_workers = DEFAULT_NDVI_WORKERS, chunk_size = DEFAULT_NDVI_CHUNK_SIZE):
+
+    # Reduce composites one after another within tool's own process when a single worker is requested (or ArcGIS reads them)
+    if max_workers <= 1 or len(composites) <= 1 or field_zones.gdal is None:
+        for composite_path, image_date, cloud_mask in composites:
+            composite = field_zones.RasterBands(composite_path)
+            try:
+                yield composite_field_ndvi(composite, zone_cache.zone_index(composite), red_band, nir_band, cloud_mask)
+            finally:
+                composite.close()
+        return
+
+    # Rasterise any zone index missing from cache within tool's own process (with ArcGIS) before workers attach to it
+    object_ids_path, lookup_path = zone_cache.shared_lookup()
+    jobs = []
+    for composite_path, image_date, cloud_mask in composites:
+        composite = field_zones.RasterBands(composite_path)
+        zone_index = zone_cache.zone_index(composite)
+        composite.close()
+        jobs.append((composite_path, cloud_mask, zone_index.zones_path, zone_index.geotransform, object_ids_path, lookup_path, int(red_band), int(nir_band)))
+
+    with sentinel_composite.worker_pool(max_workers) as executor:
+        for result in executor.map(composite_field_ndvi_job, *zip(*jobs), chunksize = max(int(chunk_size), 1)):
+            yield result
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Calculate fields x dates matrix of mean NDVI
+
+# Return FIELD_IDs (in order of object IDs), dates, and fields x dates matrices of mean NDVI and cloud fraction, for composites (list of (composite_path, date, cloud_mask or None), in order given);
+#   fields above maximum cloud fraction are left without NDVI for a date, and a date is skipped where every field is; composites of the same date (e.g. adjacent tiles) fill each other's gaps
+def field_ndvi_matrix(composites, feature_class, red_band, nir_band, max_cloud_fraction = DEFAULT_MAX_CLOUD_FRACTION, zone_cache_directory = None, zone_cache = None, max_workers = DEFAULT_NDVI_WORKERS, chunk_size = DEFAULT_NDVI_CHUNK_SIZE, messages = print):
+
+    # Zone index of fields on snap grid of each composite, rasterised only where none is cached (rows of matrix follow order of object IDs)
+    if zone_cache is None:
+        zone_cache = field_zones.FieldZoneCache(feature_class, zone_cache_directory, messages)
+    field_count = zone_cache.field_count
+
+    dates = []
+    ndvi_columns = {}
+    cloud_columns = {}
+
+    # Fill matrix in order of composites, as each one's columns stream back
+    results = composite_results(composites, zone_cache, red_band, nir_band, max_workers, chunk_size)
+    for (composite_path, image_date, cloud_mask), (field_ndvi, cloud_fraction) in zip(composites, results):
+        image_name = os.path.basename(composite_path)
+
+        # Leave fields above maximum cloud fraction without NDVI (fields outside cloud mask are treated as clear), skipping image altogether where every field is
+        cloudy = cloud_fraction > float(max_cloud_fraction)
+        if cloud_mask is not None and field_count and cloudy.all():
+            messages('Skipped {}: every field above maximum cloud fraction of {}'.format(image_name, max_cloud_fraction))
+            continue
+        if cloudy.any():
+            messages('{}: {} fields above maximum cloud fraction of {} left without NDVI'.format(image_name, int(cloudy.sum()), max_cloud_fraction))
+        field_ndvi[cloudy] = numpy.nan
+
+        if image_date not in ndvi_columns:
+            dates.append(image_date)
+            ndvi_columns[image_date] = field_ndvi
+            cloud_columns[image_date] = cloud_fraction
+        else:
+            ndvi_columns[image_date] = numpy.where(numpy.isnan(ndvi_columns[image_date]), field_ndvi, ndvi_columns[image_date])
+            cloud_columns[image_date] = numpy.where(numpy.isnan(cloud_columns[image_date]), cloud_fraction, cloud_columns[image_date])
+
+        messages('Calculated NDVI of {} fields from {}'.format(int((~numpy.isnan(field_ndvi)).sum()), image_name))
+
+    ndvi_matrix = numpy.column_stack([ndvi_columns[d] for d in dates]) if dates else numpy.zeros((field_count, 0))
+    cloud_matrix = numpy.column_stack([cloud_columns[d] for d in dates]) if dates else numpy.zeros((field_count, 0))
+    return zone_cache.field_ids, dates, ndvi_matrix, cloud_matrix
@@ -0,0 +1,497 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             field_zones.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; ArcGIS Pro license (to rasterise agricultural fields); GDAL Python bindings (osgeo), optional; without them rasters are read with ArcGIS; sentinel_cube.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.30, 0.40, 0.50, and 7.50 Script Tools and by field_ndvi.py (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module keeps a cache of zone indexes (field_zones directory beside the geodatabase or shapefile holding agricultural fields): each an int32 array of object IDs of the fields
+#                   rasterised (at cell centres, as Zonal Statistics does) onto a snap grid (coordinate system, cell size, and alignment of origin) over the fields' extent, stored as a NumPy array file.
+#                   Entries are keyed by a fingerprint of the fields (object IDs, FIELD_IDs, and geometry) and the snap grid, so that fields are rasterised once per snap grid rather than once per
+#                   zonal statistics run and date, and an entry is rebuilt (and the stale one deleted) as soon as borders are reshaped (e.g. by 0.50). Tools read the window of a zone index
+#                   covering a raster as a memory-mapped view, and reduce raster values to per-field mean, standard deviation, or majority with grouped reductions (numpy.bincount) over it.
+#                   Array files of an imagery cube (see sentinel_cube.py) are read as rasters too, a window of chunks at a time, so that tools can read a date from a cube in place of its composites.
+#                   Worker processes attach to the same files (zone index and its lookup of rows of fields), memory-mapped read-only, so that the operating system shares one copy of their pages among them.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Read raster bands a window at a time
+# 2. Fingerprint fields and key zone indexes by snap grid
+# 3. Read zone index windows
+# 4. Rasterise fields into zone index, or take it from cache
+# 5. Reduce raster values to per-field statistics
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, glob, json, time, hashlib, numpy, sentinel_cube
+
+# GDAL is optional; without it rasters are read with ArcGIS
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Engines calculating zonal statistics in 0.40 and 7.50: grouped reductions over cached zone index (NumPy) or ArcGIS Zonal Statistics as Table
+ZONAL_ENGINES = ['NUMPY', 'ARCPY']
+DEFAULT_ZONAL_ENGINE = 'NUMPY'
+
+# Name of cache directory (beside geodatabase or shapefile holding fields), and of JSON file recording its entries
+ZONE_CACHE_DIRECTORY = 'field_zones'
+ZONE_CACHE_INDEX = 'zones_index.json'
+
+# Value of zone index outside every field (object IDs start at 0 in shapefiles and at 1 in geodatabases, so no object ID is ever negative)
+ZONE_NODATA = -1
+
+# Format of zone indexes and their lookups, part of their keys and file names so that those cached in an earlier format (e.g. with 0 outside every field) are rebuilt rather than reused
+ZONE_INDEX_VERSION = 2
+
+# Suffixes of NumPy array files (named for fingerprint of fields) holding object IDs of fields and lookup of their rows, shared with worker processes
+OBJECT_IDS_SUFFIX = '_object_ids_v{}.npy'.format(ZONE_INDEX_VERSION)
+LOOKUP_SUFFIX = '_lookup_v{}.npy'.format(ZONE_INDEX_VERSION)
+
+# Rows of zone index (or raster) rasterised, read, or reduced at a time
+ZONE_STRIP_ROWS = 1024
+
+# Workspaces holding feature classes, beside which cache directory is kept
+WORKSPACE_EXTENSIONS = ('.gdb', '.sde', '.gpkg', '.shp')
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Read raster bands a window at a time
+
+class RasterBands(object):
+    """Bands of a raster (e.g. composite, cloud mask, or classified raster) read a window at a time as floating point, with nodata as NaN, from an imagery cube's chunks, or through GDAL or else ArcGIS."""
+
+    def __init__(self, raster_path):
+        self.raster_path = raster_path
+        self.snap_raster = raster_path
+        self.dataset = None
+        self.cube = None
+
+        # Array file of an imagery cube (of a date, or of its cloud mask; see sentinel_cube.py), read with NumPy alone and snapped to a composite of its date
+        if sentinel_cube.is_cube_file(raster_path):
+            self.cube, self.cube_date, self.cube_mask = sentinel_cube.open_cube_file(raster_path)
+            self.snap_raster = self.cube.snap_raster(self.cube_date)
+            self.geotransform = tuple(self.cube.geotransform)
+            self.projection = self.cube.projection
+            self.x_size = self.cube.x_size
+            self.y_size = self.cube.y_size
+            self.band_count = 1 if self.cube_mask else len(self.cube.bands)
+
+        elif gdal is not None:
+            self.dataset = gdal.Open(raster_path)
+            self.geotransform = self.dataset.GetGeoTransform()
+            self.projection = self.dataset.GetProjection()
+            self.x_size = self.dataset.RasterXSize
+            self.y_size = self.dataset.RasterYSize
+            self.band_count = self.dataset.RasterCount
+
+        else:
+            import arcpy
+            description = arcpy.Describe(raster_path)
+            cell_size = description.meanCellWidth
+            self.geotransform = (description.extent.XMin, cell_size, 0.0, description.extent.YMax, 0.0, -cell_size)
+            self.projection = description.spatialReference.exportToString()
+            self.x_size = description.width
+            self.y_size = description.height
+            self.band_count = description.bandCount
+
+    # Return grid key (coordinate system, geotransform, and size) shared by rasters on the same grid, e.g. composites of the same tile
+    def grid(self):
+        return (self.projection, tuple(self.geotransform), self.x_size, self.y_size)
+
+    # Return window (x, y, columns, rows) of band (counted from 1) as float64, nodata as NaN
+    def read(self, band, x, y, columns, rows):
+        if self.cube is not None and self.cube_mask:
+            values = self.cube.mask_window(self.cube_date, x, y, columns, rows).astype(numpy.float64)
+            nodata = None
+
+        elif self.cube is not None:
+            values = self.cube.window(self.cube_date, self.cube.bands[band - 1], x, y, columns, rows).astype(numpy.float64)
+            nodata = self.cube.nodata
+
+        elif self.dataset is not None:
+            raster_band = self.dataset.GetRasterBand(band)
+            values = raster_band.ReadAsArray(x, y, columns, rows).astype(numpy.float64)
+            nodata = raster_band.GetNoDataValue()
+
+        else:
+            import arcpy
+            band_path = os.path.join(self.raster_path, 'Band_' + str(band)) if self.band_count > 1 else self.raster_path
+            lower_left = arcpy.Point(self.geotransform[0] + x * self.geotransform[1], self.geotransform[3] + (y + rows) * self.geotransform[5])
+            values = arcpy.RasterToNumPyArray(band_path, lower_left, columns, rows).astype(numpy.float64)
+            nodata = arcpy.Raster(band_path).noDataValue
+
+        if nodata is not None:
+            values[values == nodata] = numpy.nan
+        return values
+
+    def close(self):
+        self.dataset = None
+        if self.cube is not None:
+            self.cube.close()
+
+# Return band number of raster layer name (e.g. Band_4 or Layer_4 is band 4)
+def band_number(layer_name):
+    return int(str(layer_name).replace('\\', '/').split('/')[-1].split('_')[-1])
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Fingerprint fields and key zone indexes by snap grid
+
+# Return cache directory of fields: field_zones directory beside geodatabase (or other workspace) or shapefile holding them
+def default_cache_directory(feature_class):
+    import arcpy
+    catalog_path = arcpy.Describe(feature_class).catalogPath
+
+    workspace = catalog_path
+    while workspace and os.path.splitext(workspace)[1].lower() not in WORKSPACE_EXTENSIONS and os.path.dirname(workspace) != workspace:
+        workspace = os.path.dirname(workspace)
+    if os.path.splitext(workspace)[1].lower() not in WORKSPACE_EXTENSIONS:
+        workspace = catalog_path
+
+    return os.path.join(os.path.dirname(workspace), ZONE_CACHE_DIRECTORY)
+
+# Return fingerprint of fields (hash of coordinate system, and object ID, FIELD_ID, and geometry of every field, in order of object IDs), with their object IDs and FIELD_IDs in that order
+def field_fingerprint(feature_class):
+    import arcpy
+    digest = hashlib.sha1(arcpy.Describe(feature_class).spatialReference.exportToString().encode('utf-8'))
+
+    object_ids = []
+    field_ids = []
+    for object_id, field_id, wkb in sorted(arcpy.da.SearchCursor(feature_class, ['OID@', 'FIELD_ID', 'SHAPE@WKB']), key = lambda r: r[0]):
+        digest.update(repr((object_id, field_id)).encode('utf-8'))
+        digest.update(bytes(wkb or b''))
+        object_ids.append(object_id)
+        field_ids.append(field_id)
+
+    return digest.hexdigest(), object_ids, field_ids
+
+# Return snap grid of raster: coordinate system, cell size, and offset of its origin from a multiple of cell size (rasters sharing these align cell for cell, e.g. Sentinel-2 tiles of one UTM zone)
+def snap_grid(raster):
+    cell_size = raster.geotransform[1]
+    return [raster.projection, cell_size, round(raster.geotransform[0] % cell_size, 6), round(raster.geotransform[3] % cell_size, 6)]
+
+# Return key of zone index of fields with fingerprint on snap grid
+def zone_key(fingerprint, grid):
+    return hashlib.sha1(json.dumps([fingerprint, grid, ZONE_INDEX_VERSION]).encode('utf-8')).hexdigest()
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Read zone index windows
+
+# Return row of each object ID (order of object IDs), indexed by object ID + 1: zone nodata (-1) at index 0 and object IDs above every present one at the last index are recoded to field count
+#   (dropped by reductions), so that neither is ever counted in a field (e.g. the shapefile field of FID 0)
+def zone_lookup(object_ids):
+    object_ids = numpy.asarray(object_ids, dtype = numpy.int64)
+    lookup = numpy.full((int(object_ids.max()) if object_ids.size else 0) + 3, len(object_ids), dtype = numpy.int64)
+    lookup[object_ids + 1] = numpy.arange(len(object_ids))
+    return lookup
+
+class ZoneIndex(object):
+    """Object IDs of fields rasterised onto a snap grid (zones array, typically memory-mapped, with its geotransform and file), and row of each field's statistics (order of object IDs)."""
+
+    def __init__(self, zones, geotransform, object_ids, field_ids, zones_path = None, lookup = None):
+        self.zones = zones
+        self.geotransform = tuple(geotransform)
+        self.object_ids = object_ids
+        self.field_ids = field_ids
+        self.field_count = len(object_ids)
+        self.zones_path = zones_path
+        self.lookup = zone_lookup(object_ids) if lookup is None else lookup
+
+    # Return rows of fields (field count outside every field) of zone index window (x, y, columns, rows, on zone index)
+    def codes(self, x, y, columns, rows):
+        zones = numpy.asarray(self.zones[y:y + rows, x:x + columns], dtype = numpy.int64)
+        return self.lookup[numpy.clip(zones + 1, 0, len(self.lookup) - 1)]
+
+    # Return window of zone index overlapping raster (on raster's snap grid), or None if fields lie outside raster
+    def window(self, raster):
+        cell_size = self.geotransform[1]
+        zone_x = int(round((raster.geotransform[0] - self.geotransform[0]) / cell_size))
+        zone_y = int(round((self.geotransform[3] - raster.geotransform[3]) / cell_size))
+
+        x_start, y_start = max(zone_x, 0), max(zone_y, 0)
+        x_end, y_end = min(zone_x + raster.x_size, self.zones.shape[1]), min(zone_y + raster.y_size, self.zones.shape[0])
+        if x_end <= x_start or y_end <= y_start:
+            return None
+
+        return ZoneWindow(self, x_start, y_start, x_end - x_start, y_end - y_start, x_start - zone_x, y_start - zone_y)
+
+class ZoneWindow(object):
+    """Window of a zone index (x, y on zone index) and the same window on a raster (x_offset, y_offset on raster grid), read a strip of rows at a time."""
+
+    def __init__(self, zone_index, x, y, columns, rows, x_offset, y_offset):
+        self.zone_index = zone_index
+        self.x = x
+        self.y = y
+        self.columns = columns
+        self.rows = rows
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+
+    # Yield each strip of rows of window: its first row (from top of window), number of rows, and rows of fields of its pixels
+    def strips(self, strip_rows = ZONE_STRIP_ROWS):
+        for y in range(0, self.rows, strip_rows):
+            rows = min(strip_rows, self.rows - y)
+            yield y, rows, self.zone_index.codes(self.x, self.y + y, self.columns, rows)
+
+    # Return raster window (x, y, columns, rows) of strip
+    def raster_window(self, y, rows):
+        return self.x_offset, self.y_offset + y, self.columns, rows
+
+# Zone indexes attached to by this (worker) process, by file of zone index
+attached_zone_indexes = {}
+
+# Return zone index attached to (in a worker process) from its file and from files of object IDs and lookup of fields, each memory-mapped read-only rather than copied, attaching once per process
+def attach_zone_index(zones_path, geotransform, object_ids_path, lookup_path):
+    if zones_path not in attached_zone_indexes:
+        attached_zone_indexes[zones_path] = ZoneIndex(numpy.load(zones_path, mmap_mode = 'r'), geotransform, numpy.load(object_ids_path, mmap_mode = 'r'), None, zones_path, numpy.load(lookup_path, mmap_mode = 'r'))
+    return attached_zone_indexes[zones_path]
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Rasterise fields into zone index, or take it from cache
+
+# Rasterise object IDs of fields (cell centres) onto snap grid of raster over fields' extent, writing zone index a strip at a time to a partial NumPy array file renamed once complete; return its geotransform
+def rasterize_fields(feature_class, raster, zones_path):
+    import arcpy
+
+    zone_raster = r'in_memory/field_zones'
+    if arcpy.Exists(zone_raster):
+        arcpy.Delete_management(in_data = zone_raster)
+
+    with arcpy.EnvManager(outputCoordinateSystem = raster.snap_raster, snapRaster = raster.snap_raster, cellSize = raster.snap_raster):
+        arcpy.PolygonToRaster_conversion(in_features = feature_class, value_field = arcpy.Describe(feature_class).OIDFieldName, out_rasterdataset = zone_raster, cell_assignment = 'CELL_CENTER', cellsize = raster.geotransform[1])
+
+    description = arcpy.Describe(zone_raster)
+    cell_size = raster.geotransform[1]
+    geotransform = (description.extent.XMin, cell_size, 0.0, description.extent.YMax, 0.0, -cell_size)
+    columns, rows = description.width, description.height
+
+    partial_path = zones_path + '.partial'
+    zones = numpy.lib.format.open_memmap(partial_path, mode = 'w+', dtype = numpy.int32, shape = (rows, columns))
+    try:
+        for y in range(0, rows, ZONE_STRIP_ROWS):
+            strip_rows = min(ZONE_STRIP_ROWS, rows - y)
+            lower_left = arcpy.Point(geotransform[0], geotransform[3] - (y + strip_rows) * cell_size)
+            zones[y:y + strip_rows] = arcpy.RasterToNumPyArray(zone_raster, lower_left, columns, strip_rows, nodata_to_value = ZONE_NODATA)
+        zones.flush()
+    finally:
+        del zones
+        arcpy.Delete_management(in_data = zone_raster)
+    os.replace(partial_path, zones_path)
+
+    return geotransform
+
+class FieldZoneCache(object):
+    """Zone indexes of a feature class of fields on each snap grid, taken from cache directory (JSON index of keys, feature classes, fingerprints, and geotransforms) or rasterised into it."""
+
+    def __init__(self, feature_class, cache_directory = None, messages = print):
+        import arcpy
+        self.feature_class = feature_class
+        self.catalog_path = arcpy.Describe(feature_class).catalogPath
+        self.cache_directory = cache_directory or default_cache_directory(feature_class)
+        self.index_path = os.path.join(self.cache_directory, ZONE_CACHE_INDEX)
+        self.messages = messages
+        os.makedirs(self.cache_directory, exist_ok = True)
+
+        self.fingerprint, self.object_ids, self.field_ids = field_fingerprint(feature_class)
+        self.field_count = len(self.object_ids)
+        self.zone_indexes = {}
+
+        self.entries = read_cache_index(self.cache_directory)
+
+        # Delete zone indexes of earlier versions of these fields (e.g. before borders were reshaped)
+        stale_keys = [k for k, e in self.entries.items() if e['feature_class'] == self.catalog_path and e['fingerprint'] != self.fingerprint]
+        if stale_keys:
+            remove_entries(self.cache_directory, self.entries, stale_keys)
+            messages('Deleted {} zone index(es) of {} rasterised before its fields changed'.format(len(stale_keys), os.path.basename(self.catalog_path)))
+
+    # Return zone index of fields on snap grid of raster, rasterising fields only if no zone index of them on that grid is cached
+    def zone_index(self, raster):
+        grid = snap_grid(raster)
+        key = zone_key(self.fingerprint, grid)
+        if key in self.zone_indexes:
+            return self.zone_indexes[key]
+
+        zones_path = os.path.join(self.cache_directory, key + '.npy')
+        if key in self.entries and os.path.isfile(zones_path):
+            self.messages('Zone index of {} taken from cache: {}'.format(os.path.basename(self.catalog_path), zones_path))
+            geotransform = self.entries[key]['geotransform']
+        else:
+            start = time.time()
+            geotransform = rasterize_fields(self.feature_class, raster, zones_path)
+            self.messages('Rasterised {} fields of {} into zone index in {:.0f} s: {}'.format(self.field_count, os.path.basename(self.catalog_path), time.time() - start, zones_path))
+
+        self.entries[key] = {'feature_class': self.catalog_path, 'fingerprint': self.fingerprint, 'grid': grid, 'geotransform': list(geotransform), 'last_used': time.time()}
+        write_cache_index(self.cache_directory, self.entries)
+
+        self.zone_indexes[key] = ZoneIndex(numpy.load(zones_path, mmap_mode = 'r'), geotransform, self.object_ids, self.field_ids, zones_path)
+        return self.zone_indexes[key]
+
+    # Return files of object IDs and lookup of rows of fields (written once per fingerprint, each to a partial file renamed once complete), to which worker processes attach
+    def shared_lookup(self):
+        object_ids_path = os.path.join(self.cache_directory, self.fingerprint + OBJECT_IDS_SUFFIX)
+        lookup_path = os.path.join(self.cache_directory, self.fingerprint + LOOKUP_SUFFIX)
+        if not os.path.isfile(object_ids_path):
+            save_array(object_ids_path, numpy.asarray(self.object_ids, dtype = numpy.int64))
+        if not os.path.isfile(lookup_path):
+            save_array(lookup_path, zone_lookup(self.object_ids))
+        return object_ids_path, lookup_path
+
+# Write NumPy array file to a partial file renamed once complete, so that no process attaches to it half written
+def save_array(array_path, values):
+    with open(array_path + '.partial', 'wb') as array_file:
+        numpy.save(array_file, values)
+    os.replace(array_path + '.partial', array_path)
+
+def read_cache_index(cache_directory):
+    index_path = os.path.join(cache_directory, ZONE_CACHE_INDEX)
+    if not os.path.isfile(index_path):
+        return {}
+    try:
+        with open(index_path) as index_file:
+            return json.load(index_file)
+    except ValueError:
+        return {}
+
+# Write index to a partial file renamed once complete, so that it is never left half written
+def write_cache_index(cache_directory, entries):
+    index_path = os.path.join(cache_directory, ZONE_CACHE_INDEX)
+    with open(index_path + '.partial', 'w') as index_file:
+        json.dump(entries, index_file, indent = 2)
+    os.replace(index_path + '.partial', index_path)
+
+def remove_entries(cache_directory, entries, keys):
+    fingerprints = set(entries[k]['fingerprint'] for k in keys if k in entries)
+    for key in keys:
+        zones_path = os.path.join(cache_directory, key + '.npy')
+        if os.path.isfile(zones_path):
+            os.remove(zones_path)
+        entries.pop(key, None)
+
+    # Delete files of object IDs and lookup of fingerprints no zone index is left of
+    for fingerprint in fingerprints - set(e['fingerprint'] for e in entries.values()):
+        for array_path in glob.glob(os.path.join(cache_directory, fingerprint + '_*.npy')):
+            os.remove(array_path)
+    write_cache_index(cache_directory, entries)
+
+# Delete every cached zone index of feature class (e.g. after its borders are edited), returning number deleted
+def invalidate(feature_class, cache_directory = None, messages = print):
+    import arcpy
+    catalog_path = arcpy.Describe(feature_class).catalogPath
+    cache_directory = cache_directory or default_cache_directory(feature_class)
+    if not os.path.isdir(cache_directory):
+        return 0
+
+    entries = read_cache_index(cache_directory)
+    keys = [k for k, e in entries.items() if e['feature_class'] == catalog_path]
+    if keys:
+        remove_entries(cache_directory, entries, keys)
+        messages('Deleted {} cached zone index(es) of {}'.format(len(keys), os.path.basename(catalog_path)))
+    return len(keys)
+
+#----------------------------------------------------------------------------------------------
+
+# 5. Reduce raster values to per-field statistics
+
+class ZonalAccumulator(object):
+    """Count, sum, and sum of squares of each field's valid (not NaN) values, and counts of each value (for majority), accumulated a strip at a time with grouped reductions."""
+
+    def __init__(self, field_count, majority = False):
+        self.field_count = field_count
+        self.counts = numpy.zeros(field_count, dtype = numpy.int64)
+        self.sums = numpy.zeros(field_count)
+        self.squares = numpy.zeros(field_count)
+        self.majority = majority
+        self.value_counts = {}
+
+    # Add values of strip (NaN where nodata) to rows of fields given by codes (field count outside every field)
+    def add(self, codes, values):
+        valid = ~numpy.isnan(values) & (codes < self.field_count)
+        valid_codes = codes[valid]
+        valid_values = values[valid]
+
+        self.counts += numpy.bincount(valid_codes, minlength = self.field_count)
+        self.sums += numpy.bincount(valid_codes, weights = valid_values, minlength = self.field_count)
+        self.squares += numpy.bincount(valid_codes, weights = valid_values * valid_values, minlength = self.field_count)
+
+        # Count each (field, value) pair, as integer values (e.g. classes)
+        if self.majority and valid_codes.size:
+            pairs, pair_counts = numpy.unique(numpy.stack([valid_codes, valid_values.astype(numpy.int64)], axis = 1), axis = 0, return_counts = True)
+            for (code, value), count in zip(pairs.tolist(), pair_counts.tolist()):
+                self.value_counts[(code, value)] = self.value_counts.get((code, value), 0) + count
+
+    # Return mean of each field, NaN where a field has no valid value
+    def mean(self):
+        means = numpy.full(self.field_count, numpy.nan)
+        numpy.divide(self.sums, self.counts, out = means, where = self.counts > 0)
+        return means
+
+    # Return (population) standard deviation of each field, as Zonal Statistics reports it, NaN where a field has no valid value
+    def std(self):
+        means = self.mean()
+        variances = numpy.full(self.field_count, numpy.nan)
+        numpy.divide(self.squares, self.counts, out = variances, where = self.counts > 0)
+        return numpy.sqrt(numpy.maximum(variances - means * means, 0.0))
+
+    # Return most frequent value of each field (lowest value where several are equally frequent), NaN where a field has no valid value
+    def majority_values(self):
+        majorities = numpy.full(self.field_count, numpy.nan)
+        best_counts = numpy.zeros(self.field_count, dtype = numpy.int64)
+        for (code, value), count in sorted(self.value_counts.items()):
+            if count > best_counts[code]:
+                best_counts[code] = count
+                majorities[code] = value
+        return majorities
+
+# Return statistics (MEAN, STD, or MAJORITY) of band of raster for every field (in order of object IDs), reading raster a strip at a time over its window overlapping zone index
+def zonal_statistics(zone_index, raster, band, statistics_type = 'MEAN'):
+    accumulator = ZonalAccumulator(zone_index.field_count, majority = statistics_type == 'MAJORITY')
+
+    window = zone_index.window(raster)
+    if window is not None:
+        for y, rows, codes in window.strips():
+            accumulator.add(codes, raster.read(band, *window.raster_window(y, rows)))
+
+    if statistics_type == 'STD':
+        return accumulator.std()
+    if statistics_type == 'MAJORITY':
+        return accumulator.majority_values()
+    return accumulator.mean()
+
+# Write values (one per field, in order of object IDs; NaN left null) to attribute table field of feature class, adding it (replacing any pre-existing field of that name)
+def write_field_values(feature_class, zone_index, field_name, values, field_type = 'DOUBLE'):
+    import arcpy
+
+    if field_name in [field.name for field in arcpy.ListFields(feature_class)]:
+        arcpy.DeleteField_management(in_table = feature_class, drop_field = field_name)
+    arcpy.AddField_management(in_table = feature_class, field_name = field_name, field_type = field_type)
+
+    rows = dict(zip(zone_index.object_ids, range(zone_index.field_count)))
+    with arcpy.da.UpdateCursor(feature_class, ['OID@', field_name]) as cursor:
+        for row in cursor:
+            r = rows.get(row[0])
+            if r is None or numpy.isnan(values[r]):
+                continue
+            row[1] = int(values[r]) if field_type in ('SHORT', 'LONG') else float(values[r])
+            cursor.updateRow(row)
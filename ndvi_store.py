@@ -0,0 +1,180 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             ndvi_store.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; field_ndvi.py and field_zones.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.30 Script Tool (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module keeps a time series of each agricultural field's mean NDVI and cloud fraction (ndvi_store directory within imagery directory), stored by column: one NumPy array file
+#                   per date and quantity (e.g. ndvi_20200601.npy, cloud_20200601.npy), each holding a value per field in order of object IDs, with a JSON index recording the composites
+#                   (name, size, and modification time) each date was calculated from. A store is keyed by a fingerprint of the fields (see field_zones.py) and by the Red band, NIR band,
+#                   and maximum cloud fraction, so that reshaped fields or different settings start a store of their own. Each run calculates NDVI only for dates missing from the store
+#                   (or whose composites have since been added, replaced, or removed), and returns the fields x dates matrix of every composite present in the imagery directory from the store.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Key stores and describe composites
+# 2. Read and write store
+# 3. Calculate dates missing from store
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, json, glob, shutil, hashlib, numpy, field_ndvi, field_zones
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of store directory (within imagery directory), and of JSON file recording dates within each store
+NDVI_STORE_DIRECTORY = 'ndvi_store'
+NDVI_STORE_INDEX = 'store_index.json'
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Key stores and describe composites
+
+# Return key of store of fields with fingerprint, calculated from Red and NIR bands with maximum cloud fraction
+def store_key(fingerprint, red_band, nir_band, max_cloud_fraction):
+    return hashlib.sha1(json.dumps([fingerprint, int(red_band), int(nir_band), float(max_cloud_fraction)]).encode('utf-8')).hexdigest()
+
+# Return signature of composites of a date (name, size, and modification time of each composite and of its cloud mask, if any), which changes whenever any of them is added, replaced, or removed
+def composite_signature(composites):
+    signature = []
+    for composite_path, image_date, cloud_mask in composites:
+        for file_path in [composite_path, cloud_mask]:
+            if file_path is None:
+                continue
+            file_stat = os.stat(file_path)
+            signature.append([os.path.basename(file_path), file_stat.st_size, int(file_stat.st_mtime)])
+    return sorted(signature)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Read and write store
+
+class NDVIStore(object):
+    """Columns of mean NDVI and cloud fraction of fields (one NumPy array file per date), with a JSON index of the signature of the composites each date was calculated from."""
+
+    def __init__(self, store_directory, feature_class, fingerprint, field_count, red_band, nir_band, max_cloud_fraction):
+        self.key = store_key(fingerprint, red_band, nir_band, max_cloud_fraction)
+        self.directory = os.path.join(store_directory, self.key)
+        self.index_path = os.path.join(self.directory, NDVI_STORE_INDEX)
+        self.field_count = field_count
+        os.makedirs(self.directory, exist_ok = True)
+
+        self.index = {'feature_class': feature_class, 'fingerprint': fingerprint, 'red_band': int(red_band), 'nir_band': int(nir_band), 'max_cloud_fraction': float(max_cloud_fraction), 'dates': {}}
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    self.index['dates'] = json.load(index_file)['dates']
+            except (ValueError, KeyError):
+                pass
+
+    def column_path(self, quantity, image_date):
+        return os.path.join(self.directory, '{}_{}.npy'.format(quantity, image_date))
+
+    # Return whether date is stored from composites of signature (dates skipped as cloudy are stored without columns)
+    def has(self, image_date, signature):
+        entry = self.index['dates'].get(image_date)
+        if entry is None or entry['signature'] != signature:
+            return False
+        return entry['skipped'] or all(os.path.isfile(self.column_path(q, image_date)) for q in ['ndvi', 'cloud'])
+
+    # Return whether date was skipped as every field was above maximum cloud fraction
+    def skipped(self, image_date):
+        return self.index['dates'][image_date]['skipped']
+
+    # Return columns of mean NDVI and cloud fraction of date
+    def read(self, image_date):
+        return numpy.load(self.column_path('ndvi', image_date)), numpy.load(self.column_path('cloud', image_date))
+
+    # Store columns of date (None where date was skipped), each written to a partial file renamed once complete
+    def write(self, image_date, signature, ndvi_column = None, cloud_column = None):
+        skipped = ndvi_column is None
+        for quantity, column in [('ndvi', ndvi_column), ('cloud', cloud_column)]:
+            column_path = self.column_path(quantity, image_date)
+            if skipped:
+                if os.path.isfile(column_path):
+                    os.remove(column_path)
+                continue
+            with open(column_path + '.partial', 'wb') as column_file:
+                numpy.save(column_file, numpy.asarray(column, dtype = numpy.float64))
+            os.replace(column_path + '.partial', column_path)
+        self.index['dates'][image_date] = {'signature': signature, 'skipped': skipped}
+
+    # Write index to a partial file renamed once complete, so that it is never left half written
+    def save(self):
+        with open(self.index_path + '.partial', 'w') as index_file:
+            json.dump(self.index, index_file, indent = 2)
+        os.replace(self.index_path + '.partial', self.index_path)
+
+# Delete stores of earlier versions of fields (e.g. before borders were reshaped), keeping stores of their current fingerprint (whatever their bands or maximum cloud fraction)
+def remove_stale_stores(store_directory, feature_class, fingerprint, messages = print):
+    removed = 0
+    for index_path in glob.glob(os.path.join(store_directory, '*', NDVI_STORE_INDEX)):
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+        except ValueError:
+            continue
+        if index.get('feature_class') == feature_class and index.get('fingerprint') != fingerprint:
+            shutil.rmtree(os.path.dirname(index_path))
+            removed += 1
+
+    if removed:
+        messages('Deleted {} NDVI store(s) of {} calculated before its fields changed'.format(removed, os.path.basename(feature_class)))
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Calculate dates missing from store
+
+# Return FIELD_IDs (in order of object IDs), dates (in chronological order), fields x dates matrices of mean NDVI and cloud fraction of composites (list of (composite_path, date, cloud_mask or None)),
+#   and dates calculated by this run; only dates missing from store (or whose composites changed) are calculated, several at once if requested, the rest are read from store (rebuild recalculates every date)
+def stored_field_ndvi_matrix(composites, feature_class, red_band, nir_band, store_directory, max_cloud_fraction = field_ndvi.DEFAULT_MAX_CLOUD_FRACTION, rebuild = False, max_workers = field_ndvi.DEFAULT_NDVI_WORKERS, chunk_size = field_ndvi.DEFAULT_NDVI_CHUNK_SIZE, messages = print):
+
+    # Fingerprint fields once, for key of store and of zone indexes alike
+    zone_cache = field_zones.FieldZoneCache(feature_class, messages = messages)
+    remove_stale_stores(store_directory, zone_cache.catalog_path, zone_cache.fingerprint, messages)
+    store = NDVIStore(store_directory, zone_cache.catalog_path, zone_cache.fingerprint, zone_cache.field_count, red_band, nir_band, max_cloud_fraction)
+
+    # Group composites by date (composites of the same date, e.g. adjacent tiles, fill each other's gaps)
+    date_composites = {}
+    for composite in composites:
+        date_composites.setdefault(composite[1], []).append(composite)
+
+    signatures = {d: composite_signature(c) for d, c in date_composites.items()}
+    new_dates = sorted(d for d in date_composites if rebuild or not store.has(d, signatures[d]))
+    messages('NDVI of {} date(s) taken from store {}; calculating {} new date(s)'.format(len(date_composites) - len(new_dates), store.directory, len(new_dates)))
+
+    # Calculate dates missing from store, recording dates skipped as cloudy so that they are not calculated again
+    if new_dates:
+        new_composites = [c for c in composites if c[1] in new_dates]
+        field_ids, calculated_dates, ndvi_matrix, cloud_matrix = field_ndvi.field_ndvi_matrix(new_composites, feature_class, red_band, nir_band, max_cloud_fraction, zone_cache = zone_cache, max_workers = max_workers, chunk_size = chunk_size, messages = messages)
+        for image_date in new_dates:
+            if image_date in calculated_dates:
+                column = calculated_dates.index(image_date)
+                store.write(image_date, signatures[image_date], ndvi_matrix[:, column], cloud_matrix[:, column])
+            else:
+                store.write(image_date, signatures[image_date])
+        store.save()
+
+    # Assemble matrices of every date present in imagery directory from store, in chronological order
+    dates = [d for d in sorted(date_composites) if not store.skipped(d)]
+    columns = [store.read(d) for d in dates]
+    ndvi_matrix = numpy.column_stack([c[0] for c in columns]) if dates else numpy.zeros((zone_cache.field_count, 0))
+    cloud_matrix = numpy.column_stack([c[1] for c in columns]) if dates else numpy.zeros((zone_cache.field_count, 0))
+
+    return zone_cache.field_ids, dates, ndvi_matrix, cloud_matrix, [d for d in new_dates if d in dates]
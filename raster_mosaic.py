@@ -0,0 +1,215 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             raster_mosaic.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy and GDAL Python bindings (osgeo)
+
+# Notes:            This module is imported by the 5.00 Script Tool (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module mosaics adjacent rasters (e.g. composites of neighbouring tiles on the same date) in priority order ("FIRST": where rasters overlap, the first valid pixel wins)
+#                   into a new raster, one block at a time, so that memory stays flat however large the mosaic. Each input's own nodata value is mapped onto the mosaic's nodata value.
+#                   It can instead write a virtual mosaic (GDAL VRT), a small XML descriptor referencing the inputs, which downstream tools read as a single raster without any pixels being copied.
+#                   Inputs are only ever read, never written, renamed, or deleted.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Define mosaic grid
+# 2. Write mosaic raster block by block
+# 3. Write virtual mosaic
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, numpy
+
+# GDAL is optional; without it 5.00 mosaics with ArcGIS instead
+try:
+    from osgeo import gdal, gdal_array, osr
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+    gdal_array = None
+    osr = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# GDAL driver of each mosaic output format: ERDAS IMAGINE (matching rasters generated by 5.00) or virtual mosaic
+MOSAIC_FORMATS = {'IMG': 'HFA', 'VRT': 'VRT'}
+DEFAULT_MOSAIC_FORMAT = 'IMG'
+
+# Size (pixels) of square blocks in which mosaic is written
+MOSAIC_BLOCK_SIZE = 1024
+
+# Nodata value of mosaic where none of its inputs has one
+DEFAULT_NODATA = 0
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Define mosaic grid
+
+class MosaicInput(object):
+    """Input raster of a mosaic, with its position (in pixels) on mosaic grid."""
+
+    def __init__(self, raster_path):
+        self.raster_path = raster_path
+        self.dataset = gdal.Open(raster_path)
+        self.geotransform = self.dataset.GetGeoTransform()
+        self.x_size = self.dataset.RasterXSize
+        self.y_size = self.dataset.RasterYSize
+        self.band_count = self.dataset.RasterCount
+        self.nodata = [self.dataset.GetRasterBand(b + 1).GetNoDataValue() for b in range(self.band_count)]
+        self.x_offset = 0
+        self.y_offset = 0
+
+    # Return window (x, y, columns, rows, on mosaic grid) where input overlaps block, or None
+    def overlap(self, x, y, columns, rows):
+        x_start, y_start = max(x, self.x_offset), max(y, self.y_offset)
+        x_end, y_end = min(x + columns, self.x_offset + self.x_size), min(y + rows, self.y_offset + self.y_size)
+        if x_end <= x_start or y_end <= y_start:
+            return None
+        return x_start, y_start, x_end - x_start, y_end - y_start
+
+# Check inputs share coordinate system, cell size, and band count, and place each on grid snapped to first (priority) input and covering all of them; return geotransform and size of grid
+def mosaic_grid(inputs):
+    first = inputs[0]
+    resolution_x, resolution_y = first.geotransform[1], first.geotransform[5]
+    first_reference = osr.SpatialReference(wkt = first.dataset.GetProjection())
+
+    for i in inputs[1:]:
+        if not osr.SpatialReference(wkt = i.dataset.GetProjection()).IsSame(first_reference):
+            raise ValueError('Coordinate system of {} differs from that of {}; reproject it before mosaicking'.format(os.path.basename(i.raster_path), os.path.basename(first.raster_path)))
+        if (i.geotransform[1], i.geotransform[5]) != (resolution_x, resolution_y):
+            raise ValueError('Cell size of {} differs from that of {}'.format(os.path.basename(i.raster_path), os.path.basename(first.raster_path)))
+        if i.band_count != first.band_count:
+            raise ValueError('{} has {} bands where {} has {}'.format(os.path.basename(i.raster_path), i.band_count, os.path.basename(first.raster_path), first.band_count))
+
+    # Offset (in whole pixels, snapped to first input) of each input from first input
+    for i in inputs:
+        i.x_offset = int(round((i.geotransform[0] - first.geotransform[0]) / resolution_x))
+        i.y_offset = int(round((i.geotransform[3] - first.geotransform[3]) / resolution_y))
+
+    x_start, y_start = min(i.x_offset for i in inputs), min(i.y_offset for i in inputs)
+    x_end, y_end = max(i.x_offset + i.x_size for i in inputs), max(i.y_offset + i.y_size for i in inputs)
+    for i in inputs:
+        i.x_offset -= x_start
+        i.y_offset -= y_start
+
+    geotransform = (first.geotransform[0] + x_start * resolution_x, resolution_x, 0.0, first.geotransform[3] + y_start * resolution_y, 0.0, resolution_y)
+    return geotransform, x_end - x_start, y_end - y_start
+
+# Return nodata value of mosaic: value given, or else that of first input band having one
+def mosaic_nodata(inputs, nodata = None):
+    if nodata is not None:
+        return nodata
+    for i in inputs:
+        for n in i.nodata:
+            if n is not None:
+                return n
+    return DEFAULT_NODATA
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Write mosaic raster block by block
+
+def write_mosaic(raster_paths, mosaic_raster, nodata = None, messages = print):
+
+    if gdal is None:
+        raise RuntimeError('GDAL Python bindings (osgeo) are required to mosaic rasters block by block')
+
+    inputs = [MosaicInput(r) for r in raster_paths]
+    geotransform, x_size, y_size = mosaic_grid(inputs)
+    nodata = mosaic_nodata(inputs, nodata)
+    first = inputs[0]
+    data_type = first.dataset.GetRasterBand(1).DataType
+
+    # Write mosaic to a partial raster renamed once complete, so that an interrupted mosaic is never mistaken for a complete one
+    driver = gdal.GetDriverByName(MOSAIC_FORMATS['IMG'])
+    target_raster = mosaic_raster + '.partial'
+    target = driver.Create(target_raster, x_size, y_size, first.band_count, data_type)
+
+    complete = False
+    try:
+        target.SetGeoTransform(geotransform)
+        target.SetProjection(first.dataset.GetProjection())
+        for b in range(first.band_count):
+            target.GetRasterBand(b + 1).SetNoDataValue(nodata)
+
+        for y in range(0, y_size, MOSAIC_BLOCK_SIZE):
+            rows = min(MOSAIC_BLOCK_SIZE, y_size - y)
+            for x in range(0, x_size, MOSAIC_BLOCK_SIZE):
+                columns = min(MOSAIC_BLOCK_SIZE, x_size - x)
+                overlaps = [(i, i.overlap(x, y, columns, rows)) for i in inputs]
+
+                for b in range(first.band_count):
+                    block = numpy.full((rows, columns), nodata, dtype = gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+                    filled = numpy.zeros((rows, columns), dtype = bool)
+
+                    # Fill pixels in priority order, each input only where no earlier input had a valid pixel (input's own nodata pixels are never taken)
+                    for i, window in overlaps:
+                        if window is None:
+                            continue
+                        window_x, window_y, window_columns, window_rows = window
+                        values = i.dataset.GetRasterBand(b + 1).ReadAsArray(window_x - i.x_offset, window_y - i.y_offset, window_columns, window_rows)
+                        block_rows = slice(window_y - y, window_y - y + window_rows)
+                        block_columns = slice(window_x - x, window_x - x + window_columns)
+                        take = ~filled[block_rows, block_columns]
+                        if i.nodata[b] is not None:
+                            take &= values != i.nodata[b]
+                        block[block_rows, block_columns][take] = values[take]
+                        filled[block_rows, block_columns] |= take
+
+                    target.GetRasterBand(b + 1).WriteArray(block, x, y)
+
+        complete = True
+    finally:
+        target = None
+        for i in inputs:
+            i.dataset = None
+        if not complete and os.path.exists(target_raster):
+            driver.Delete(target_raster)
+
+    if os.path.exists(mosaic_raster):
+        driver.Delete(mosaic_raster)
+    driver.Rename(mosaic_raster, target_raster)
+
+    messages('Mosaicked {} rasters into {} ({} x {} pixels, nodata {})'.format(len(inputs), mosaic_raster, x_size, y_size, nodata))
+    return mosaic_raster
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Write virtual mosaic
+
+# Write virtual mosaic (GDAL VRT) of rasters in priority order; GDAL takes overlapping pixels from the last source listed, so sources are listed lowest priority first
+def write_virtual_mosaic(raster_paths, mosaic_raster, nodata = None, messages = print):
+
+    if gdal is None:
+        raise RuntimeError('GDAL Python bindings (osgeo) are required to write a virtual mosaic')
+
+    inputs = [MosaicInput(r) for r in raster_paths]
+    mosaic_grid(inputs)
+    nodata = mosaic_nodata(inputs, nodata)
+
+    # Each source's own nodata value is kept from being drawn over earlier sources; where no input has one, mosaic's nodata value is used for all of them
+    source_nodata = None if any(n is not None for i in inputs for n in i.nodata) else nodata
+    for i in inputs:
+        i.dataset = None
+
+    options = gdal.BuildVRTOptions(resolution = 'highest', srcNodata = source_nodata, VRTNodata = nodata)
+    virtual_mosaic = gdal.BuildVRT(mosaic_raster, [os.path.abspath(r) for r in reversed(raster_paths)], options = options)
+    virtual_mosaic = None
+
+    messages('Wrote virtual mosaic of {} rasters: {}'.format(len(inputs), mosaic_raster))
+    return mosaic_raster
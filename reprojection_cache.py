@@ -0,0 +1,227 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             reprojection_cache.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         GDAL Python bindings (osgeo), optional; without them rasters are reprojected with ArcGIS (ArcGIS Pro license), one at a time; sentinel_composite.py (in same directory as this module)
+
+# Notes:            This module is imported by the 5.00 Script Tool (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+#                   Worker processes import this module rather than the tool script, as ArcGIS Pro script tools have no __main__ guard.
+
+# Description:      This module keeps a cache of reprojected rasters (reprojection_cache directory within image directory), keyed by a fingerprint of the source raster's content
+#                   (its size and samples of its bytes, so that a copied or renamed raster is still recognised), the target coordinate system, the resampling method, and the snap grid (cell size).
+#                   A raster already reprojected with the same key is taken straight from the cache; the rest are reprojected several at once in worker processes.
+#                   Once the cache exceeds its disk quota, the rasters used least recently are evicted first.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Fingerprint source rasters and key cache entries
+# 2. Reproject a single raster
+# 3. Record cache entries and evict least recently used
+# 4. Reproject rasters missing from cache, several at once
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, glob, json, time, hashlib, sentinel_composite
+
+# GDAL is optional; without it rasters are reprojected with ArcGIS
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of cache directory (within image directory), and of JSON file recording its entries
+CACHE_DIRECTORY = 'reprojection_cache'
+CACHE_INDEX = 'cache_index.json'
+
+# Disk quota of cache, in megabytes
+DEFAULT_CACHE_QUOTA_MB = 20480
+
+# Resampling methods (named as in ArcGIS Project Raster tool) and their GDAL equivalents
+RESAMPLING_METHODS = {'NEAREST': 'near', 'BILINEAR': 'bilinear', 'CUBIC': 'cubic', 'MAJORITY': 'mode'}
+DEFAULT_RESAMPLING = 'NEAREST'
+
+# Number of rasters reprojected at once (1 reprojects rasters one after another within the tool's own process)
+DEFAULT_REPROJECT_WORKERS = 1
+
+# Bytes read from start, middle, and end of a raster to fingerprint its content
+FINGERPRINT_SAMPLE_BYTES = 2 ** 20
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Fingerprint source rasters and key cache entries
+
+# Return fingerprint of raster's content (hash of its size and of samples from its start, middle, and end, and likewise of any ERDAS IMAGINE spill file), independent of its name, location, or modification time
+def raster_fingerprint(raster_path):
+    digest = hashlib.sha1()
+    for file_path in [raster_path, os.path.splitext(raster_path)[0] + '.ige']:
+        if not os.path.isfile(file_path):
+            continue
+        size = os.path.getsize(file_path)
+        digest.update(str(size).encode('ascii'))
+        with open(file_path, 'rb') as raster_file:
+            for offset in sorted(set([0, max(size // 2 - FINGERPRINT_SAMPLE_BYTES // 2, 0), max(size - FINGERPRINT_SAMPLE_BYTES, 0)])):
+                raster_file.seek(offset)
+                digest.update(raster_file.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+# Return key of cache entry: reprojection of raster with fingerprint onto target coordinate system (WKT or EPSG:xxxx) with resampling method, snapped to grid of cell size (None keeps cell size chosen by reprojection)
+def cache_key(fingerprint, target_crs, resampling, cell_size):
+    return hashlib.sha1(json.dumps([fingerprint, target_crs, resampling, cell_size]).encode('utf-8')).hexdigest()
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Reproject a single raster
+
+# Reproject raster into ERDAS IMAGINE raster at cache path (written to a partial raster renamed once complete), catching any failure so it is reported rather than raised
+def reproject_raster(source_raster, cached_raster, target_crs, resampling = DEFAULT_RESAMPLING, cell_size = None):
+    result = {'source_raster': source_raster, 'cached_raster': cached_raster, 'seconds': 0.0, 'error': None}
+    start = time.time()
+
+    try:
+        if gdal is not None:
+            partial_raster = cached_raster + '.partial'
+            driver = gdal.GetDriverByName('HFA')
+
+            # Snap output to grid of cell size (cells aligned to multiples of cell size), as ArcGIS does with a snap raster on that grid
+            options = gdal.WarpOptions(format = 'HFA', dstSRS = target_crs, resampleAlg = RESAMPLING_METHODS[resampling], xRes = cell_size, yRes = cell_size, targetAlignedPixels = cell_size is not None, multithread = True)
+            try:
+                gdal.Warp(partial_raster, source_raster, options = options)
+            except Exception:
+                if os.path.exists(partial_raster):
+                    driver.Delete(partial_raster)
+                raise
+            driver.Rename(cached_raster, partial_raster)
+
+        else:
+            # Import arcpy only when needed, as worker processes reprojecting with GDAL do not need it
+            import arcpy
+            arcpy.ProjectRaster_management(in_raster = source_raster, out_raster = cached_raster, out_coor_system = target_crs, resampling_type = resampling, cell_size = cell_size)
+
+    except Exception as e:
+        result['error'] = str(e)
+
+    result['seconds'] = time.time() - start
+    return result
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Record cache entries and evict least recently used
+
+class ReprojectionCache(object):
+    """Directory of reprojected rasters with a JSON index of their keys, sources, sizes, and when each was last used."""
+
+    def __init__(self, cache_directory, quota_mb = DEFAULT_CACHE_QUOTA_MB):
+        self.cache_directory = cache_directory
+        self.quota_bytes = quota_mb * 2 ** 20
+        self.index_path = os.path.join(cache_directory, CACHE_INDEX)
+        os.makedirs(cache_directory, exist_ok = True)
+
+        self.entries = {}
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    self.entries = json.load(index_file)
+            except ValueError:
+                self.entries = {}
+
+    def cached_raster(self, key):
+        return os.path.join(self.cache_directory, key + '.img')
+
+    # Return cached raster of key (marking it used), or None if it is not cached
+    def lookup(self, key):
+        if key in self.entries and os.path.isfile(self.cached_raster(key)):
+            self.entries[key]['last_used'] = time.time()
+            return self.cached_raster(key)
+        self.entries.pop(key, None)
+        return None
+
+    # Record raster reprojected into cache, with its size on disk (including any spill file)
+    def add(self, key, source_raster):
+        size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(self.cache_directory, key + '.*')))
+        self.entries[key] = {'source_raster': source_raster, 'bytes': size, 'last_used': time.time()}
+
+    # Delete rasters used least recently until cache fits within quota, keeping those in use (e.g. by current run)
+    def evict(self, keep_keys, messages = print):
+        total = sum(e['bytes'] for e in self.entries.values())
+        for key in sorted(self.entries, key = lambda k: self.entries[k]['last_used']):
+            if total <= self.quota_bytes:
+                break
+            if key in keep_keys:
+                continue
+            for cached_file in glob.glob(os.path.join(self.cache_directory, key + '.*')):
+                os.remove(cached_file)
+            total -= self.entries[key]['bytes']
+            messages('Evicted reprojection of {} from cache ({:.1f} MB)'.format(os.path.basename(self.entries[key]['source_raster']), self.entries[key]['bytes'] / 2 ** 20))
+            del self.entries[key]
+
+    # Write index to a partial file renamed once complete, so that it is never left half written
+    def save(self):
+        with open(self.index_path + '.partial', 'w') as index_file:
+            json.dump(self.entries, index_file, indent = 2)
+        os.replace(self.index_path + '.partial', self.index_path)
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Reproject rasters missing from cache, several at once
+
+# Return cached reprojection of each raster (in order given), reprojecting those missing from cache, several at once in worker processes if requested (GDAL only)
+def reproject_rasters(raster_paths, target_crs, cache_directory, resampling = DEFAULT_RESAMPLING, cell_size = None, max_workers = DEFAULT_REPROJECT_WORKERS, quota_mb = DEFAULT_CACHE_QUOTA_MB, messages = print):
+
+    cache = ReprojectionCache(cache_directory, quota_mb)
+
+    keys = [cache_key(raster_fingerprint(r), target_crs, resampling, cell_size) for r in raster_paths]
+    cached_rasters = {}
+    misses = {}
+    for raster_path, key in zip(raster_paths, keys):
+        cached_raster = cache.lookup(key)
+        if cached_raster is not None:
+            messages('Reprojection of {} taken from cache: {}'.format(raster_path, cached_raster))
+            cached_rasters[key] = cached_raster
+        else:
+            misses.setdefault(key, raster_path)
+
+    jobs = [(misses[k], cache.cached_raster(k), target_crs, resampling, cell_size) for k in misses]
+    results = []
+
+    # Reproject rasters one after another within tool's own process when a single worker is requested (or ArcGIS reprojects them)
+    if max_workers <= 1 or len(jobs) <= 1 or gdal is None:
+        results = [reproject_raster(*job) for job in jobs]
+
+    else:
+        with sentinel_composite.worker_pool(max_workers) as executor:
+            results = list(executor.map(reproject_raster, *zip(*jobs)))
+
+    failures = []
+    for key, result in zip(misses, results):
+        if result['error']:
+            failures.append('{}: {}'.format(result['source_raster'], result['error']))
+            continue
+        messages('Reprojected {} in {:.0f} s: {}'.format(result['source_raster'], result['seconds'], result['cached_raster']))
+        cache.add(key, result['source_raster'])
+        cached_rasters[key] = result['cached_raster']
+
+    # Keep cache within quota (never evicting rasters of this run), and record it
+    cache.evict(set(keys), messages)
+    cache.save()
+
+    if failures:
+        raise RuntimeError('Could not reproject ' + '; '.join(failures))
+
+    return [cached_rasters[k] for k in keys]
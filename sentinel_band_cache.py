@@ -0,0 +1,149 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_band_cache.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         GDAL Python bindings (osgeo)
+
+# Notes:            This module is imported by sentinel_composite.py and sentinel_ingest.py (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+#                   Worker processes read and fill the cache on their own; only the tool's own process evicts from it, once compositing has finished.
+
+# Description:      This module keeps a cache of decoded Sentinel-2 band files (band_cache directory within output directory), keyed by granule ID and band file name
+#                   (e.g. band_cache/L1C_T11SPS_A025786_20200601T184921/T11SPS_20200601T184921_B02.tif), each stored at its native resolution as a tiled, losslessly compressed GeoTIFF.
+#                   The JPEG2000 band files are decoded once, the first time a product is composited; re-compositing the same products with a different band set (or resolution, or resampling method)
+#                   then reads the cached bands, which decompress far faster than JPEG2000 decodes, so that a new composite mostly becomes a matter of stacking and writing.
+#                   Once the cache exceeds its disk quota, the band files used least recently (by modification time, refreshed on every use) are evicted first.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Name cached band files by granule ID and band
+# 2. Decode band files into cache, or take them from it
+# 3. Evict band files used least recently
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, re, glob
+
+# GDAL is optional; without it band files are composited with ArcGIS and never cached
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of cache directory (within output directory)
+BAND_CACHE_DIRECTORY = 'band_cache'
+
+# Disk quota of cache, in megabytes (0 turns cache off)
+DEFAULT_BAND_CACHE_MB = 20480
+
+# Extension and creation options of cached band files (tiled and losslessly compressed with horizontal differencing, like Cloud-Optimized GeoTIFF composites, so that windows decompress only the tiles they touch)
+BAND_CACHE_EXTENSION = '.tif'
+BAND_CACHE_BLOCK_SIZE = 512
+BAND_CACHE_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=' + str(BAND_CACHE_BLOCK_SIZE), 'BLOCKYSIZE=' + str(BAND_CACHE_BLOCK_SIZE), 'COMPRESS=DEFLATE', 'PREDICTOR=2', 'BIGTIFF=IF_SAFER']
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Name cached band files by granule ID and band
+
+# Return granule ID of band file (name of its folder within GRANULE directory, e.g. L1C_T11SPS_A025786_20200601T184921), whether read from zip file (/vsizip/) or SAFE directory
+def granule_id(band_path):
+    parts = [p for p in re.split(r'[\\/]', band_path) if p]
+    if 'GRANULE' in parts[:-1]:
+        return parts[parts.index('GRANULE') + 1]
+
+    # Band files outside a GRANULE directory are keyed by their own folder
+    return parts[-2] if len(parts) > 1 else 'band_files'
+
+# Return path of cached band file within cache directory, e.g. band_cache/L1C_T11SPS_A025786_20200601T184921/T11SPS_20200601T184921_B02.tif
+def cached_band_name(band_path, cache_directory):
+    return os.path.join(cache_directory, granule_id(band_path), os.path.splitext(re.split(r'[\\/]', band_path)[-1])[0] + BAND_CACHE_EXTENSION)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Decode band files into cache, or take them from it
+
+# Decode band file into cached band file (written to a partial file, named for this process, renamed once complete)
+def decode_band(band_path, cached_band):
+    os.makedirs(os.path.dirname(cached_band), exist_ok = True)
+    partial_band = '{}.{}.partial'.format(cached_band, os.getpid())
+
+    options = gdal.TranslateOptions(format = 'GTiff', creationOptions = BAND_CACHE_CREATION_OPTIONS)
+    try:
+        gdal.Translate(partial_band, band_path, options = options)
+    except Exception:
+        if os.path.exists(partial_band):
+            os.remove(partial_band)
+        raise
+    os.replace(partial_band, cached_band)
+
+    return cached_band
+
+# Return path to read each band file from (in order given): its cached band file where cached (marking it used), else band file decoded into cache where fill is True,
+#   else band file itself (e.g. when compositing is cropped to an area of interest, as decoding whole band to fill cache would cost more than the cropped composite saves)
+def cached_band_paths(band_paths, cache_directory, fill = True):
+    if gdal is None or cache_directory is None:
+        return list(band_paths)
+
+    read_paths = []
+    for band_path in band_paths:
+        cached_band = cached_band_name(band_path, cache_directory)
+        if os.path.isfile(cached_band):
+            os.utime(cached_band, None)
+            read_paths.append(cached_band)
+        elif fill:
+            read_paths.append(decode_band(band_path, cached_band))
+        else:
+            read_paths.append(band_path)
+
+    return read_paths
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Evict band files used least recently
+
+# Delete cached band files used least recently (and partial files left by interrupted runs) until cache fits within quota; return number of megabytes evicted
+def evict_bands(cache_directory, quota_mb = DEFAULT_BAND_CACHE_MB, messages = print):
+    if not os.path.isdir(cache_directory):
+        return 0.0
+
+    for partial_band in glob.glob(os.path.join(cache_directory, '*', '*.partial')):
+        os.remove(partial_band)
+
+    cached_bands = sorted(glob.glob(os.path.join(cache_directory, '*', '*' + BAND_CACHE_EXTENSION)), key = os.path.getmtime)
+    sizes = {c: os.path.getsize(c) for c in cached_bands}
+    total = sum(sizes.values())
+    quota_bytes = quota_mb * 2 ** 20
+
+    evicted = 0
+    for cached_band in cached_bands:
+        if total <= quota_bytes:
+            break
+        os.remove(cached_band)
+        total -= sizes[cached_band]
+        evicted += sizes[cached_band]
+
+    # Remove granule folders left empty
+    for granule_directory in glob.glob(os.path.join(cache_directory, '*')):
+        if os.path.isdir(granule_directory) and not os.listdir(granule_directory):
+            os.rmdir(granule_directory)
+
+    if evicted:
+        messages('Evicted {:.1f} MB of decoded band files from band cache ({:.1f} MB kept, quota {} MB)'.format(evicted / 2 ** 20, total / 2 ** 20, quota_mb))
+
+    return evicted / 2 ** 20
@@ -0,0 +1,260 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_catalog.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         Python standard library only (sqlite3)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module keeps a persistent catalog (SQLite database within the output directory) of Sentinel-2 Level-1C products, keyed by product UUID.
+#                   It records query results (tile, relative orbit, sensing date, cloud cover, size), download status and checksum, SAFE extraction status,
+#                   and the composite rasters produced for each band set, so that a rerun only has to ask the catalog what is missing
+#                   instead of scanning the output directory and asking the hub again. It also holds the queue of offline products awaiting
+#                   retrieval from the Long Term Archive, so an interrupted session can pick the queue back up.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Parse tile, relative orbit, and sensing date from product title
+# 2. Open catalog and create tables and indexes
+# 3. Record query results, downloads, extractions, and composites
+# 4. Find work that is missing
+# 5. Queue offline products for retrieval from the Long Term Archive
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, re, glob, sqlite3, zipfile, datetime
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of catalog database created within output directory
+CATALOG_NAME = 'sentinel_catalog.sqlite'
+
+# Download statuses for which product zip file is present and verified
+DOWNLOADED_STATUSES = ('downloaded', 'exists')
+
+#--------------------------------------------
+
+# 0.2 Define tables and indexes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    uuid TEXT PRIMARY KEY,
+    title TEXT UNIQUE NOT NULL,
+    tile TEXT,
+    orbit TEXT,
+    sensing_date TEXT,
+    cloud_cover REAL,
+    size_bytes INTEGER,
+    download_status TEXT NOT NULL DEFAULT 'pending',
+    checksum TEXT,
+    zip_path TEXT,
+    safe_status TEXT NOT NULL DEFAULT 'pending',
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS products_tile_date ON products (tile, sensing_date);
+CREATE INDEX IF NOT EXISTS products_download_status ON products (download_status);
+
+CREATE TABLE IF NOT EXISTS composites (
+    uuid TEXT NOT NULL REFERENCES products (uuid),
+    band_set TEXT NOT NULL,
+    composite_path TEXT NOT NULL,
+    created TEXT,
+    PRIMARY KEY (uuid, band_set)
+);
+CREATE INDEX IF NOT EXISTS composites_band_set ON composites (band_set);
+
+CREATE TABLE IF NOT EXISTS lta_requests (
+    uuid TEXT PRIMARY KEY REFERENCES products (uuid),
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    triggered_at REAL,
+    next_poll REAL NOT NULL DEFAULT 0,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS lta_requests_status ON lta_requests (status);
+"""
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Parse tile, relative orbit, and sensing date from product title (e.g. S2A_MSIL1C_20200601T184921_N0209_R070_T10SFG_20200601T221039)
+
+PRODUCT_TITLE_PATTERN = re.compile(r'^S2[AB]_MSIL1C_(?P<sensing_date>\d{8})T\d{6}_N\d{4}_(?P<orbit>R\d{3})_(?P<tile>T\d{2}[A-Z]{3})_')
+
+def parse_product_title(title):
+    match = PRODUCT_TITLE_PATTERN.match(title)
+    if match is None:
+        return {'tile': None, 'orbit': None, 'sensing_date': None}
+    return match.groupdict()
+
+# Convert size string reported by hub query (e.g. '791.84 MB') into bytes
+def parse_size(size):
+    units = {'B': 1, 'KB': 2 ** 10, 'MB': 2 ** 20, 'GB': 2 ** 30}
+    try:
+        value, unit = str(size).split()
+        return int(float(value) * units[unit.upper()])
+    except (ValueError, KeyError):
+        return None
+
+def timestamp():
+    return datetime.datetime.now().isoformat(timespec = 'seconds')
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Open catalog and create tables and indexes
+
+class ProductCatalog(object):
+    """SQLite catalog of Sentinel-2 products, their downloads, extractions, and composites."""
+
+    def __init__(self, directory_path):
+        self.directory_path = directory_path
+        self.database_path = os.path.join(directory_path, CATALOG_NAME)
+
+        # Wait up to 30 seconds for a lock, as the Long Term Archive scheduler writes to catalog from its own thread
+        self.connection = sqlite3.connect(self.database_path, timeout = 30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Record query results, downloads, extractions, and composites
+
+    # Record products returned from query (sentinelsat DataFrame indexed by UUID), keeping any download and extraction status already recorded
+    def record_products(self, products_df):
+        rows = []
+        for uuid, product in products_df.iterrows():
+            parsed = parse_product_title(product['title'])
+            rows.append((uuid, product['title'], parsed['tile'], parsed['orbit'], parsed['sensing_date'], float(product['cloudcoverpercentage']), parse_size(product['size']), timestamp()))
+
+        with self.connection:
+            # Replace title standing in for UUID of products recorded from disk before a query returned them
+            self.connection.executemany('UPDATE composites SET uuid = ? WHERE uuid = ?', [(r[0], r[1]) for r in rows])
+            self.connection.executemany('UPDATE products SET uuid = ? WHERE title = ? AND uuid = title', [(r[0], r[1]) for r in rows])
+
+            self.connection.executemany('INSERT OR IGNORE INTO products (uuid, title, tile, orbit, sensing_date, cloud_cover, size_bytes, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('UPDATE products SET cloud_cover = ?, size_bytes = ? WHERE uuid = ?', [(r[5], r[6], r[0]) for r in rows])
+
+    # Record zip file found on disk (e.g. by tool 0.26) that was not downloaded through a query; its title stands in for the unknown UUID
+    def record_local_product(self, zip_path):
+
+        # Take title from SAFE directory within zip file, as zip files downloaded from USGS Earth Explorer (L1C_T*.zip) are named differently
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            title = zip_ref.namelist()[0].split('/')[0].replace('.SAFE', '')
+
+        parsed = parse_product_title(title)
+
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO products (uuid, title, tile, orbit, sensing_date, size_bytes, updated) VALUES (?, ?, ?, ?, ?, ?, ?)', (title, title, parsed['tile'], parsed['orbit'], parsed['sensing_date'], os.path.getsize(zip_path), timestamp()))
+            self.connection.execute("UPDATE products SET download_status = 'exists', zip_path = ? WHERE title = ? AND download_status NOT IN ('downloaded', 'exists')", (zip_path, title))
+
+        return self.connection.execute('SELECT uuid FROM products WHERE title = ?', (title,)).fetchone()['uuid']
+
+    # Record every Sentinel-2 Level-1C zip file (downloaded from Copernicus Open Access Hub or USGS Earth Explorer) in directory; zip files already recorded keep their status, so it is run every time a tool opens the catalog
+    def import_local_products(self):
+        for z in glob.glob(os.path.join(self.directory_path, 'S2?_MSIL1C*.zip')) + glob.glob(os.path.join(self.directory_path, 'L1C_T*.zip')):
+            self.record_local_product(z)
+
+    # Record outcome of downloads (list of result dictionaries returned by sentinel_download.download_products)
+    def record_downloads(self, results):
+        rows = []
+        for r in results:
+            zip_path = os.path.join(self.directory_path, r['title'] + '.zip') if r['title'] else None
+            rows.append((r['status'], r.get('md5'), zip_path, timestamp(), r['id']))
+
+        with self.connection:
+            self.connection.executemany('UPDATE products SET download_status = ?, checksum = COALESCE(?, checksum), zip_path = ?, updated = ? WHERE uuid = ?', rows)
+
+    # Record that SAFE directory of product has been extracted (or that extraction failed)
+    def record_extraction(self, uuid, status = 'extracted'):
+        with self.connection:
+            self.connection.execute('UPDATE products SET safe_status = ?, updated = ? WHERE uuid = ?', (status, timestamp(), uuid))
+
+    # Record composite raster generated from product for band set (e.g. '2-4_8', or composite key naming its resolution, resampling, or crop, see sentinel_composite.composite_key)
+    def record_composite(self, uuid, band_set, composite_path):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO composites (uuid, band_set, composite_path, created) VALUES (?, ?, ?, ?)', (uuid, band_set, composite_path, timestamp()))
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Find work that is missing
+
+    # Return UUIDs (from those passed) whose zip file has not been downloaded and verified, or whose recorded zip file has since been removed
+    def missing_downloads(self, uuids):
+        missing = []
+        for uuid in uuids:
+            row = self.connection.execute('SELECT download_status, zip_path FROM products WHERE uuid = ?', (uuid,)).fetchone()
+            if row is None or row['download_status'] not in DOWNLOADED_STATUSES or not row['zip_path'] or not os.path.isfile(row['zip_path']):
+                missing.append(uuid)
+        return missing
+
+    # Return downloaded products (rows with uuid, title, zip_path, and safe_status) lacking a composite for band set (with file extension, if given), or whose recorded composite has since been removed
+    #   or is not current (where is_current, taking the composite's path, is given)
+    def missing_composites(self, band_set, extension = None, is_current = None):
+        rows = self.connection.execute("""
+            SELECT p.uuid, p.title, p.zip_path, p.safe_status, c.composite_path
+            FROM products p
+            LEFT JOIN composites c ON c.uuid = p.uuid AND c.band_set = ?
+            WHERE p.download_status IN ('downloaded', 'exists') AND p.title LIKE 'S2_\\_MSIL1C%' ESCAPE '\\'
+            ORDER BY p.sensing_date, p.tile""", (band_set,)).fetchall()
+        return [r for r in rows if r['composite_path'] is None or not os.path.isfile(r['composite_path']) or (extension is not None and not r['composite_path'].endswith(extension)) or (is_current is not None and not is_current(r['composite_path']))]
+
+    # Return every product with its download, extraction, and size, and the composite recorded for band set (if any), in a single pass for planning a run
+    def work_state(self, band_set = None):
+        return self.connection.execute("""
+            SELECT p.uuid, p.title, p.download_status, p.zip_path, p.size_bytes, p.safe_status, c.composite_path
+            FROM products p
+            LEFT JOIN composites c ON c.uuid = p.uuid AND c.band_set = ?
+            ORDER BY p.sensing_date, p.tile""", (band_set,)).fetchall()
+
+    # Return composite raster recorded for product and band set, provided it still exists on disk
+    def composite_path(self, uuid, band_set):
+        row = self.connection.execute('SELECT composite_path FROM composites WHERE uuid = ? AND band_set = ?', (uuid, band_set)).fetchone()
+        if row is not None and os.path.isfile(row['composite_path']):
+            return row['composite_path']
+        return None
+
+#----------------------------------------------------------------------------------------------
+
+# 5. Queue offline products for retrieval from the Long Term Archive
+
+    # Add offline products to queue (products already queued keep their progress; products an earlier session gave up on are queued afresh)
+    def queue_lta_requests(self, uuids):
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO lta_requests (uuid, updated) VALUES (?, ?)", [(u, timestamp()) for u in uuids])
+            self.connection.executemany("UPDATE lta_requests SET status = 'pending', attempts = 0, triggered_at = NULL, next_poll = 0, updated = ? WHERE uuid = ? AND status = 'failed'", [(timestamp(), u) for u in uuids])
+
+    # Return queued products not yet downloaded (rows with uuid, status, attempts, triggered_at, and next_poll)
+    def pending_lta_requests(self):
+        return self.connection.execute("SELECT uuid, status, attempts, triggered_at, next_poll FROM lta_requests WHERE status IN ('pending', 'triggered') ORDER BY next_poll").fetchall()
+
+    # Update progress of queued product (status is one of: pending, triggered, downloaded, failed)
+    def update_lta_request(self, uuid, status, attempts, triggered_at, next_poll):
+        with self.connection:
+            self.connection.execute('UPDATE lta_requests SET status = ?, attempts = ?, triggered_at = ?, next_poll = ?, updated = ? WHERE uuid = ?', (status, attempts, triggered_at, next_poll, timestamp(), uuid))
+
+    # Return time (seconds since epoch) of most recent retrieval request, so the hub quota carries over between sessions
+    def last_lta_trigger(self):
+        row = self.connection.execute('SELECT MAX(triggered_at) AS last FROM lta_requests').fetchone()
+        return row['last'] or 0.0
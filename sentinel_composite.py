@@ -0,0 +1,835 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_composite.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         ArcGIS Pro license (for compositing extracted SAFE directories where GDAL is unavailable); GDAL Python bindings (osgeo), optional; without them the 0.2x tools fall back to extracting band files and compositing with ArcGIS (as ERDAS IMAGINE only); sentinel_safe.py, sentinel_manifest.py, and sentinel_band_cache.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+#                   Worker processes import this module rather than the tool script, as ArcGIS Pro script tools have no __main__ guard.
+
+# Description:      This module composites user-selected Sentinel-2 Level-1C bands straight out of the product zip file, reading each band's JPEG2000 file
+#                   through GDAL's /vsizip/ virtual file system and writing the multiband ERDAS IMAGINE (.img) composite directly, so that no SAFE directory
+#                   is ever written to disk. Bands of coarser resolution (20 m: 05, 06, 07, 11, 12; 60 m: 01, 09, 10) are resampled onto the common 10 m grid
+#                   (nearest, bilinear, or average) in NumPy as the composite is written, one window at a time: windows are aligned to the band files' JPEG2000 tiles and sized
+#                   to a memory budget, and bands are read and written one at a time within each window, so peak memory stays flat however many bands are selected.
+#                   Composites can be cropped to the window around an area of interest (plus a buffer), so that only the band file tiles it intersects are decoded; a cropped composite is named (and keyed in the catalog) with a token identifying its crop, so it never stands in for the full tile or another crop; likewise composites at a resolution or with a resampling method other than the default. Composites can instead be written as tiled, losslessly compressed Cloud-Optimized GeoTIFFs (.tif) with overviews, whose
+#                   per-band statistics and histograms are gathered while the band files are decoded, so that later tools reading small windows touch only the tiles they need.
+#                   Alongside each composite, the tile's Level-1C cloud mask (raster from processing baseline 04.00, GML polygons before) is rasterised onto the same grid (*_cloudmask.tif: 0 clear, 1 opaque cloud, 2 cirrus),
+#                   so that later tools can screen cloudy fields before computing indices from the composite. A JSON manifest (*.img.json or *.tif.json; see sentinel_manifest.py) recording the composite's
+#                   grid, bands, product metadata, and the statistics gathered while writing is written alongside it, so that later tools need not open or describe the composite.
+#                   Decoded band files can be kept in a cache (see sentinel_band_cache.py), so that re-compositing the same products with a different band set skips JPEG2000 decoding.
+#                   It also composites several products at once, each in its own worker process with a memory cap,
+#                   so that JPEG2000 decoding runs on every core and a product that fails (or exhausts its memory) does not take the others down with it.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Name composite raster and find band files within product zip file
+# 2. Resample band files onto a common grid
+# 3. Write composite raster (Cloud-Optimized GeoTIFF with statistics and histograms gathered in the same pass)
+# 3.1 Rasterise cloud mask onto composite grid
+# 3.2 Write manifest of composite raster
+# 4. Composite band files read straight from product zip file
+# 5. Composite band files extracted to SAFE directory
+# 6. Composite several products at once in worker processes
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, re, sys, json, time, ctypes, hashlib, zipfile, contextlib, multiprocessing, concurrent.futures, numpy, sentinel_safe, sentinel_manifest, sentinel_band_cache
+
+# Address space limit is only available on POSIX systems; on Windows the memory cap is enforced with a job object instead
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# GDAL is optional; zip-native compositing is only available where it is installed
+try:
+    from osgeo import gdal, osr
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+    osr = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# File extension of each composite output format: ERDAS IMAGINE (matching composites generated by arcpy.CompositeBands_management) or Cloud-Optimized GeoTIFF
+OUTPUT_FORMATS = {'IMG': '.img', 'COG': '.tif'}
+DEFAULT_OUTPUT_FORMAT = 'IMG'
+
+# GDAL driver writing ERDAS IMAGINE composites
+IMG_DRIVER = 'HFA'
+
+# Tile size (pixels) of Cloud-Optimized GeoTIFF composites, and number of histogram buckets recorded for each band
+COG_BLOCK_SIZE = 512
+HISTOGRAM_BUCKETS = 256
+
+# Creation options of Cloud-Optimized GeoTIFF composites (lossless DEFLATE compression with horizontal differencing, overviews taken from staging raster);
+#   GTiff driver options give the same layout where GDAL predates its COG driver (GDAL 3.1)
+COG_CREATION_OPTIONS = ['COMPRESS=DEFLATE', 'PREDICTOR=2', 'BLOCKSIZE=' + str(COG_BLOCK_SIZE), 'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER']
+GTIFF_COG_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=' + str(COG_BLOCK_SIZE), 'BLOCKYSIZE=' + str(COG_BLOCK_SIZE), 'COMPRESS=DEFLATE', 'PREDICTOR=2', 'COPY_SRC_OVERVIEWS=YES', 'BIGTIFF=IF_SAFER']
+
+# Creation options of tiled staging raster from which overviews and Cloud-Optimized GeoTIFF are written (fast compression, as it is deleted afterwards)
+STAGING_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=' + str(COG_BLOCK_SIZE), 'BLOCKYSIZE=' + str(COG_BLOCK_SIZE), 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
+# Suffix of cloud mask raster written alongside each composite, and Level-1C quality masks it is rasterised from, in order of preference (raster mask from processing baseline 04.00, GML polygons before)
+CLOUD_MASK_SUFFIX = '_cloudmask.tif'
+CLOUD_MASK_FILES = ['MSK_CLASSI_B00.jp2', 'MSK_CLOUDS_B00.gml']
+
+# Values of cloud mask raster, and its creation options (tiled like Cloud-Optimized GeoTIFF composites, and losslessly compressed)
+CLEAR, OPAQUE_CLOUD, CIRRUS = 0, 1, 2
+CLOUD_MASK_CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=' + str(COG_BLOCK_SIZE), 'BLOCKYSIZE=' + str(COG_BLOCK_SIZE), 'COMPRESS=DEFLATE']
+
+# Native resolution (m) of each band, common grid resolution of composites, and methods of resampling band files of other resolutions onto it
+BAND_RESOLUTIONS = {'01': 60, '02': 10, '03': 10, '04': 10, '05': 20, '06': 20, '07': 20, '08': 10, '09': 60, '10': 60, '11': 20, '12': 20}
+DEFAULT_RESOLUTION = 10
+RESAMPLING_METHODS = ['NEAREST', 'BILINEAR', 'AVERAGE']
+DEFAULT_RESAMPLING = 'NEAREST'
+
+# Pixels of common grid added around area of interest when cropping composites to it, and points along each edge of area of interest's bounds projected into tile's coordinate system
+DEFAULT_CROP_BUFFER = 10
+CROP_EDGE_POINTS = 21
+
+# Tokens appended to band set in names (and catalog keys) of composites: grid resolution where it is not the default (e.g. '_20m'), resampling method where it is not the default and some band is resampled
+#   (e.g. '_bilinear'), and, for composites cropped to an area of interest, '_crop' followed by the first 8 hexadecimal digits of the SHA-1 of the crop's bounds and buffer;
+#   and pattern of the tokens that may follow band set in composite names (full-tile composites at default resolution and resampling carry none, so that composites named before these settings existed keep their names)
+CROP_TOKEN = '_crop'
+COMPOSITE_VARIANT_PATTERN = '(?:_\\d+m)?(?:_(?:' + '|'.join(m.lower() for m in RESAMPLING_METHODS) + '))?(?:_crop[0-9a-f]{8})?'
+
+# Width and height (m) of a Sentinel-2 tile, by which a full-tile composite whose manifest predates crops being recorded is told from a cropped one
+TILE_EXTENT = 109800
+
+# Share of memory budget given to window buffers (GDAL block cache gets a quarter, and the rest is left to JPEG2000 decoder and Python),
+#   and working bytes per window pixel of a single band (decoded block, resampling temporaries, and value counts)
+WINDOW_MEMORY_SHARE = 0.5
+WINDOW_BYTES_PER_PIXEL = 48
+
+# Number of products composited at once (1 composites products one after another within the tool's own process)
+DEFAULT_COMPOSITE_WORKERS = 1
+
+# Memory cap per worker process, in megabytes
+DEFAULT_WORKER_MEMORY_MB = 2048
+
+# Set once memory cap has been applied within a worker process, and job object capping it on Windows (kept open for life of worker process)
+worker_memory_limited = False
+worker_memory_job = None
+
+# Windows job object information class and limit flag capping memory committed by each process assigned to job
+JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS = 9
+JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x00000100
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Name composite raster and find band files within product zip file
+
+# Return identifier of crop (first 8 hexadecimal digits of SHA-1 of its bounds, rounded to a micro-degree, and buffer), so that composites cropped to different areas of interest are told apart
+def crop_id(crop):
+    return hashlib.sha1(json.dumps([round(float(c), 6) for c in crop[:4]] + [int(crop[4])]).encode('utf-8')).hexdigest()[:8]
+
+# Return list of band numbers (e.g. ['02', '03', '04', '08']) of band set (e.g. '2-4_8') or composite key (leaving out any resolution, resampling, or crop token)
+def band_set_bands(band_set):
+    bands_list = []
+    for chunk in [c for c in band_set.split('_') if re.match(r'^\d+(?:-\d+)?$', c)]:
+        first, last = (chunk.split('-') + [chunk])[:2]
+        bands_list += [str(b).zfill(2) for b in range(int(first), int(last) + 1)]
+    return bands_list
+
+# Return key of composites of band set (e.g. '2-4_8') on grid of resolution, resampled with method, and cropped to crop (if any), naming them and keying them in product catalog
+#   (e.g. '2-4_8' for full tile at 10 m, '2-4_8_20m' at 20 m, '5-7_bilinear' resampled bilinearly onto 10 m grid, '2-4_8_crop1f3a9c0d' cropped)
+def composite_key(band_set, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, crop = None):
+    key = band_set
+    if int(resolution) != DEFAULT_RESOLUTION:
+        key += '_{}m'.format(int(resolution))
+    if resampling != DEFAULT_RESAMPLING and needs_resampling(band_set_bands(band_set), int(resolution)):
+        key += '_' + resampling.lower()
+    if crop is not None:
+        key += CROP_TOKEN + crop_id(crop)
+    return key
+
+# Assign name of composite raster associated with product and based on user-selected bands (with any crop, see composite_key) using the following nomenclature:
+#   S2_MSIL1C_YYYYMMDD_Rxxx_Txxxxx_Bx_.img (or .tif for Cloud-Optimized GeoTIFF)
+#   (i.e. S2_ProductLevel1C_SensingDate_RelativeOrbitNumber_TileNumber_BandsComposited.img, or S2_ProductLevel1C_SensingDate_RelativeOrbitNumber_TileNumber_BandsComposited_cropCropID.img)
+def composite_raster_name(title, composite_key, output_format = DEFAULT_OUTPUT_FORMAT):
+    return title.split('_')[0][:-1] + '_' + title.split('_')[1] + '_' + title.split('_')[2][:8] + '_' + title.split('_')[4] + '_' + title.split('_')[5] + '_B' + composite_key + OUTPUT_FORMATS[output_format]
+
+# Assign name of cloud mask raster written alongside composite raster (e.g. S2_MSIL1C_YYYYMMDD_Rxxx_Txxxxx_Bx__cloudmask.tif)
+def cloud_mask_name(composite_raster):
+    return os.path.splitext(composite_raster)[0] + CLOUD_MASK_SUFFIX
+
+# Return band set (e.g. '2-4_8') from name of composite raster, leaving out any resolution, resampling, or crop token following it
+def composite_band_set(composite_raster):
+    band_chunks = os.path.splitext(os.path.basename(composite_raster))[0].split('_')[5:]
+    band_chunks[0] = band_chunks[0][1:]
+    return '_'.join(c for c in band_chunks if re.match(r'^\d+(?:-\d+)?$', c))
+
+# Return whether composite raster was written on grid of resolution, resampled with method (where any band is resampled), and with crop (None for full tile), as recorded in its manifest;
+#   a composite without a manifest (written with ArcGIS, which neither resamples nor crops) is a full tile at default resolution, one whose manifest predates resampling being recorded was resampled
+#   with the default method, and one whose manifest predates crops being recorded is full tile where its grid spans a whole Sentinel-2 tile
+def composite_is_current(composite_raster, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, crop = None):
+    manifest = sentinel_manifest.read_manifest(composite_raster)
+    if manifest is None:
+        return crop is None and int(resolution) == DEFAULT_RESOLUTION and resampling == DEFAULT_RESAMPLING
+
+    if manifest['resolution'] != int(resolution):
+        return False
+    if needs_resampling(manifest['bands'], int(resolution)) and manifest.get('resampling', DEFAULT_RESAMPLING) != resampling:
+        return False
+
+    if 'crop' not in manifest:
+        return crop is None and manifest['x_size'] * manifest['resolution'] >= TILE_EXTENT and manifest['y_size'] * manifest['resolution'] >= TILE_EXTENT
+    return (manifest['crop'] is None and crop is None) or (manifest['crop'] is not None and crop is not None and crop_id(manifest['crop']) == crop_id(crop))
+
+def zip_native_available():
+    return gdal is not None
+
+# Return /vsizip/ paths of band files matching user-selected bands, in the order they are listed within IMG_DATA directory (e.g. B02, B03, B04, B08)
+def zip_band_paths(zip_path, bands_list):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        band_members = sorted(sentinel_safe.match_band_files([n for n in zip_ref.namelist() if '/IMG_DATA/' in n], bands_list))
+    return ['/vsizip/' + os.path.abspath(zip_path).replace('\\', '/') + '/' + n for n in band_members]
+
+# Return /vsizip/ path of product's cloud mask (within QI_DATA directory of GRANULE directory), or None if product has none
+def zip_cloud_mask_path(zip_path):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        member_names = zip_ref.namelist()
+    for mask_file in CLOUD_MASK_FILES:
+        for n in member_names:
+            if n.endswith('/QI_DATA/' + mask_file):
+                return '/vsizip/' + os.path.abspath(zip_path).replace('\\', '/') + '/' + n
+    return None
+
+# Return path of cloud mask extracted to QI_DATA directory of GRANULE directory, or None if none was extracted
+def safe_cloud_mask_path(level_1C_folder_path):
+    for mask_file in CLOUD_MASK_FILES:
+        mask_path = os.path.join(level_1C_folder_path, 'QI_DATA', mask_file)
+        if os.path.isfile(mask_path):
+            return mask_path
+    return None
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Resample band files onto a common grid
+
+# Return, for each output pixel along an axis (from start), the source pixels it lies between and the weight of the second (bilinear), or the source pixel holding its centre (nearest)
+#   scale is size of an output pixel in source pixels (e.g. 0.5 for a 20 m band resampled onto 10 m grid, 2 for a 10 m band averaged onto 20 m grid)
+def source_positions(start, count, scale, source_size, resampling):
+    centres = (numpy.arange(start, start + count) + 0.5) * scale
+
+    if resampling == 'BILINEAR':
+        positions = centres - 0.5
+        lower = numpy.floor(positions)
+        weights = (positions - lower).astype(numpy.float32)
+        lower = lower.astype(numpy.int64)
+        return numpy.clip(lower, 0, source_size - 1), numpy.clip(lower + 1, 0, source_size - 1), weights
+
+    index = numpy.minimum(numpy.floor(centres).astype(numpy.int64), source_size - 1)
+    return index, index, None
+
+# Return whether any user-selected band has to be resampled onto grid of given resolution
+def needs_resampling(bands_list, resolution = DEFAULT_RESOLUTION):
+    return any(BAND_RESOLUTIONS.get(b, resolution) != resolution for b in bands_list)
+
+# Return crop (west, south, east, north, in WGS 1984 degrees, and buffer in pixels of common grid) bounding GeoJSON area of interest (e.g. aoi.geojson written by 0.21)
+def aoi_crop(geojson, buffer_pixels = DEFAULT_CROP_BUFFER):
+    points = []
+
+    def collect(coordinates):
+        if isinstance(coordinates[0], (int, float)):
+            points.append(coordinates[:2])
+        else:
+            for c in coordinates:
+                collect(c)
+
+    for feature in geojson.get('features', [geojson]):
+        collect(feature.get('geometry', feature)['coordinates'])
+
+    return (min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points), int(buffer_pixels))
+
+# Return window (x, y, columns, rows) of grid covering crop, projecting its bounds into grid's coordinate system along each edge (as straight lines of longitude and latitude curve in UTM)
+def crop_window(crop, projection, geotransform, x_size, y_size):
+    west, south, east, north, buffer_pixels = crop
+
+    geographic = osr.SpatialReference()
+    geographic.ImportFromEPSG(4326)
+    projected = osr.SpatialReference()
+    projected.ImportFromWkt(projection)
+    for reference in (geographic, projected):
+        if hasattr(reference, 'SetAxisMappingStrategy'):
+            reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transformation = osr.CoordinateTransformation(geographic, projected)
+
+    steps = numpy.linspace(0.0, 1.0, CROP_EDGE_POINTS)
+    edge_points = [(west + (east - west) * t, south) for t in steps] + [(west + (east - west) * t, north) for t in steps] + [(west, south + (north - south) * t) for t in steps] + [(east, south + (north - south) * t) for t in steps]
+    xs, ys = zip(*[transformation.TransformPoint(float(lon), float(lat))[:2] for lon, lat in edge_points])
+
+    resolution = geotransform[1]
+    x_start = max(int(numpy.floor((min(xs) - geotransform[0]) / resolution)) - buffer_pixels, 0)
+    x_end = min(int(numpy.ceil((max(xs) - geotransform[0]) / resolution)) + buffer_pixels, x_size)
+    y_start = max(int(numpy.floor((geotransform[3] - max(ys)) / resolution)) - buffer_pixels, 0)
+    y_end = min(int(numpy.ceil((geotransform[3] - min(ys)) / resolution)) + buffer_pixels, y_size)
+
+    if x_end <= x_start or y_end <= y_start:
+        raise ValueError('Area of interest does not overlap tile')
+
+    return x_start, y_start, x_end - x_start, y_end - y_start
+
+# Return (offset, size) spans covering size pixels from offset in steps, starting at a multiple of block (so that spans line up with source blocks)
+def aligned_spans(offset, size, step, block):
+    spans = []
+    for start in range(offset - offset % block, offset + size, step):
+        span_start = max(start, offset)
+        spans.append((span_start - offset, min(start + step, offset + size) - span_start))
+    return spans
+
+class ResampledBands(object):
+    """Band files read onto a common grid (optionally cropped to an area of interest) a window at a time, with bands of other resolutions resampled in NumPy."""
+
+    def __init__(self, band_paths, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, crop = None):
+        self.datasets = [gdal.Open(p) for p in band_paths]
+        self.resolution = resolution
+        self.resampling = resampling
+
+        # Common grid shares origin and extent of band files (every band of a Sentinel-2 tile covers the same 109.8 km square)
+        first = self.datasets[0]
+        transform = first.GetGeoTransform()
+        self.grid_x_size = int(round(first.RasterXSize * transform[1] / resolution))
+        self.grid_y_size = int(round(first.RasterYSize * -transform[5] / resolution))
+        self.projection = first.GetProjection()
+        grid_transform = (transform[0], float(resolution), 0.0, transform[3], 0.0, -float(resolution))
+
+        # Crop grid to window around area of interest (plus buffer), so that only band file tiles intersecting it are decoded
+        self.x_offset, self.y_offset, self.x_size, self.y_size = 0, 0, self.grid_x_size, self.grid_y_size
+        if crop is not None:
+            self.x_offset, self.y_offset, self.x_size, self.y_size = crop_window(crop, self.projection, grid_transform, self.grid_x_size, self.grid_y_size)
+
+        self.band_count = len(self.datasets)
+        self.geotransform = (grid_transform[0] + self.x_offset * resolution, float(resolution), 0.0, grid_transform[3] - self.y_offset * resolution, 0.0, -float(resolution))
+        self.data_type = first.GetRasterBand(1).DataType
+        self.nodata = [d.GetRasterBand(1).GetNoDataValue() for d in self.datasets]
+
+        # Source columns of output columns for each band, computed once rather than for every window
+        self.columns = {}
+
+    # Return windows (x, y, columns, rows) covering common grid, each a whole number of source blocks (e.g. 1024 x 1024 JPEG2000 tiles, so that no tile is decoded twice)
+    #   and small enough that buffers of a single band fit within share of memory budget; as bands are read, written, and released one at a time, memory does not grow with number of bands
+    def windows(self, memory_budget_mb = DEFAULT_WORKER_MEMORY_MB):
+        max_pixels = max(int(memory_budget_mb * 2 ** 20 * WINDOW_MEMORY_SHARE / WINDOW_BYTES_PER_PIXEL), 1)
+
+        # Block size, on common grid, of finest band file (whose blocks cover least ground)
+        reference = min(self.datasets, key = lambda d: d.GetGeoTransform()[1])
+        block_x, block_y = reference.GetRasterBand(1).GetBlockSize()
+        scale = reference.GetGeoTransform()[1] / self.resolution
+        block_x = min(max(int(block_x * scale), 1), self.grid_x_size)
+        block_y = min(max(int(block_y * scale), 1), self.grid_y_size)
+
+        # Full-width windows of as many block rows as fit; otherwise a single block row split into as many blocks across as fit; otherwise (block larger than budget, e.g. untiled band file) strips of rows
+        if block_y * self.x_size <= max_pixels:
+            column_spans = [(0, self.x_size)]
+            rows = block_y * (max_pixels // (block_y * self.x_size))
+        elif block_x * block_y <= max_pixels:
+            column_spans = aligned_spans(self.x_offset, self.x_size, block_x * (max_pixels // (block_x * block_y)), block_x)
+            rows = block_y
+        else:
+            column_spans = [(0, self.x_size)]
+            rows = max(max_pixels // self.x_size, 1)
+            block_y = 1
+
+        return [(x, y, columns, row_count) for y, row_count in aligned_spans(self.y_offset, self.y_size, rows, block_y) for x, columns in column_spans]
+
+    # Return window (x, y, columns, rows, from top left of cropped grid) of band b (counted from 0) on common grid
+    def read(self, b, x, y, columns, rows):
+        x, y = x + self.x_offset, y + self.y_offset
+        dataset = self.datasets[b]
+        band = dataset.GetRasterBand(1)
+        scale = self.resolution / dataset.GetGeoTransform()[1]
+
+        # Band file already on common grid
+        if scale == 1:
+            return band.ReadAsArray(x, y, columns, rows)
+
+        # Average band file finer than common grid over each whole block of source pixels (e.g. 2 x 2 10 m pixels for each 20 m pixel)
+        if self.resampling == 'AVERAGE' and scale > 1 and scale == int(scale):
+            factor = int(scale)
+            block = band.ReadAsArray(x * factor, y * factor, columns * factor, rows * factor)
+            return numpy.rint(block.reshape(rows, factor, columns, factor).mean(axis = (1, 3))).astype(block.dtype)
+
+        # Otherwise look up source pixels of output rows and columns (averaging a band file coarser than common grid, where each output pixel lies within a single source pixel, matches nearest)
+        if b not in self.columns:
+            self.columns[b] = source_positions(0, self.grid_x_size, scale, dataset.RasterXSize, self.resampling)
+        column_lower, column_upper, column_weights = [None if p is None else p[x:x + columns] for p in self.columns[b]]
+        row_lower, row_upper, row_weights = source_positions(y, rows, scale, dataset.RasterYSize, self.resampling)
+
+        # Decode only source pixels covering output window
+        first_row, first_column = int(row_lower[0]), int(column_lower[0])
+        block = band.ReadAsArray(first_column, first_row, int(column_upper[-1]) - first_column + 1, int(row_upper[-1]) - first_row + 1)
+
+        if row_weights is None:
+            return block[row_lower - first_row][:, column_lower - first_column]
+
+        # Interpolate between source rows, then between source columns
+        top = block[row_lower - first_row].astype(numpy.float32)
+        bottom = block[row_upper - first_row].astype(numpy.float32)
+        between_rows = top + (bottom - top) * row_weights[:, None]
+        left = between_rows[:, column_lower - first_column]
+        right = between_rows[:, column_upper - first_column]
+        return numpy.rint(left + (right - left) * column_weights).astype(block.dtype)
+
+    def close(self):
+        self.datasets = []
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Write composite raster (Cloud-Optimized GeoTIFF with statistics and histograms gathered in the same pass)
+
+class BandStatistics(object):
+    """Minimum, maximum, mean, standard deviation, and histogram of a band, accumulated block by block as the band is written."""
+
+    def __init__(self, nodata = None):
+        self.nodata = nodata
+        self.value_counts = None
+        self.offset = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def add(self, block):
+        values = block.ravel()
+        if self.nodata is not None:
+            values = values[values != self.nodata]
+        if not values.size:
+            return
+
+        # Count each value of 8- and 16-bit integer bands (e.g. Sentinel-2 UInt16 reflectance), from which statistics and histogram are exact
+        if values.dtype.kind in 'ui' and values.dtype.itemsize <= 2:
+            self.offset = 0 if values.dtype.kind == 'u' else 2 ** (8 * values.dtype.itemsize - 1)
+            value_counts = numpy.bincount(values.astype(numpy.int64) + self.offset, minlength = 2 ** (8 * values.dtype.itemsize))
+            self.value_counts = value_counts if self.value_counts is None else self.value_counts + value_counts
+
+        # Otherwise keep running sums (no histogram)
+        else:
+            values = values.astype(numpy.float64)
+            self.count += values.size
+            self.minimum = values.min() if self.minimum is None else min(self.minimum, values.min())
+            self.maximum = values.max() if self.maximum is None else max(self.maximum, values.max())
+            self.total += values.sum()
+            self.total_squares += numpy.square(values).sum()
+
+    # Return minimum, maximum, mean, standard deviation, and histogram (lower bound, upper bound, and bucket counts, or None), or None if band holds no data
+    def summarize(self):
+        if self.value_counts is not None:
+            present = numpy.nonzero(self.value_counts)[0]
+            counts = self.value_counts[present]
+            values = present.astype(numpy.float64) - self.offset
+            count = counts.sum()
+            minimum, maximum = values[0], values[-1]
+            mean = (values * counts).sum() / count
+            std = numpy.sqrt((numpy.square(values - mean) * counts).sum() / count)
+
+            # Spread histogram buckets evenly over range of values, as GDAL does for integer bands
+            lower, upper = minimum - 0.5, maximum + 0.5
+            buckets = numpy.minimum(((values - lower) * HISTOGRAM_BUCKETS / (upper - lower)).astype(numpy.int64), HISTOGRAM_BUCKETS - 1)
+            histogram = numpy.bincount(buckets, weights = counts, minlength = HISTOGRAM_BUCKETS).astype(numpy.int64).tolist()
+            return float(minimum), float(maximum), float(mean), float(std), (lower, upper, histogram)
+
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        std = numpy.sqrt(max(self.total_squares / self.count - mean ** 2, 0.0))
+        return float(self.minimum), float(self.maximum), float(mean), float(std), None
+
+# Return overview factors halving resolution until whole raster fits within a single tile
+def overview_factors(x_size, y_size):
+    factors = []
+    factor = 2
+    while max(x_size, y_size) / (factor / 2) > COG_BLOCK_SIZE:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+def write_raster(bands, composite_raster, output_format = DEFAULT_OUTPUT_FORMAT, memory_budget_mb = DEFAULT_WORKER_MEMORY_MB):
+
+    gtiff_driver = gdal.GetDriverByName('GTiff')
+
+    # Write Cloud-Optimized GeoTIFF to a tiled staging raster first (from which overviews are built), and ERDAS IMAGINE to a partial raster renamed once complete
+    target_raster = composite_raster + '.partial'
+    if output_format == 'COG':
+        target_driver = gtiff_driver
+        target = target_driver.Create(target_raster, bands.x_size, bands.y_size, bands.band_count, bands.data_type, STAGING_CREATION_OPTIONS)
+    else:
+        target_driver = gdal.GetDriverByName(IMG_DRIVER)
+        target = target_driver.Create(target_raster, bands.x_size, bands.y_size, bands.band_count, bands.data_type)
+
+    complete = False
+    try:
+        target.SetGeoTransform(bands.geotransform)
+        target.SetProjection(bands.projection)
+
+        statistics = []
+        for b in range(bands.band_count):
+            if bands.nodata[b] is not None:
+                target.GetRasterBand(b + 1).SetNoDataValue(bands.nodata[b])
+            statistics.append(BandStatistics(bands.nodata[b]))
+
+        # Decode (and resample) band files one window at a time, writing each window and adding it to band statistics in the same pass; only one band's window is held at once
+        for x, y, columns, rows in bands.windows(memory_budget_mb):
+            for b in range(bands.band_count):
+                block = bands.read(b, x, y, columns, rows)
+                target.GetRasterBand(b + 1).WriteArray(block, x, y)
+                statistics[b].add(block)
+                del block
+
+        if output_format == 'COG':
+
+            # Build overviews from staging raster rather than band files, so that no band file is decoded twice
+            target.BuildOverviews('AVERAGE', overview_factors(bands.x_size, bands.y_size))
+            target.FlushCache()
+
+            # Write composite with overviews ahead of full-resolution tiles, so that readers fetch only the tiles (and level) they need
+            cog_driver = gdal.GetDriverByName('COG')
+            if cog_driver is not None:
+                cog_driver.CreateCopy(composite_raster, target, options = COG_CREATION_OPTIONS)
+            else:
+                gtiff_driver.CreateCopy(composite_raster, target, options = GTIFF_COG_CREATION_OPTIONS)
+
+        complete = True
+    finally:
+        target = None
+
+        # Remove staging raster, or partial raster left by a failure, so that an unfinished composite is never mistaken for a complete one
+        if (output_format == 'COG' or not complete) and os.path.exists(target_raster):
+            target_driver.Delete(target_raster)
+
+    # Rename complete ERDAS IMAGINE composite (with any spill file) to its final name
+    if output_format != 'COG':
+        if os.path.exists(composite_raster):
+            target_driver.Delete(composite_raster)
+        target_driver.Rename(composite_raster, target_raster)
+
+    # Record statistics and histograms gathered above (within .img, or in .aux.xml alongside Cloud-Optimized GeoTIFF; read by ArcGIS Pro and GDAL) rather than reading composite again
+    summaries = [s.summarize() for s in statistics]
+    composite = gdal.Open(composite_raster, gdal.GA_ReadOnly if output_format == 'COG' else gdal.GA_Update)
+    for b, summary in enumerate(summaries, start = 1):
+        if summary is None:
+            continue
+        minimum, maximum, mean, std, histogram = summary
+        band = composite.GetRasterBand(b)
+        band.SetStatistics(minimum, maximum, mean, std)
+        if histogram is not None:
+            band.SetDefaultHistogram(histogram[0], histogram[1], histogram[2])
+    composite = None
+
+    return summaries
+
+#--------------------------------------------
+
+# 3.1 Rasterise cloud mask onto composite grid
+
+# Write cloud mask (0 clear, 1 opaque cloud, 2 cirrus) on grid of composite (including any crop); Level-1C products carry no cloud shadow mask
+def write_cloud_mask(mask_path, bands, mask_raster):
+
+    target = gdal.GetDriverByName('GTiff').Create(mask_raster + '.partial', bands.x_size, bands.y_size, 1, gdal.GDT_Byte, CLOUD_MASK_CREATION_OPTIONS)
+    try:
+        target.SetGeoTransform(bands.geotransform)
+        target.SetProjection(bands.projection)
+        target_band = target.GetRasterBand(1)
+        target_band.Fill(CLEAR)
+
+        # Burn cirrus polygons, then opaque cloud polygons over them, from GML mask (a tile without cloud has a GML mask GDAL cannot open, and is left clear)
+        if mask_path.lower().endswith('.gml'):
+            for value, mask_type in [(CIRRUS, 'CIRRUS'), (OPAQUE_CLOUD, 'OPAQUE')]:
+                try:
+                    gdal.Rasterize(target, mask_path, burnValues = [value], where = "maskType = '{}'".format(mask_type))
+                except RuntimeError:
+                    break
+
+        # Otherwise look up raster mask (60 m; band 1 opaque cloud, band 2 cirrus) at nearest pixel of each composite pixel, a strip of tiles at a time
+        else:
+            source = gdal.Open(mask_path)
+            scale = bands.resolution / source.GetGeoTransform()[1]
+            opaque = source.GetRasterBand(1).ReadAsArray()
+            cirrus = source.GetRasterBand(2).ReadAsArray()
+            source = None
+
+            column_index = source_positions(bands.x_offset, bands.x_size, scale, opaque.shape[1], 'NEAREST')[0]
+            for y in range(0, bands.y_size, COG_BLOCK_SIZE):
+                rows = min(COG_BLOCK_SIZE, bands.y_size - y)
+                row_index = source_positions(bands.y_offset + y, rows, scale, opaque.shape[0], 'NEAREST')[0]
+                strip = numpy.where(opaque[row_index][:, column_index] > 0, OPAQUE_CLOUD, numpy.where(cirrus[row_index][:, column_index] > 0, CIRRUS, CLEAR)).astype(numpy.uint8)
+                target_band.WriteArray(strip, 0, y)
+    except Exception:
+        target = None
+        gdal.GetDriverByName('GTiff').Delete(mask_raster + '.partial')
+        raise
+
+    target = None
+    os.replace(mask_raster + '.partial', mask_raster)
+    return mask_raster
+
+#--------------------------------------------
+
+# 3.2 Write manifest of composite raster
+
+# Write manifest of composite from its grid (band files on common grid), statistics of each band, and product metadata (see sentinel_manifest.product_metadata)
+def write_composite_manifest(composite_raster, output_format, bands, band_paths, summaries, product, mask_raster = None, resampling = DEFAULT_RESAMPLING, crop = None):
+
+    # Identify EPSG code of coordinate system (e.g. 32611 for WGS 1984 UTM zone 11N), so that tools can compare it with that of field borders
+    spatial_reference = osr.SpatialReference(wkt = bands.projection)
+    spatial_reference.AutoIdentifyEPSG()
+    epsg = spatial_reference.GetAuthorityCode(None)
+
+    west, resolution, north = bands.geotransform[0], bands.geotransform[1], bands.geotransform[3]
+    manifest = dict(product)
+    manifest.update({
+        'composite': os.path.basename(composite_raster),
+        'format': output_format,
+        'band_set': composite_band_set(composite_raster),
+        'bands': [os.path.splitext(os.path.basename(p))[0][-2:] for p in band_paths],
+        'crs': {'epsg': int(epsg) if epsg else None, 'wkt': bands.projection},
+        'geotransform': list(bands.geotransform),
+        'x_size': bands.x_size,
+        'y_size': bands.y_size,
+        'resolution': resolution,
+        'resampling': resampling,
+        'extent': {'xmin': west, 'ymin': north - bands.y_size * resolution, 'xmax': west + bands.x_size * resolution, 'ymax': north},
+        'data_type': gdal.GetDataTypeName(bands.data_type),
+        'nodata': bands.nodata,
+        'statistics': [None if s is None else {'min': s[0], 'max': s[1], 'mean': s[2], 'std': s[3]} for s in summaries],
+        'cloud_mask': None if mask_raster is None else os.path.basename(mask_raster),
+        'crop': None if crop is None else list(crop)})
+
+    return sentinel_manifest.write_manifest(composite_raster, manifest)
+
+# Open band files (GDAL paths, e.g. /vsizip/) onto common grid and write composite from them, with cloud mask (if product has one) on the same grid and manifest (if product metadata is given);
+#   band files are read from band cache directory (if given), decoding those not yet cached into it unless composite is cropped
+def write_composite(band_paths, composite_raster, output_format = DEFAULT_OUTPUT_FORMAT, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, memory_budget_mb = DEFAULT_WORKER_MEMORY_MB, crop = None, mask_path = None, product = None, band_cache = None):
+
+    if gdal is None:
+        raise RuntimeError('GDAL Python bindings (osgeo) are required to composite bands straight from zip files, resample bands, or write Cloud-Optimized GeoTIFF')
+
+    read_paths = sentinel_band_cache.cached_band_paths(band_paths, band_cache, fill = crop is None)
+
+    bands = ResampledBands(read_paths, resolution, resampling, crop)
+    try:
+        # Write cloud mask first, so that a composite is never left without its mask
+        mask_raster = None
+        if mask_path is not None:
+            mask_raster = write_cloud_mask(mask_path, bands, cloud_mask_name(composite_raster))
+        summaries = write_raster(bands, composite_raster, output_format, memory_budget_mb)
+
+        if product is not None:
+            write_composite_manifest(composite_raster, output_format, bands, band_paths, summaries, product, mask_raster, resampling, crop)
+    finally:
+        bands.close()
+
+    return composite_raster
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Composite band files read straight from product zip file
+
+def composite_from_zip(zip_path, bands_list, composite_raster, output_format = DEFAULT_OUTPUT_FORMAT, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, memory_budget_mb = DEFAULT_WORKER_MEMORY_MB, crop = None, band_cache = None):
+
+    band_paths = zip_band_paths(zip_path, bands_list)
+    if not band_paths:
+        raise ValueError('No band files matching bands {} within {}'.format(bands_list, os.path.basename(zip_path)))
+
+    product = sentinel_manifest.product_metadata(os.path.splitext(os.path.basename(zip_path))[0], zip_path = zip_path)
+    return write_composite(band_paths, composite_raster, output_format, resolution, resampling, memory_budget_mb, crop, zip_cloud_mask_path(zip_path), product, band_cache)
+
+#----------------------------------------------------------------------------------------------
+
+# 5. Composite band files extracted to SAFE directory
+
+def composite_from_safe(safe_directory, bands_list, composite_raster, output_format = DEFAULT_OUTPUT_FORMAT, resolution = DEFAULT_RESOLUTION, resampling = DEFAULT_RESAMPLING, memory_budget_mb = DEFAULT_WORKER_MEMORY_MB, crop = None, band_cache = None):
+
+    # Composite rasters within IMG_DATA directory (within GRANULE directory of SAFE directory) that match user-selected bands
+    granule_folder_path = os.path.join(safe_directory, 'GRANULE')
+    level_1C_folder_list = os.listdir(granule_folder_path)
+    for k in level_1C_folder_list:
+        level_1C_folder_path = os.path.join(granule_folder_path, k)
+        img_folder_path = os.path.join(level_1C_folder_path, 'IMG_DATA')
+        raster_list = os.listdir(img_folder_path)
+        all_bands_of_interest_path_list = [os.path.join(img_folder_path, r) for r in sentinel_safe.match_band_files(raster_list, bands_list)]
+
+        # Generate composite of rasters matching user-selected bands with GDAL, a window at a time, with cloud mask on the same grid (wherever GDAL is available, and always for Cloud-Optimized GeoTIFF)
+        if output_format == 'COG' or gdal is not None:
+            product = sentinel_manifest.product_metadata(os.path.splitext(os.path.basename(os.path.normpath(safe_directory)))[0], safe_directory = safe_directory)
+            write_composite(sorted(all_bands_of_interest_path_list), composite_raster, output_format, resolution, resampling, memory_budget_mb, crop, safe_cloud_mask_path(level_1C_folder_path), product, band_cache)
+            continue
+
+        # Import arcpy only when needed, as worker processes writing with GDAL do not need it
+        import arcpy
+
+        # Generate ERDAS IMAGINE, .img composite of rasters matching user-selected bands
+        arcpy.CompositeBands_management(in_rasters = all_bands_of_interest_path_list, out_raster = composite_raster)
+
+    return composite_raster
+
+#----------------------------------------------------------------------------------------------
+
+# 6. Composite several products at once in worker processes
+
+class IOCounters(ctypes.Structure):
+    """IO_COUNTERS of a Windows job object."""
+    _fields_ = [(n, ctypes.c_uint64) for n in ['ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount', 'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount']]
+
+class JobBasicLimits(ctypes.Structure):
+    """JOBOBJECT_BASIC_LIMIT_INFORMATION of a Windows job object."""
+    _fields_ = [('PerProcessUserTimeLimit', ctypes.c_int64), ('PerJobUserTimeLimit', ctypes.c_int64), ('LimitFlags', ctypes.c_uint32), ('MinimumWorkingSetSize', ctypes.c_size_t), ('MaximumWorkingSetSize', ctypes.c_size_t),
+                ('ActiveProcessLimit', ctypes.c_uint32), ('Affinity', ctypes.c_size_t), ('PriorityClass', ctypes.c_uint32), ('SchedulingClass', ctypes.c_uint32)]
+
+class JobExtendedLimits(ctypes.Structure):
+    """JOBOBJECT_EXTENDED_LIMIT_INFORMATION of a Windows job object."""
+    _fields_ = [('BasicLimitInformation', JobBasicLimits), ('IoInfo', IOCounters), ('ProcessMemoryLimit', ctypes.c_size_t), ('JobMemoryLimit', ctypes.c_size_t), ('PeakProcessMemoryUsed', ctypes.c_size_t), ('PeakJobMemoryUsed', ctypes.c_size_t)]
+
+# Cap memory committed by this (Windows) process, by assigning it to a job object with a per-process memory limit; allocations beyond the cap fail with MemoryError, as under an address space limit
+def limit_windows_process_memory(memory_cap_bytes):
+    global worker_memory_job
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error = True)
+    kernel32.CreateJobObjectW.restype = ctypes.c_void_p
+    kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+    kernel32.SetInformationJobObject.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_uint32]
+    kernel32.AssignProcessToJobObject.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+
+    job = kernel32.CreateJobObjectW(None, None)
+    if not job:
+        raise ctypes.WinError(ctypes.get_last_error())
+
+    limits = JobExtendedLimits()
+    limits.BasicLimitInformation.LimitFlags = JOB_OBJECT_LIMIT_PROCESS_MEMORY
+    limits.ProcessMemoryLimit = memory_cap_bytes
+    if not kernel32.SetInformationJobObject(job, JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS, ctypes.byref(limits), ctypes.sizeof(limits)):
+        raise ctypes.WinError(ctypes.get_last_error())
+
+    # Windows 8 and later nest jobs, so a worker started within ArcGIS Pro's own job object can still be assigned to this one
+    if not kernel32.AssignProcessToJobObject(job, kernel32.GetCurrentProcess()):
+        raise ctypes.WinError(ctypes.get_last_error())
+    worker_memory_job = job
+
+# Cap memory of worker process: GDAL block cache gets a quarter of the cap, and the process the whole cap (its address space on POSIX systems, its committed memory through a job object on Windows)
+def limit_worker_memory(memory_cap_mb):
+    global worker_memory_limited
+    if worker_memory_limited or not memory_cap_mb:
+        return
+
+    if gdal is not None:
+        gdal.SetCacheMax(int(memory_cap_mb * 2 ** 20 / 4))
+    if resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (int(memory_cap_mb * 2 ** 20), resource.getrlimit(resource.RLIMIT_AS)[1]))
+    elif sys.platform == 'win32':
+        limit_windows_process_memory(int(memory_cap_mb * 2 ** 20))
+
+    worker_memory_limited = True
+
+# Composite a single product (job dictionary with uuid, zip_path, safe_directory, composite_raster, bands_list, from_zip, output_format, resolution, resampling, memory_cap_mb, within which composite is written a window at a time, crop, and band_cache directory or None), catching any failure so it is reported rather than raised
+def composite_product(job, memory_cap_mb = None):
+
+    result = {'uuid': job['uuid'], 'composite_raster': job['composite_raster'], 'status': 'composited', 'seconds': 0.0, 'error': None}
+    start = time.time()
+
+    try:
+        # Cap memory of worker process before compositing (a cap that cannot be enforced fails the product rather than letting it run uncapped)
+        limit_worker_memory(memory_cap_mb)
+
+        if job['from_zip']:
+            composite_from_zip(job['zip_path'], job['bands_list'], job['composite_raster'], job['output_format'], job['resolution'], job['resampling'], job['memory_cap_mb'], job['crop'], job['band_cache'])
+        else:
+            composite_from_safe(job['safe_directory'], job['bands_list'], job['composite_raster'], job['output_format'], job['resolution'], job['resampling'], job['memory_cap_mb'], job['crop'], job['band_cache'])
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e) or type(e).__name__
+
+    result['seconds'] = time.time() - start
+    return result
+
+def report_composite(result, messages):
+    composite_raster_name = os.path.basename(result['composite_raster'])
+    if result['status'] == 'composited':
+        messages('Finished compositing {} in {:.1f} s'.format(composite_raster_name, result['seconds']))
+    else:
+        messages('Was not able to composite {} ({:.1f} s): {}'.format(composite_raster_name, result['seconds'], result['error']))
+
+# Hide tool script from worker processes while they start, so that spawned workers (e.g. on Windows) do not run the whole tool again on import
+@contextlib.contextmanager
+def main_module_hidden():
+    main_module = sys.modules['__main__']
+    main_file = main_module.__dict__.pop('__file__', None)
+    try:
+        yield
+    finally:
+        if main_file is not None:
+            main_module.__file__ = main_file
+
+# Return pool of worker processes, started with Python interpreter rather than ArcGIS Pro executable when run as a script tool; workers must start while tool script is hidden (see main_module_hidden)
+def process_pool(max_workers):
+    if sys.platform == 'win32' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    return concurrent.futures.ProcessPoolExecutor(max_workers = max_workers)
+
+# Run pool of worker processes (see process_pool) with tool script hidden from them throughout, shared by every tool and module fanning work out over worker processes
+@contextlib.contextmanager
+def worker_pool(max_workers):
+    with main_module_hidden(), process_pool(max_workers) as executor:
+        yield executor
+
+# Composite jobs within a single pool; return jobs left unfinished because a worker process died (e.g. exhausted its memory), which breaks the whole pool
+def run_composite_pool(jobs, max_workers, memory_cap_mb, results, messages):
+    unfinished = []
+
+    with worker_pool(max_workers) as executor:
+        futures = {executor.submit(composite_product, job, memory_cap_mb): job for job in jobs}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                unfinished.append(futures[future])
+                continue
+
+            results.append(result)
+            report_composite(result, messages)
+
+    return unfinished
+
+def composite_products(jobs, max_workers = DEFAULT_COMPOSITE_WORKERS, memory_cap_mb = DEFAULT_WORKER_MEMORY_MB, messages = print):
+
+    results = []
+    composite_start = time.time()
+
+    # Composite products one after another within tool's own process when a single worker is requested
+    if max_workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            result = composite_product(job)
+            results.append(result)
+            report_composite(result, messages)
+
+    else:
+        unfinished = run_composite_pool(jobs, max_workers, memory_cap_mb, results, messages)
+
+        # Rerun products left unfinished by a worker process dying, each within its own pool, so that only product responsible fails
+        for job in unfinished:
+            if run_composite_pool([job], 1, memory_cap_mb, results, messages):
+                result = {'uuid': job['uuid'], 'composite_raster': job['composite_raster'], 'status': 'failed', 'seconds': 0.0, 'error': 'worker process died (e.g. exceeded memory cap of {} MB)'.format(memory_cap_mb)}
+                results.append(result)
+                report_composite(result, messages)
+
+    composited = [r for r in results if r['status'] == 'composited']
+    if jobs:
+        messages('Composited {} of {} products in {:.1f} s using {} worker(s)'.format(len(composited), len(jobs), time.time() - composite_start, max(1, min(max_workers, len(jobs)))))
+
+    return results
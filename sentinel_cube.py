@@ -0,0 +1,482 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_cube.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; GDAL Python bindings (osgeo) to build or update an imagery cube (reading one needs NumPy alone); sentinel_composite.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.27 Script Tool and by field_zones.py, through which the 0.30 and 0.40 Script Tools read imagery from a cube (it must sit in the same directory as the tool scripts);
+#                   it is not intended as a stand-alone script.
+
+# Description:      This module aligns every composite raster of a band set within an imagery directory onto one common grid, snapped to the composites' cell size and covering all of them,
+#                   and writes them to an imagery cube: a directory holding one int16 NumPy array file per sensing date, stored in spatial chunks of 512 x 512 cells
+#                   (chunk row x chunk column x band x y x x, so that every band of a chunk lies together on disk), plus a JSON file recording its dates, bands, coordinate system, grid, and chunk size.
+#                   Composites of the same date (adjacent tiles) are mosaicked into that date's array, the first valid pixel winning, and their cloud masks (written alongside them by the 0.2x tools)
+#                   into a chunked mask array of that date. The cube is append-only: an update writes arrays only for dates that are new (or whose composites or cloud masks changed),
+#                   and rebuilds the cube only when the grid or chunk size changes. Tools read a window of the cube by assembling it from the memory-mapped chunks overlapping it,
+#                   so that only those chunks are read from disk; a composite held by an up-to-date cube is read from it (see cube_files_of_composite) in place of the composite itself.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Find composite rasters and their dates and band sets
+# 2. Define common grid of composites
+# 3. Write a date of the cube
+# 4. Build or update cube
+# 5. Read windows of cube
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, re, glob, json, numpy, sentinel_composite
+
+# GDAL is optional; it is only needed to build or update a cube
+try:
+    from osgeo import gdal, osr
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+    osr = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of cube directory within imagery directory (one per composite key, e.g. imagery_cube_B2-4_8, or imagery_cube_B2-4_8_20m for composites at 20 m), and of JSON file recording cube's coordinates within it
+CUBE_PREFIX = 'imagery_cube_B'
+CUBE_METADATA = 'cube.json'
+
+# Storage data type of reflectance (Level-1C digital numbers fit within int16, saturated values are clipped to its maximum), and value of pixels no composite covers
+CUBE_DTYPE = numpy.int16
+CUBE_NODATA = 0
+
+# Name of composite raster written by 0.2x tools (e.g. S2_MSIL1C_20200601_R113_T11SPS_B2-4_8, or S2_MSIL1C_20200601_R113_T11SPS_B2-4_8_20m_crop1f3a9c0d at 20 m and cropped), capturing its sensing date,
+#   composite key (band set with any resolution, resampling, or crop token, see sentinel_composite.composite_key), and band set; other rasters within an imagery directory
+#   (e.g. 5.00 mosaics, S2_MSIL1C_20200601_R113_T11SPS_B2-4_8_mosaic.img, or cloud masks) do not match
+COMPOSITE_NAME_PATTERN = re.compile(r'^S2_MSIL1C_(\d{8})_R\d{3}_T[0-9A-Z]{5}_B((\d+(?:-\d+)?(?:_\d+(?:-\d+)?)*)' + sentinel_composite.COMPOSITE_VARIANT_PATTERN + ')$')
+
+# Width and height of spatial chunks of cube, in cells (a composite is read, and written into the cube, a row of chunks at a time)
+CUBE_CHUNK_SIZE = 512
+
+# Suffix of array file of a date's cloud mask (0 clear or uncovered, 1 opaque cloud, 2 cirrus, as in cloud masks written by 0.2x tools), and its storage data type
+CUBE_MASK_SUFFIX = '_cloudmask.npy'
+CUBE_MASK_DTYPE = numpy.uint8
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Find composite rasters and their dates and band sets
+
+# Return sensing date (YYYYMMDD) and composite key (e.g. '2-4_8', or '2-4_8_20m_crop1f3a9c0d' at 20 m and cropped) of composite raster named by 0.2x tools (e.g. S2_MSIL1C_20200601_R113_T11SPS_B2-4_8.img),
+#   or None where raster is not named as a composite
+def parse_composite_name(composite_path):
+    name_match = COMPOSITE_NAME_PATTERN.match(os.path.splitext(os.path.basename(composite_path))[0])
+    if name_match is None:
+        return None
+    return name_match.group(1), name_match.group(2)
+
+# Return composite rasters within imagery directory, one per product and band set: the full-tile composite of a product at default resolution and resampling is read in preference to any other,
+#   and a product composited as both ERDAS IMAGINE and Cloud-Optimized GeoTIFF is read from the latter; rasters not named as composites (cloud masks, 5.00 mosaics) are left out
+def list_composites(imagery_directory):
+    composites = {}
+    for composite_path in sorted(glob.glob(os.path.join(imagery_directory, 'S2_MSIL1C_*'))):
+        composite_name = parse_composite_name(composite_path)
+        extension = os.path.splitext(composite_path)[1]
+        if composite_name is None or extension not in sentinel_composite.OUTPUT_FORMATS.values():
+            continue
+
+        # Key product by its name up to band set, leaving out any resolution, resampling, or crop token
+        composite_stem = os.path.splitext(os.path.basename(composite_path))[0]
+        band_set = sentinel_composite.composite_band_set(composite_path)
+        product = composite_stem[:len(composite_stem) - len(composite_name[1])] + band_set
+
+        preference = (composite_name[1] == band_set, extension == sentinel_composite.OUTPUT_FORMATS['COG'])
+        if product not in composites or preference >= composites[product][0]:
+            composites[product] = (preference, composite_path)
+    return sorted(c[1] for c in composites.values())
+
+# Return composite rasters within imagery directory (see list_composites), grouped by composite key (band set, with any resolution, resampling, or crop)
+def find_composites(imagery_directory):
+    band_sets = {}
+    for composite_path in list_composites(imagery_directory):
+        band_sets.setdefault(parse_composite_name(composite_path)[1], []).append(composite_path)
+    return band_sets
+
+def cube_directory_name(imagery_directory, band_set):
+    return os.path.join(imagery_directory, CUBE_PREFIX + band_set)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Define common grid of composites
+
+# Return grid (projection, geotransform, x_size, y_size) snapped to cell size of composites and covering all of them, and composites left out (with reason) for a differing coordinate system, cell size, or band count
+def common_grid(composite_paths, band_count, messages = print):
+    grid_composites = []
+    skipped = []
+    projection, resolution = None, None
+    west, north, east, south = None, None, None, None
+
+    for composite_path in composite_paths:
+        dataset = gdal.Open(composite_path)
+        transform = dataset.GetGeoTransform()
+        spatial_reference = osr.SpatialReference(wkt = dataset.GetProjection())
+
+        # First composite sets coordinate system and cell size of grid
+        if projection is None:
+            projection, resolution = dataset.GetProjection(), transform[1]
+            grid_reference = spatial_reference
+
+        if not spatial_reference.IsSame(grid_reference):
+            skipped.append((composite_path, 'coordinate system differs from cube'))
+        elif transform[1] != resolution or -transform[5] != resolution:
+            skipped.append((composite_path, 'cell size of {} differs from cube ({})'.format(transform[1], resolution)))
+        elif dataset.RasterCount != band_count:
+            skipped.append((composite_path, '{} bands where band set has {}'.format(dataset.RasterCount, band_count)))
+        else:
+            grid_composites.append(composite_path)
+            composite_east = transform[0] + dataset.RasterXSize * resolution
+            composite_south = transform[3] - dataset.RasterYSize * resolution
+            west = transform[0] if west is None else min(west, transform[0])
+            north = transform[3] if north is None else max(north, transform[3])
+            east = composite_east if east is None else max(east, composite_east)
+            south = composite_south if south is None else min(south, composite_south)
+        dataset = None
+
+    for composite_path, reason in skipped:
+        messages('Left {} out of cube: {}'.format(os.path.basename(composite_path), reason))
+
+    if not grid_composites:
+        return None, []
+
+    # Snap bounds outwards to multiples of cell size, so that composites of every date (and later tiles) fall on whole cells
+    west = numpy.floor(west / resolution) * resolution
+    north = numpy.ceil(north / resolution) * resolution
+    east = numpy.ceil(east / resolution) * resolution
+    south = numpy.floor(south / resolution) * resolution
+    geotransform = [float(west), float(resolution), 0.0, float(north), 0.0, -float(resolution)]
+
+    return {'projection': projection, 'geotransform': geotransform, 'x_size': int(round((east - west) / resolution)), 'y_size': int(round((north - south) / resolution))}, grid_composites
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Write a date of the cube
+
+# Return cube array file of date, and of its cloud mask
+def date_file_name(cube_directory, date):
+    return os.path.join(cube_directory, date + '.npy')
+
+def mask_file_name(cube_directory, date):
+    return os.path.join(cube_directory, date + CUBE_MASK_SUFFIX)
+
+# Return number of chunk rows and chunk columns covering grid (chunks of last row and column are padded with nodata)
+def chunk_counts(grid, chunk_size = CUBE_CHUNK_SIZE):
+    return -(-grid['y_size'] // chunk_size), -(-grid['x_size'] // chunk_size)
+
+# Return cloud mask written alongside composite by 0.2x tools, or None if it has none
+def composite_cloud_mask(composite_path):
+    cloud_mask = sentinel_composite.cloud_mask_name(composite_path)
+    return cloud_mask if os.path.isfile(cloud_mask) else None
+
+# Mosaic composites of a single date into its chunked array (chunk row x chunk column x band x y x x) on cube's grid, and their cloud masks into its chunked mask array (chunk row x chunk column x y x x),
+#   a row of chunks at a time, where no earlier composite has already filled a pixel; a date none of whose composites has a cloud mask has no mask array
+def write_date(cube_directory, date, composite_paths, grid, band_count):
+    date_file = date_file_name(cube_directory, date)
+    mask_file = mask_file_name(cube_directory, date)
+    origin_x, origin_y = grid['geotransform'][0], grid['geotransform'][3]
+    resolution = grid['geotransform'][1]
+    chunk_rows, chunk_columns = chunk_counts(grid)
+
+    # Open each composite (and its cloud mask, where it covers the same cells) with its offset within grid (rounded, as composites of another tile may sit a fraction of a cell off the grid)
+    sources = []
+    for composite_path in composite_paths:
+        dataset = gdal.Open(composite_path)
+        transform = dataset.GetGeoTransform()
+        x_offset = int(round((transform[0] - origin_x) / resolution))
+        y_offset = int(round((origin_y - transform[3]) / resolution))
+
+        cloud_mask = composite_cloud_mask(composite_path)
+        mask_dataset = gdal.Open(cloud_mask) if cloud_mask is not None else None
+        if mask_dataset is not None and (mask_dataset.RasterXSize, mask_dataset.RasterYSize) != (dataset.RasterXSize, dataset.RasterYSize):
+            mask_dataset = None
+        sources.append((dataset, mask_dataset, x_offset, y_offset))
+
+    # Write to partial files renamed once complete, so that an interrupted update never leaves a date half written
+    cube_date = numpy.lib.format.open_memmap(date_file + '.partial', mode = 'w+', dtype = CUBE_DTYPE, shape = (chunk_rows, chunk_columns, band_count, CUBE_CHUNK_SIZE, CUBE_CHUNK_SIZE))
+    cube_mask = None
+    if any(s[1] is not None for s in sources):
+        cube_mask = numpy.lib.format.open_memmap(mask_file + '.partial', mode = 'w+', dtype = CUBE_MASK_DTYPE, shape = (chunk_rows, chunk_columns, CUBE_CHUNK_SIZE, CUBE_CHUNK_SIZE))
+
+    try:
+        for chunk_row in range(chunk_rows):
+            top = chunk_row * CUBE_CHUNK_SIZE
+
+            # Row of chunks across whole grid (padded to whole chunks), filled by composites overlapping it
+            strip = numpy.full((band_count, CUBE_CHUNK_SIZE, chunk_columns * CUBE_CHUNK_SIZE), CUBE_NODATA, dtype = CUBE_DTYPE)
+            mask_strip = numpy.zeros((CUBE_CHUNK_SIZE, chunk_columns * CUBE_CHUNK_SIZE), dtype = CUBE_MASK_DTYPE)
+
+            for dataset, mask_dataset, x_offset, y_offset in sources:
+                first, last = max(top, y_offset), min(top + CUBE_CHUNK_SIZE, y_offset + dataset.RasterYSize)
+                if last <= first:
+                    continue
+
+                for b in range(band_count):
+                    band = dataset.GetRasterBand(b + 1)
+                    nodata = band.GetNoDataValue()
+                    values = band.ReadAsArray(0, first - y_offset, dataset.RasterXSize, last - first)
+                    target = strip[b, first - top:last - top, x_offset:x_offset + dataset.RasterXSize]
+
+                    # Fill pixels not yet filled by an earlier composite with valid pixels of this one (Level-1C marks pixels outside a tile's footprint 0)
+                    fill = (target == CUBE_NODATA) & (values != (CUBE_NODATA if nodata is None else nodata))
+                    target[fill] = numpy.minimum(values[fill], numpy.iinfo(CUBE_DTYPE).max)
+
+                    # Take cloud mask of the pixels this composite filled (in its first band), so that mask and reflectance of a pixel come from the same composite
+                    if b == 0 and mask_dataset is not None:
+                        mask_values = mask_dataset.GetRasterBand(1).ReadAsArray(0, first - y_offset, dataset.RasterXSize, last - first)
+                        mask_strip[first - top:last - top, x_offset:x_offset + dataset.RasterXSize][fill] = mask_values[fill]
+                    del values
+
+            # Cut row into chunks, each holding every band of its cells
+            cube_date[chunk_row] = strip.reshape(band_count, CUBE_CHUNK_SIZE, chunk_columns, CUBE_CHUNK_SIZE).transpose(2, 0, 1, 3)
+            if cube_mask is not None:
+                cube_mask[chunk_row] = mask_strip.reshape(CUBE_CHUNK_SIZE, chunk_columns, CUBE_CHUNK_SIZE).transpose(1, 0, 2)
+
+        cube_date.flush()
+        if cube_mask is not None:
+            cube_mask.flush()
+    except Exception:
+        del cube_date, cube_mask
+        for partial_file in [date_file + '.partial', mask_file + '.partial']:
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+        raise
+    finally:
+        sources = None
+
+    del cube_date
+    os.replace(date_file + '.partial', date_file)
+    if cube_mask is not None:
+        del cube_mask
+        os.replace(mask_file + '.partial', mask_file)
+    elif os.path.isfile(mask_file):
+        os.remove(mask_file)
+    return date_file
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Build or update cube
+
+def read_metadata(cube_directory):
+    metadata_path = os.path.join(cube_directory, CUBE_METADATA)
+    if not os.path.isfile(metadata_path):
+        return None
+    with open(metadata_path) as metadata_file:
+        return json.load(metadata_file)
+
+# Write JSON file to a temporary file first, so that readers never see it half written
+def write_metadata(cube_directory, metadata):
+    metadata_path = os.path.join(cube_directory, CUBE_METADATA)
+    with open(metadata_path + '.partial', 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent = 2)
+    os.replace(metadata_path + '.partial', metadata_path)
+
+# Return record of composites making up a date and of their cloud masks, by which a date whose composites or cloud masks were added, rewritten, or removed is recognised
+def composite_record(composite_paths):
+    file_paths = list(composite_paths) + [m for m in map(composite_cloud_mask, composite_paths) if m is not None]
+    return [[os.path.basename(f), os.path.getsize(f), int(os.path.getmtime(f))] for f in file_paths]
+
+# Build cube of band set from composites within imagery directory, or bring an existing one up to date by writing only dates that are new or whose composites changed
+def update_cube(imagery_directory, band_set, composite_paths, messages = print):
+
+    if gdal is None:
+        raise RuntimeError('GDAL Python bindings (osgeo) are required to build an imagery cube')
+
+    cube_directory = cube_directory_name(imagery_directory, band_set)
+    os.makedirs(cube_directory, exist_ok = True)
+    bands_list = sentinel_composite.band_set_bands(band_set)
+
+    grid, grid_composites = common_grid(composite_paths, len(bands_list), messages)
+    if grid is None:
+        messages('No composites of band set {} to add to cube'.format(band_set))
+        return None
+
+    # Group composites by sensing date
+    dates = {}
+    for composite_path in grid_composites:
+        dates.setdefault(parse_composite_name(composite_path)[0], []).append(composite_path)
+
+    # Keep dates already within cube only where its grid and chunk size are unchanged (otherwise, e.g. where composites of a new tile widen it, every date is rewritten)
+    metadata = read_metadata(cube_directory)
+    if metadata is not None and (metadata['grid'] != grid or metadata.get('chunk_size') != CUBE_CHUNK_SIZE):
+        messages('Grid or chunk size of cube {} changed, rebuilding every date'.format(os.path.basename(cube_directory)))
+        metadata = None
+    if metadata is None:
+        metadata = {'band_set': band_set, 'bands': bands_list, 'dtype': numpy.dtype(CUBE_DTYPE).name, 'nodata': CUBE_NODATA, 'grid': grid, 'chunk_size': CUBE_CHUNK_SIZE, 'dates': {}}
+
+    written = 0
+    for date in sorted(dates):
+        record = composite_record(dates[date])
+        if metadata['dates'].get(date) == record and os.path.isfile(date_file_name(cube_directory, date)):
+            continue
+
+        write_date(cube_directory, date, dates[date], grid, len(bands_list))
+        written += 1
+
+        # Record date once its arrays are in place, so that an interrupted update resumes where it stopped
+        metadata['dates'][date] = record
+        write_metadata(cube_directory, metadata)
+
+    # Remove dates whose composites are no longer within imagery directory
+    for date in [d for d in metadata['dates'] if d not in dates]:
+        del metadata['dates'][date]
+        for cube_file in [date_file_name(cube_directory, date), mask_file_name(cube_directory, date)]:
+            if os.path.isfile(cube_file):
+                os.remove(cube_file)
+    write_metadata(cube_directory, metadata)
+
+    messages('Cube {}: {} dates ({} written), {} bands, {} x {} cells in chunks of {} x {}'.format(os.path.basename(cube_directory), len(metadata['dates']), written, len(bands_list), grid['x_size'], grid['y_size'], CUBE_CHUNK_SIZE, CUBE_CHUNK_SIZE))
+    return cube_directory
+
+#----------------------------------------------------------------------------------------------
+
+# 5. Read windows of cube
+
+# Return window (x, y, columns, rows) of chunked array (chunk row x chunk column x [band x] y x x), assembled from only the chunks overlapping it
+def read_chunks(chunks, x, y, columns, rows):
+    chunk_size = chunks.shape[-1]
+    window = numpy.empty(chunks.shape[2:-2] + (rows, columns), dtype = chunks.dtype)
+
+    for chunk_row in range(y // chunk_size, (y + rows - 1) // chunk_size + 1):
+        for chunk_column in range(x // chunk_size, (x + columns - 1) // chunk_size + 1):
+            top, left = chunk_row * chunk_size, chunk_column * chunk_size
+            y_start, y_end = max(y, top), min(y + rows, top + chunk_size)
+            x_start, x_end = max(x, left), min(x + columns, left + chunk_size)
+            window[..., y_start - y:y_end - y, x_start - x:x_end - x] = chunks[chunk_row, chunk_column, ..., y_start - top:y_end - top, x_start - left:x_end - left]
+
+    return window
+
+class ImageryCube(object):
+    """Imagery cube opened for reading, whose windows are assembled from the memory-mapped chunks of its date (and cloud mask) array files overlapping them."""
+
+    def __init__(self, cube_directory):
+        metadata = read_metadata(cube_directory)
+        if metadata is None or metadata.get('chunk_size') is None:
+            raise ValueError('{} is not an imagery cube (or was built before cubes were chunked; rerun 0.27)'.format(cube_directory))
+
+        self.cube_directory = cube_directory
+        self.imagery_directory = os.path.dirname(os.path.abspath(cube_directory))
+        self.band_set = metadata['band_set']
+        self.bands = metadata['bands']
+        self.dates = sorted(metadata['dates'])
+        self.records = metadata['dates']
+        self.nodata = metadata['nodata']
+        self.projection = metadata['grid']['projection']
+        self.geotransform = metadata['grid']['geotransform']
+        self.x_size = metadata['grid']['x_size']
+        self.y_size = metadata['grid']['y_size']
+        self.chunk_size = metadata['chunk_size']
+
+        # Array files are mapped the first time a date is read
+        self.arrays = {}
+        self.masks = {}
+
+    # Return chunked array (chunk row x chunk column x band x y x x) of date, mapped into memory rather than read
+    def date_array(self, date):
+        if date not in self.arrays:
+            self.arrays[date] = numpy.load(date_file_name(self.cube_directory, date), mmap_mode = 'r')
+        return self.arrays[date]
+
+    # Return whether date has a cloud mask, and its chunked array (chunk row x chunk column x y x x), mapped into memory rather than read
+    def has_cloud_mask(self, date):
+        return os.path.isfile(mask_file_name(self.cube_directory, date))
+
+    def mask_array(self, date):
+        if date not in self.masks:
+            self.masks[date] = numpy.load(mask_file_name(self.cube_directory, date), mmap_mode = 'r')
+        return self.masks[date]
+
+    # Return a composite of date, on the snap grid cube shares, for tools needing a raster on disk to snap to (e.g. ArcGIS rasterising fields)
+    def snap_raster(self, date):
+        composite_names = [r[0] for r in self.records[date] if not r[0].endswith(sentinel_composite.CLOUD_MASK_SUFFIX)]
+        return os.path.join(self.imagery_directory, composite_names[0])
+
+    # Return window (x, y, columns, rows) of cube covering extent (west, south, east, north, in cube's coordinate system), clipped to cube
+    def extent_window(self, west, south, east, north):
+        origin_x, resolution, origin_y = self.geotransform[0], self.geotransform[1], self.geotransform[3]
+        x_start = max(int(numpy.floor((west - origin_x) / resolution)), 0)
+        x_end = min(int(numpy.ceil((east - origin_x) / resolution)), self.x_size)
+        y_start = max(int(numpy.floor((origin_y - north) / resolution)), 0)
+        y_end = min(int(numpy.ceil((origin_y - south) / resolution)), self.y_size)
+        return x_start, y_start, max(x_end - x_start, 0), max(y_end - y_start, 0)
+
+    # Return window (x, y, columns, rows) of a date, either of a single band (e.g. '08') as y x x or of every band as band x y x x, reading only the chunks overlapping it
+    def window(self, date, band = None, x = 0, y = 0, columns = None, rows = None):
+        columns = self.x_size - x if columns is None else columns
+        rows = self.y_size - y if rows is None else rows
+        array = self.date_array(date)
+        if band is not None:
+            array = array[:, :, self.bands.index(band)]
+        return read_chunks(array, x, y, columns, rows)
+
+    # Return window (x, y, columns, rows) of cloud mask of a date as y x x, reading only the chunks overlapping it
+    def mask_window(self, date, x = 0, y = 0, columns = None, rows = None):
+        columns = self.x_size - x if columns is None else columns
+        rows = self.y_size - y if rows is None else rows
+        return read_chunks(self.mask_array(date), x, y, columns, rows)
+
+    # Return geotransform of window, for writing or georeferencing values read from it
+    def window_geotransform(self, x, y):
+        return [self.geotransform[0] + x * self.geotransform[1], self.geotransform[1], 0.0, self.geotransform[3] + y * self.geotransform[5], 0.0, self.geotransform[5]]
+
+    def close(self):
+        self.arrays = {}
+        self.masks = {}
+
+# Open cube of band set within imagery directory, or return None if it has not been built
+def open_cube(imagery_directory, band_set):
+    cube_directory = cube_directory_name(imagery_directory, band_set)
+    if read_metadata(cube_directory) is None:
+        return None
+    return ImageryCube(cube_directory)
+
+# Return whether raster path is an array file of a cube (of a date, or of its cloud mask)
+def is_cube_file(raster_path):
+    return str(raster_path).lower().endswith('.npy') and os.path.isfile(os.path.join(os.path.dirname(str(raster_path)), CUBE_METADATA))
+
+# Return cube holding array file, date of array file, and whether it is the date's cloud mask
+def open_cube_file(cube_file):
+    file_name = os.path.basename(cube_file)
+    cloud_mask = file_name.endswith(CUBE_MASK_SUFFIX)
+    date = file_name[:-len(CUBE_MASK_SUFFIX)] if cloud_mask else os.path.splitext(file_name)[0]
+    return ImageryCube(os.path.dirname(cube_file)), date, cloud_mask
+
+# Return array files of cube (date, and its cloud mask or None) holding composite, where the cube of composite's band set within its imagery directory holds composite (and its cloud mask) as they are now;
+#   otherwise None, and composite is read itself. The date's array mosaics every composite of that date on cube's grid.
+def cube_files_of_composite(composite_path):
+    composite_name = parse_composite_name(composite_path)
+    if composite_name is None:
+        return None
+
+    cube_directory = cube_directory_name(os.path.dirname(os.path.abspath(composite_path)), composite_name[1])
+    metadata = read_metadata(cube_directory)
+    if metadata is None or metadata.get('chunk_size') != CUBE_CHUNK_SIZE:
+        return None
+
+    date = composite_name[0]
+    record = metadata['dates'].get(date, [])
+    date_file = date_file_name(cube_directory, date)
+
+    # Compare cube's record of composite and its cloud mask (present, absent, or rewritten) with them as they are now
+    names = [os.path.basename(composite_path), os.path.basename(sentinel_composite.cloud_mask_name(composite_path))]
+    if [r for r in record if r[0] in names] != composite_record([composite_path]) or not os.path.isfile(date_file):
+        return None
+
+    mask_file = mask_file_name(cube_directory, date)
+    return date_file, (mask_file if os.path.isfile(mask_file) else None)
@@ -0,0 +1,423 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_download.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinelsat Python package (and its dependency, requests) and sentinel_catalog.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+#                   Only the OData endpoints of the hub are used (Products('<uuid>') for metadata and Products('<uuid>')/$value for the zip), so pointing
+#                   sentinelsat.SentinelAPI(api_url = ...) at a local stand-in server that serves synthetic SAFE zips is enough to exercise it.
+
+# Description:      This module downloads Sentinel-2 products with a pool of worker threads, limiting both the total number of concurrent downloads
+#                   and the number of concurrent downloads per host, retrying each product with exponential backoff, and summarizing throughput per product.
+#                   Downloads resume from the partial file on disk with HTTP range requests, the MD5 checksum is computed while bytes stream in, and
+#                   products that fail the checksum are moved to a quarantine folder so they never reach the composite loop.
+#                   Offline products are handed to a background scheduler that requests their retrieval from the Long Term Archive within the hub quota,
+#                   polls with backoff, and downloads each one as soon as it comes online; its queue is kept in the product catalog so it survives interruption.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Limit concurrent connections per host
+# 2. Stream a single product to disk, resuming from and verifying partial downloads
+# 3. Download a single product with retries and backoff
+# 4. Download many products with a pool of workers
+# 5. Summarize throughput per product
+# 6. Retrieve offline products from the Long Term Archive in the background
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, time, hashlib, threading, concurrent.futures, sentinel_catalog
+from urllib.parse import urlparse
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Copernicus Open Access Hub allows two concurrent downloads per user account, so default to two per host
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 10
+
+# Size of each chunk streamed to disk (1 MB)
+CHUNK_SIZE = 2 ** 20
+
+# Name of folder (within output directory) that products failing checksum are moved to
+QUARANTINE_FOLDER = 'quarantine'
+
+# Copernicus Open Access Hub accepts one Long Term Archive retrieval request per user every 30 minutes
+DEFAULT_LTA_TRIGGER_INTERVAL_SECONDS = 1800
+
+# First wait before checking whether a requested product is online, doubled after every check up to the maximum
+DEFAULT_LTA_POLL_SECONDS = 300
+DEFAULT_LTA_MAX_POLL_SECONDS = 3600
+
+# Number of failed retrieval requests or failed downloads (once online) of a product after which scheduler gives up on it for this session
+DEFAULT_LTA_MAX_FAILURES = 3
+
+#--------------------------------------------
+
+# 0.2 Define exception raised when a downloaded product does not match the MD5 checksum published by the hub
+
+class ChecksumError(IOError):
+    pass
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Limit concurrent connections per host
+
+class HostLimiter(object):
+    """Hand out one bounded semaphore per host so that no host receives more than max_per_host concurrent downloads."""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, url):
+        host = urlparse(url).netloc
+
+        # Create semaphore for host the first time it is seen
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Stream a single product to disk, resuming from and verifying partial downloads
+
+def quarantine_file(file_path, directory_path):
+
+    # Create quarantine folder if it does not already exist and move file into it (replacing any earlier quarantined copy)
+    quarantine_path = os.path.join(directory_path, QUARANTINE_FOLDER)
+    os.makedirs(quarantine_path, exist_ok = True)
+    quarantined_file = os.path.join(quarantine_path, os.path.basename(file_path).replace('.incomplete', ''))
+    os.replace(file_path, quarantined_file)
+
+    return quarantined_file
+
+def stream_product(session, product_info, directory_path):
+
+    # Assign variables to final zip file and to the partial file written to while streaming (so a partial file is never mistaken for a finished product)
+    zip_path = os.path.join(directory_path, product_info['title'] + '.zip')
+    partial_path = zip_path + '.incomplete'
+    expected_size = int(product_info['size'])
+
+    # Start the checksum with whatever a previous attempt (or run) left on disk so the finished file never has to be re-read
+    md5 = hashlib.md5()
+    offset = 0
+
+    if os.path.isfile(partial_path):
+        offset = os.path.getsize(partial_path)
+
+        # Discard partial file if it is larger than the product itself
+        if offset > expected_size:
+            os.remove(partial_path)
+            offset = 0
+        else:
+            with open(partial_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    md5.update(chunk)
+
+    bytes_written = 0
+
+    # Request only the bytes not yet on disk
+    if offset < expected_size:
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+        with session.get(product_info['url'], headers = headers, stream = True, timeout = 60) as response:
+            response.raise_for_status()
+
+            # Start over if server ignored range request and is sending the whole product
+            if offset and response.status_code != 206:
+                md5 = hashlib.md5()
+                offset = 0
+
+            with open(partial_path, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size = CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        md5.update(chunk)
+                        bytes_written += len(chunk)
+
+    # Raise error if connection closed before the full product was received (partial file is kept so the next attempt resumes from it)
+    if offset + bytes_written != expected_size:
+        raise IOError('Received {} of {} bytes for {}'.format(offset + bytes_written, expected_size, product_info['title']))
+
+    # Quarantine product if checksum does not match that published in product metadata
+    if md5.hexdigest().lower() != product_info['md5'].lower():
+        quarantined_file = quarantine_file(partial_path, directory_path)
+        raise ChecksumError('Checksum of {} does not match {}; moved to {}'.format(product_info['title'], product_info['md5'], quarantined_file))
+
+    os.replace(partial_path, zip_path)
+
+    return bytes_written, offset
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Download a single product with retries and backoff
+
+def download_product(api, product_id, directory_path, host_limiter, max_attempts = DEFAULT_MAX_ATTEMPTS, backoff_seconds = DEFAULT_BACKOFF_SECONDS):
+
+    # Create dictionary recording outcome of download
+    result = {'id': product_id, 'title': None, 'status': 'failed', 'bytes': 0, 'resumed_bytes': 0, 'seconds': 0.0, 'attempts': 0, 'md5': None, 'error': None}
+
+    for attempt in range(1, max_attempts + 1):
+        result['attempts'] = attempt
+        try:
+            product_info = api.get_product_odata(product_id)
+            result['title'] = product_info['title']
+
+            # Skip products held in the Long Term Archive
+            if not product_info['Online']:
+                result['status'] = 'offline'
+                return result
+
+            # Skip products already downloaded in full
+            zip_path = os.path.join(directory_path, product_info['title'] + '.zip')
+            if os.path.isfile(zip_path) and os.path.getsize(zip_path) == int(product_info['size']):
+                result['status'] = 'exists'
+                return result
+
+            # Wait for a free connection to the host serving the product, then time the download
+            with host_limiter.semaphore(product_info['url']):
+                start = time.time()
+                result['bytes'], result['resumed_bytes'] = stream_product(api.session, product_info, directory_path)
+                result['seconds'] = time.time() - start
+
+            result['status'] = 'downloaded'
+            result['md5'] = product_info['md5']
+            result['error'] = None
+            return result
+
+        except ChecksumError as e:
+            result['status'] = 'quarantined'
+            result['error'] = str(e)
+
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+
+        # Wait twice as long after every failed attempt (e.g. 10, 20, 40 seconds)
+        if attempt < max_attempts:
+            time.sleep(backoff_seconds * 2 ** (attempt - 1))
+
+    return result
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Download many products with a pool of workers
+
+# Report outcome of a single download
+def report_download(result, messages):
+    if result['status'] == 'downloaded':
+        messages('Downloaded {} ({:.1f} MB in {:.0f} s)'.format(result['title'], result['bytes'] / 2 ** 20, result['seconds']))
+    elif result['status'] == 'exists':
+        messages('{} already exists in output directory'.format(result['title']))
+    elif result['status'] == 'offline':
+        messages('Product {} is not online.'.format(result['id']))
+    elif result['status'] == 'quarantined':
+        messages('Quarantined product {} after {} attempts: {}'.format(result['id'], result['attempts'], result['error']))
+    else:
+        messages('Failed to download product {} after {} attempts: {}'.format(result['id'], result['attempts'], result['error']))
+
+def download_products(api, product_ids, directory_path, max_workers = DEFAULT_MAX_WORKERS, max_per_host = DEFAULT_MAX_PER_HOST, max_attempts = DEFAULT_MAX_ATTEMPTS, backoff_seconds = DEFAULT_BACKOFF_SECONDS, messages = print):
+
+    host_limiter = HostLimiter(max_per_host)
+    results = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(download_product, api, p, directory_path, host_limiter, max_attempts, backoff_seconds) for p in product_ids]
+
+        # Report each product as soon as it finishes rather than in submission order
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            report_download(result, messages)
+
+    return results
+
+#----------------------------------------------------------------------------------------------
+
+# 5. Summarize throughput per product
+
+def summarize_downloads(results, wall_seconds, messages = print):
+
+    downloaded = [r for r in results if r['status'] == 'downloaded']
+
+    for r in downloaded:
+        rate = r['bytes'] / 2 ** 20 / r['seconds'] if r['seconds'] else 0.0
+        resumed = ', resumed after {:.1f} MB'.format(r['resumed_bytes'] / 2 ** 20) if r['resumed_bytes'] else ''
+        messages('{}: {:.1f} MB in {:.0f} s ({:.2f} MB/s, {} attempt(s){})'.format(r['title'], r['bytes'] / 2 ** 20, r['seconds'], rate, r['attempts'], resumed))
+
+    total_bytes = sum(r['bytes'] for r in downloaded)
+    total_rate = total_bytes / 2 ** 20 / wall_seconds if wall_seconds else 0.0
+
+    # Count products by final status (downloaded, exists, offline, failed)
+    status_counts = {}
+    for r in results:
+        status_counts[r['status']] = status_counts.get(r['status'], 0) + 1
+
+    messages('Download summary: ' + ', '.join('{} {}'.format(v, k) for k, v in sorted(status_counts.items())))
+    messages('Aggregate throughput: {:.1f} MB in {:.0f} s ({:.2f} MB/s)'.format(total_bytes / 2 ** 20, wall_seconds, total_rate))
+
+#----------------------------------------------------------------------------------------------
+
+# 6. Retrieve offline products from the Long Term Archive in the background
+
+class LongTermArchiveScheduler(object):
+    """Request offline products from the Long Term Archive, poll with backoff until each is online, and download it straight away."""
+
+    def __init__(self, api, directory_path, max_workers = DEFAULT_MAX_WORKERS, max_per_host = DEFAULT_MAX_PER_HOST, trigger_interval_seconds = DEFAULT_LTA_TRIGGER_INTERVAL_SECONDS, poll_seconds = DEFAULT_LTA_POLL_SECONDS, max_poll_seconds = DEFAULT_LTA_MAX_POLL_SECONDS, max_failures = DEFAULT_LTA_MAX_FAILURES, messages = print):
+        self.api = api
+        self.directory_path = directory_path
+        self.max_workers = max_workers
+        self.host_limiter = HostLimiter(max_per_host)
+        self.trigger_interval_seconds = trigger_interval_seconds
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.max_failures = max_failures
+        self.messages = messages
+        self.results = []
+        self.failures = {}
+        self.stop_event = threading.Event()
+
+        # Count of downloads finished since main thread last waited, so that a download finishing while it is busy (e.g. compositing) is not missed
+        self.downloaded = threading.Condition()
+        self.downloads_ready = 0
+        self.finished = False
+        self.thread = threading.Thread(target = self.run, daemon = True)
+
+    # Add offline products to queue persisted in catalog
+    def add(self, product_ids):
+        with sentinel_catalog.ProductCatalog(self.directory_path) as catalog:
+            catalog.queue_lta_requests(product_ids)
+
+    def start(self):
+        self.thread.start()
+
+    def is_alive(self):
+        return not self.finished
+
+    # Block until another product has been downloaded (since last call), queue is empty, or timeout (in seconds) is reached
+    def wait_for_download(self, timeout):
+        with self.downloaded:
+            self.downloaded.wait_for(lambda: self.downloads_ready or self.finished, max(timeout, 0))
+            self.downloads_ready = 0
+
+    # Stop requesting and polling (queue stays in catalog for next session) after downloads already started have finished
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    # Count failure of product, giving up on it (until queued again in a later session) once it has failed max_failures times; return whether it was given up
+    def record_failure(self, catalog, uuid, error):
+        self.failures[uuid] = self.failures.get(uuid, 0) + 1
+        if self.failures[uuid] < self.max_failures:
+            return False
+        catalog.update_lta_request(uuid, 'failed', self.failures[uuid], None, 0)
+        self.messages('Gave up on retrieving product {} from Long Term Archive after {} failures: {}'.format(uuid, self.failures[uuid], error))
+        return True
+
+    def record_result(self, catalog, result):
+        self.results.append(result)
+        catalog.record_downloads([result])
+        report_download(result, self.messages)
+
+        # Return product to queue if it went offline again, or if download failed once online (up to max_failures times)
+        if result['status'] in ('downloaded', 'exists'):
+            catalog.update_lta_request(result['id'], 'downloaded', 0, None, 0)
+        elif result['status'] == 'offline' or not self.record_failure(catalog, result['id'], result['error']):
+            catalog.update_lta_request(result['id'], 'pending', 0, None, time.time() + self.poll_seconds)
+
+        with self.downloaded:
+            self.downloads_ready += 1
+            self.downloaded.notify_all()
+
+    def run(self):
+
+        # Open catalog within scheduler thread (SQLite connections cannot be shared between threads)
+        catalog = sentinel_catalog.ProductCatalog(self.directory_path)
+        in_flight = {}
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                while not self.stop_event.is_set():
+
+                    # Record downloads that have finished
+                    for future in [f for f in in_flight if f.done()]:
+                        self.record_result(catalog, future.result())
+                        del in_flight[future]
+
+                    pending = [r for r in catalog.pending_lta_requests() if r['uuid'] not in in_flight.values()]
+
+                    # Finish once queue is empty and nothing is downloading
+                    if not pending and not in_flight:
+                        break
+
+                    now = time.time()
+                    last_trigger = catalog.last_lta_trigger()
+
+                    for request in pending:
+                        uuid = request['uuid']
+
+                        if request['next_poll'] > now:
+                            continue
+
+                        try:
+                            # Check whether product is online (either retrieved by an earlier request, or by another user)
+                            if self.api.is_online(uuid):
+                                self.messages('Product {} is now online. Starting download.'.format(uuid))
+                                future = executor.submit(download_product, self.api, uuid, self.directory_path, self.host_limiter)
+                                in_flight[future] = uuid
+                                continue
+
+                            # Request retrieval if product has not yet been requested and hub quota allows another request
+                            if request['status'] == 'pending':
+                                if now - last_trigger >= self.trigger_interval_seconds:
+                                    self.api.trigger_offline_retrieval(uuid)
+                                    last_trigger = now
+                                    catalog.update_lta_request(uuid, 'triggered', 0, now, now + self.poll_seconds)
+                                    self.messages('Requested retrieval of product {} from Long Term Archive'.format(uuid))
+                                continue
+
+                            # Otherwise wait twice as long before checking again (up to the maximum)
+                            wait = min(self.poll_seconds * 2 ** (request['attempts'] + 1), self.max_poll_seconds)
+                            catalog.update_lta_request(uuid, 'triggered', request['attempts'] + 1, request['triggered_at'], now + wait)
+
+                        # Back off if hub refuses request (e.g. quota exceeded) or cannot be reached, giving up after max_failures failures
+                        except Exception as e:
+                            if self.record_failure(catalog, uuid, e):
+                                continue
+                            wait = min(self.poll_seconds * 2 ** (request['attempts'] + 1), self.max_poll_seconds)
+                            catalog.update_lta_request(uuid, request['status'], request['attempts'] + 1, request['triggered_at'], now + wait)
+                            self.messages('Long Term Archive request for product {} failed, retrying in {:.0f} minutes: {}'.format(uuid, wait / 60, e))
+
+                    # Sleep until stopped or next check (at most 5 seconds so finished downloads are recorded promptly)
+                    self.stop_event.wait(5)
+
+                # Let downloads already started finish before closing
+                for future in concurrent.futures.as_completed(list(in_flight)):
+                    self.record_result(catalog, future.result())
+
+        finally:
+            catalog.close()
+
+            with self.downloaded:
+                self.finished = True
+                self.downloaded.notify_all()
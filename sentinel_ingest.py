@@ -0,0 +1,273 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_ingest.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinel_catalog.py, sentinel_safe.py, sentinel_composite.py, sentinel_manifest.py, and sentinel_band_cache.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module holds the Sentinel-2 Level-1C ingest steps shared by tools 0.21, 0.23, 0.24, and 0.26: organizing user-selected bands into the
+#                   band set used in composite names (e.g. 2-4_8), planning the remaining work of a run, and compositing downloaded products that lack a composite.
+#                   The plan is computed from the catalog and a single listing of the output directory, and lists the queries, downloads, extractions, and
+#                   composites still to do with their bytes and an estimate of processing time, so that a dry run can show it before a multi-hour run is started.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Organize user-selected bands
+# 2. Plan remaining work
+# 3. Composite downloaded products lacking a composite
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, zipfile, sentinel_catalog, sentinel_safe, sentinel_composite, sentinel_manifest, sentinel_band_cache
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Typical size (MB) of each band's JPEG2000 file within a Level-1C product (10 m bands: 02, 03, 04, 08; 20 m bands: 05, 06, 07, 11, 12; 60 m bands: 01, 09, 10),
+#   used to estimate bytes for products not yet downloaded
+TYPICAL_BAND_MB = {'01': 4, '02': 110, '03': 110, '04': 110, '05': 30, '06': 30, '07': 30, '08': 110, '09': 4, '10': 4, '11': 30, '12': 30}
+
+# Typical size (MB) of a Level-1C product zip file, used when catalog has no size recorded
+TYPICAL_PRODUCT_MB = 750
+
+# Approximate processing time to decode and composite one MB of JPEG2000 band file on a single core
+COMPOSITE_SECONDS_PER_MB = 0.1
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Organize user-selected bands
+
+# Function to convert list of numbers into a string that more elegantly expresses instances of consecutive sequences
+#   Adapted from: https://stackoverflow.com/questions/29418693/write-ranges-of-numbers-with-dashes
+
+def organize_list_of_integers(band_numbers):
+    seq = []
+    final = []
+    last = 0
+
+    for index, val in enumerate(band_numbers):
+        # Check to see if current value is either the first in list or a consecutive number from the previous
+
+        # If element is either first element or consecutive number, add value to sequence list
+        if last + 1 == val or index == 0:
+            seq.append(val)
+            last = val
+        # If element is not consecutive number
+        else:
+            # Either add string of first-last in the case of a sequence
+            if len(seq) > 1:
+               final.append(str(seq[0]) + '-' + str(seq[len(seq)-1]))
+            # Or just add previous single value to final
+            else:
+               final.append(str(seq[0]))
+            seq = []
+            seq.append(val)
+            last = val
+
+        # Check to see if loop is on last number in list (seq gets converted during the next index's turn, which doesn't exist for last index)
+        if index == len(band_numbers) - 1:
+            # Either add string of first-last in the case of a sequence
+            if len(seq) > 1:
+                final.append(str(seq[0]) + '-' + str(seq[-1]))
+            # Or just add single value to final
+            else:
+                final.append(str(seq[0]))
+    # Concatenate list of string elements in final list into one string using '_' in between elements
+    final_str = '_'.join(final)
+    return final_str
+
+# Convert list of user-selected band numbers (e.g. ['02', '03', '04', '08']) into band set used in composite names (e.g. '2-4_8')
+def band_set_name(bands_list):
+    return organize_list_of_integers(sorted(list(map(int, bands_list))))
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Plan remaining work
+
+class IngestPlan(object):
+    """Queries, downloads, extractions, and composites remaining for a run, with their bytes and estimated processing time."""
+
+    def __init__(self):
+        self.query_batches = 0
+        self.query_requests = 0
+        self.downloads = []
+        self.download_bytes = 0
+        self.extractions = []
+        self.extraction_bytes = 0
+        self.composites = []
+        self.composite_bytes = 0
+        self.composites_done = 0
+        self.estimated_products = 0
+
+    def composite_seconds(self):
+        return self.composite_bytes / 2 ** 20 * COMPOSITE_SECONDS_PER_MB
+
+    def report(self, composite_workers = 1, messages = print):
+        if self.query_batches:
+            messages('Plan: {} query batches, {} sent to hub ({} answered from cache)'.format(self.query_batches, self.query_requests, self.query_batches - self.query_requests))
+        messages('Plan: download {} products ({:.2f} GB)'.format(len(self.downloads), self.download_bytes / 2 ** 30))
+        messages('Plan: extract band files of {} products ({:.2f} GB)'.format(len(self.extractions), self.extraction_bytes / 2 ** 30))
+        messages('Plan: composite {} products ({} already composited), about {:.0f} minutes of processing ({:.0f} minutes across {} worker(s))'.format(len(self.composites), self.composites_done, self.composite_seconds() / 60, self.composite_seconds() / 60 / max(composite_workers, 1), max(composite_workers, 1)))
+        if self.estimated_products:
+            messages('Plan: bytes and processing time of {} products not yet downloaded are estimated from typical band file sizes'.format(self.estimated_products))
+
+# Return size (bytes) of band files within zip file that still need extracting, and of all band files matching user-selected bands
+def band_bytes(zip_path, directory_path, bands_list):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        band_members = [zip_ref.getinfo(n) for n in sentinel_safe.match_band_files([n for n in zip_ref.namelist() if '/IMG_DATA/' in n], bands_list)]
+
+    missing = 0
+    for member in band_members:
+        target_path = os.path.join(directory_path, *member.filename.split('/'))
+        if not os.path.isfile(target_path) or os.path.getsize(target_path) != member.file_size:
+            missing += member.file_size
+
+    return missing, sum(m.file_size for m in band_members)
+
+def plan_ingest(catalog, directory_path, product_ids = (), bands_list = None, band_set = None, from_zip = False, query_stats = None, output_format = sentinel_composite.DEFAULT_OUTPUT_FORMAT, resolution = sentinel_composite.DEFAULT_RESOLUTION, resampling = sentinel_composite.DEFAULT_RESAMPLING, crop = None):
+
+    plan = IngestPlan()
+    if query_stats:
+        plan.query_batches = query_stats['batches']
+        plan.query_requests = query_stats['requests']
+
+    product_ids = set(product_ids)
+
+    # List output directory once, rather than checking each product's zip file and composite raster separately
+    directory_entries = set(os.listdir(directory_path))
+
+    typical_band_bytes = sum(TYPICAL_BAND_MB.get(b, 0) for b in (bands_list or [])) * 2 ** 20
+
+    # Read every product (with composite recorded for band set, resolution, resampling, and crop) from catalog in a single pass
+    composite_key = sentinel_composite.composite_key(band_set, resolution, resampling, crop) if band_set is not None else None
+    for product in catalog.work_state(composite_key):
+
+        downloaded = product['download_status'] in sentinel_catalog.DOWNLOADED_STATUSES and product['zip_path'] is not None and os.path.basename(product['zip_path']) in directory_entries
+
+        # Download products returned from query that are not downloaded and verified
+        if product['uuid'] in product_ids and not downloaded:
+            plan.downloads.append(product['uuid'])
+            plan.download_bytes += product['size_bytes'] or TYPICAL_PRODUCT_MB * 2 ** 20
+        elif not downloaded:
+            continue
+
+        # Composite only Sentinel-2 Level-1C products from Copernicus Open Access Hub (if user selected to composite bands)
+        if band_set is None or not sentinel_catalog.PRODUCT_TITLE_PATTERN.match(product['title']):
+            continue
+
+        # Count composite as done only where it was written with resolution, resampling, and crop (a composite left by an earlier run with other settings is written again)
+        composite_raster_name = sentinel_composite.composite_raster_name(product['title'], composite_key, output_format)
+        if product['composite_path'] and product['composite_path'].endswith(sentinel_composite.OUTPUT_FORMATS[output_format]) and os.path.basename(product['composite_path']) in directory_entries:
+            composite_raster_name = os.path.basename(product['composite_path'])
+        if composite_raster_name in directory_entries and sentinel_composite.composite_is_current(os.path.join(directory_path, composite_raster_name), resolution, resampling, crop):
+            plan.composites_done += 1
+            continue
+
+        plan.composites.append(product['uuid'])
+
+        # Size band files exactly from zip file directory where product is downloaded; otherwise estimate from typical band file sizes
+        missing_bytes, total_bytes = typical_band_bytes, typical_band_bytes
+        if downloaded:
+            try:
+                missing_bytes, total_bytes = band_bytes(product['zip_path'], directory_path, bands_list)
+            except (zipfile.BadZipFile, OSError):
+                pass
+        else:
+            plan.estimated_products += 1
+
+        plan.composite_bytes += total_bytes
+
+        if not from_zip and missing_bytes:
+            plan.extractions.append(product['uuid'])
+            plan.extraction_bytes += missing_bytes
+
+    return plan
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Composite downloaded products lacking a composite
+
+# Return band cache directory within output directory, or None if band cache has no quota (turned off) or GDAL is unavailable
+def band_cache_directory(directory_path, band_cache_mb = 0):
+    if not band_cache_mb or sentinel_band_cache.gdal is None:
+        return None
+    return os.path.join(directory_path, sentinel_band_cache.BAND_CACHE_DIRECTORY)
+
+# Create job (passed to sentinel_composite.composite_product) for compositing product
+def composite_job(directory_path, uuid, title, zip_path, bands_list, band_set, from_zip = False, output_format = sentinel_composite.DEFAULT_OUTPUT_FORMAT, resolution = sentinel_composite.DEFAULT_RESOLUTION, resampling = sentinel_composite.DEFAULT_RESAMPLING, memory_cap_mb = sentinel_composite.DEFAULT_WORKER_MEMORY_MB, crop = None, band_cache = None):
+    return {'uuid': uuid, 'title': title, 'zip_path': zip_path, 'safe_directory': os.path.join(directory_path, title + '.SAFE'), 'composite_raster': os.path.join(directory_path, sentinel_composite.composite_raster_name(title, sentinel_composite.composite_key(band_set, resolution, resampling, crop), output_format)), 'bands_list': bands_list, 'from_zip': from_zip, 'output_format': output_format, 'resolution': resolution, 'resampling': resampling, 'memory_cap_mb': memory_cap_mb, 'crop': crop, 'band_cache': band_cache, 'extraction': None}
+
+# Return jobs for downloaded products (recorded in catalog) that do not yet have a composite raster for user-selected bands, resolution, resampling, and crop
+def composite_jobs(catalog, directory_path, bands_list, band_set, from_zip = False, output_format = sentinel_composite.DEFAULT_OUTPUT_FORMAT, resolution = sentinel_composite.DEFAULT_RESOLUTION, resampling = sentinel_composite.DEFAULT_RESAMPLING, memory_cap_mb = sentinel_composite.DEFAULT_WORKER_MEMORY_MB, crop = None, band_cache = None, messages = print):
+    jobs = []
+    composite_key = sentinel_composite.composite_key(band_set, resolution, resampling, crop)
+    is_current = lambda composite_path: sentinel_composite.composite_is_current(composite_path, resolution, resampling, crop)
+
+    for product in catalog.missing_composites(composite_key, sentinel_composite.OUTPUT_FORMATS[output_format], is_current):
+        job = composite_job(directory_path, product['uuid'], product['title'], product['zip_path'], bands_list, band_set, from_zip, output_format, resolution, resampling, memory_cap_mb, crop, band_cache)
+        composite_raster_name = os.path.basename(job['composite_raster'])
+
+        # Check to see if composite raster was generated before catalog existed; if so, record it and continue to next product (unless its manifest shows other settings, e.g. one written before they were named)
+        if os.path.isfile(job['composite_raster']):
+            if is_current(job['composite_raster']):
+                messages(composite_raster_name + ' already exists, continuing to next product')
+                catalog.record_composite(uuid = product['uuid'], band_set = composite_key, composite_path = job['composite_raster'])
+                continue
+            messages(composite_raster_name + ' already exists but with another resolution, resampling, or crop, compositing it again')
+            jobs.append(job)
+            continue
+
+        messages(composite_raster_name + ' does not already exist, proceeding')
+        jobs.append(job)
+
+    return jobs
+
+def composite_missing(catalog, directory_path, bands_list, band_set, from_zip = False, composite_workers = sentinel_composite.DEFAULT_COMPOSITE_WORKERS, memory_cap_mb = sentinel_composite.DEFAULT_WORKER_MEMORY_MB, output_format = sentinel_composite.DEFAULT_OUTPUT_FORMAT, resolution = sentinel_composite.DEFAULT_RESOLUTION, resampling = sentinel_composite.DEFAULT_RESAMPLING, crop = None, band_cache_mb = 0, messages = print):
+
+    # Keep decoded band files in band cache within output directory, if it has a quota
+    band_cache = band_cache_directory(directory_path, band_cache_mb)
+
+    jobs = composite_jobs(catalog, directory_path, bands_list, band_set, from_zip, output_format, resolution, resampling, memory_cap_mb, crop, band_cache, messages)
+
+    # Extract from zip files, several products at once, only band files matching user-selected bands (and metadata), skipping those already extracted (unless compositing straight from zip files)
+    failed_extractions = []
+
+    if not from_zip:
+        extraction_results = sentinel_safe.extract_products(zip_paths = [j['zip_path'] for j in jobs], output_directory = directory_path, bands_list = bands_list, messages = messages)
+
+        # Record extraction in catalog
+        failed_extractions = [e['zip_path'] for e in extraction_results if e['error']]
+
+        for job in jobs:
+            catalog.record_extraction(uuid = job['uuid'], status = 'failed' if job['zip_path'] in failed_extractions else 'extracted')
+
+    # Composite products (those whose band files could be extracted), several at once in separate worker processes if requested
+    composite_results = sentinel_composite.composite_products(jobs = [j for j in jobs if j['zip_path'] not in failed_extractions], max_workers = composite_workers, memory_cap_mb = memory_cap_mb, messages = messages)
+
+    # Record composites in catalog so that they are skipped on subsequent runs
+    for r in composite_results:
+        if r['status'] == 'composited':
+            catalog.record_composite(uuid = r['uuid'], band_set = sentinel_composite.composite_key(band_set, resolution, resampling, crop), composite_path = r['composite_raster'])
+
+    # Keep band cache within quota, evicting band files used least recently
+    if band_cache is not None:
+        sentinel_band_cache.evict_bands(band_cache, band_cache_mb, messages)
+
+    # Add manifests of new composites to index of output directory
+    sentinel_manifest.update_index(directory_path)
+
+    return composite_results
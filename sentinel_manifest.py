@@ -0,0 +1,168 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_manifest.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinel_catalog.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools and by tools reading their composites (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module writes a small JSON manifest alongside each composite raster (e.g. S2_MSIL1C_20200601_R113_T11SPS_B2-4_8.img.json) recording its coordinate system, geotransform,
+#                   extent, nodata values, bands, product, sensing time, tile, relative orbit, cloud cover, and per-band statistics, and keeps an index of every manifest within an imagery directory
+#                   (imagery_index.json), so that tools can select and validate imagery (and read its dates and extent) without opening or describing any raster.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Read product metadata
+# 2. Write and read manifest of a composite raster
+# 3. Index manifests within an imagery directory
+# 4. Select imagery from index
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, re, glob, json, zipfile, sentinel_catalog
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Extension of manifest added to name of composite raster it describes (so that ERDAS IMAGINE and Cloud-Optimized GeoTIFF composites of a product each have their own), and name of index of manifests within imagery directory
+MANIFEST_EXTENSION = '.json'
+INDEX_NAME = 'imagery_index.json'
+
+# Product metadata file within product zip file or SAFE directory, and elements holding sensing time and cloud cover (percent of tile)
+PRODUCT_METADATA = 'MTD_MSIL1C.xml'
+SENSING_TIME_PATTERN = re.compile(r'<PRODUCT_START_TIME>([^<]+)</PRODUCT_START_TIME>')
+CLOUD_COVER_PATTERN = re.compile(r'<Cloud_Coverage_Assessment>([^<]+)</Cloud_Coverage_Assessment>')
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Read product metadata
+
+# Return product title, tile, relative orbit, sensing date and time, and cloud cover of product, read from its title and its product metadata (within zip file, or else SAFE directory)
+def product_metadata(title, zip_path = None, safe_directory = None):
+    metadata = dict(sentinel_catalog.parse_product_title(title), product = title, sensing_time = None, cloud_cover = None)
+
+    metadata_text = None
+    try:
+        if zip_path is not None:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                members = [n for n in zip_ref.namelist() if n.endswith('/' + PRODUCT_METADATA)]
+                if members:
+                    metadata_text = zip_ref.read(members[0]).decode('utf-8', 'replace')
+        elif safe_directory is not None and os.path.isfile(os.path.join(safe_directory, PRODUCT_METADATA)):
+            with open(os.path.join(safe_directory, PRODUCT_METADATA), encoding = 'utf-8', errors = 'replace') as metadata_file:
+                metadata_text = metadata_file.read()
+    except (zipfile.BadZipFile, OSError):
+        pass
+
+    if metadata_text is not None:
+        sensing_time = SENSING_TIME_PATTERN.search(metadata_text)
+        cloud_cover = CLOUD_COVER_PATTERN.search(metadata_text)
+        metadata['sensing_time'] = sensing_time.group(1) if sensing_time else None
+        metadata['cloud_cover'] = float(cloud_cover.group(1)) if cloud_cover else None
+
+    return metadata
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Write and read manifest of a composite raster
+
+def manifest_name(raster_path):
+    return raster_path + MANIFEST_EXTENSION
+
+# Write manifest to a partial file renamed once complete, so that an interrupted write never leaves a manifest half written
+def write_manifest(raster_path, manifest):
+    manifest_path = manifest_name(raster_path)
+    with open(manifest_path + '.partial', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent = 2)
+    os.replace(manifest_path + '.partial', manifest_path)
+    return manifest_path
+
+# Return manifest of raster, or None if raster has none (e.g. a composite generated with ArcGIS, or a raster not written by the 0.2x tools)
+def read_manifest(raster_path):
+    manifest_path = manifest_name(raster_path)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except ValueError:
+        return None
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Index manifests within an imagery directory
+
+# Bring index of imagery directory up to date (reading only manifests changed since it was last written) and return it, keyed by composite raster name
+def update_index(imagery_directory):
+    index_path = os.path.join(imagery_directory, INDEX_NAME)
+
+    index = {}
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+        except ValueError:
+            index = {}
+
+    # Reuse index entries of manifests unchanged since index was written
+    indexed = {e.get('manifest'): e for e in index.values()}
+
+    current = {}
+    changed = False
+    for manifest_path in glob.glob(os.path.join(imagery_directory, 'S2_MSIL1C_*' + MANIFEST_EXTENSION)):
+        manifest_file_name = os.path.basename(manifest_path)
+        manifest_mtime = os.path.getmtime(manifest_path)
+
+        entry = indexed.get(manifest_file_name)
+        if entry is None or entry.get('manifest_mtime') != manifest_mtime:
+            try:
+                with open(manifest_path) as manifest_file:
+                    entry = dict(json.load(manifest_file), manifest = manifest_file_name, manifest_mtime = manifest_mtime)
+            except ValueError:
+                continue
+            changed = True
+
+        # Index only manifests whose composite raster is still within imagery directory
+        if os.path.isfile(os.path.join(imagery_directory, entry['composite'])):
+            current[entry['composite']] = entry
+
+    if changed or set(current) != set(index):
+        with open(index_path + '.partial', 'w') as index_file:
+            json.dump(current, index_file, indent = 2, sort_keys = True)
+        os.replace(index_path + '.partial', index_path)
+
+    return current
+
+#----------------------------------------------------------------------------------------------
+
+# 4. Select imagery from index
+
+# Return manifests (sorted by sensing date) of composites matching band set, tile, sensing dates (YYYYMMDD, inclusive), and maximum cloud cover (percent), each where given
+def select_imagery(index, band_set = None, tile = None, start_date = None, end_date = None, max_cloud_cover = None):
+    selected = []
+    for manifest in index.values():
+        if band_set is not None and manifest.get('band_set') != band_set:
+            continue
+        if tile is not None and manifest.get('tile') != tile:
+            continue
+        if start_date is not None and manifest.get('sensing_date', '') < start_date:
+            continue
+        if end_date is not None and manifest.get('sensing_date', '') > end_date:
+            continue
+        if max_cloud_cover is not None and manifest.get('cloud_cover') is not None and manifest['cloud_cover'] > max_cloud_cover:
+            continue
+        selected.append(manifest)
+    return sorted(selected, key = lambda m: (m.get('sensing_date') or '', m['composite']))
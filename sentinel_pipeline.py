@@ -0,0 +1,301 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_pipeline.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinel_download.py, sentinel_catalog.py, sentinel_safe.py, sentinel_composite.py, sentinel_manifest.py, sentinel_band_cache.py, and sentinel_ingest.py (in same directory as this module)
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module runs downloading, band extraction, and compositing of Sentinel-2 Level-1C products as overlapping stages connected by bounded queues,
+#                   so that each product is extracted and composited as soon as its download and checksum finish while other downloads carry on,
+#                   and wall time approaches that of the slowest stage rather than the sum of all three. When a queue is full the stage feeding it waits
+#                   (back-pressure), so downloads cannot run far ahead of compositing and fill scratch disk. Each stage's utilisation is reported at the end.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Track stage utilisation and queue back-pressure
+# 2. Run download, extraction, and composite stages
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, time, queue, threading, contextlib, concurrent.futures, sentinel_download, sentinel_catalog, sentinel_safe, sentinel_composite, sentinel_manifest, sentinel_band_cache, sentinel_ingest
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Number of products each stage may hold waiting for the next stage, per worker of next stage
+QUEUE_SLOTS_PER_WORKER = 2
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Track stage utilisation and queue back-pressure
+
+class StageMonitor(object):
+    """Busy time and number of products handled by a pipeline stage."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.items += 1
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds, messages):
+        utilisation = self.busy_seconds / (wall_seconds * self.workers) if wall_seconds else 0.0
+        messages('{} stage: {} products, {:.0f} s busy across {} worker(s) ({:.0%} utilisation)'.format(self.name, self.items, self.busy_seconds, self.workers, utilisation))
+
+class MonitoredQueue(queue.Queue):
+    """Bounded queue recording its high-water mark and how long producers waited for space (back-pressure)."""
+
+    def __init__(self, name, maxsize):
+        queue.Queue.__init__(self, maxsize)
+        self.name = name
+        self.high_water = 0
+        self.blocked_seconds = 0.0
+
+    def put(self, item, block = True, timeout = None):
+        start = time.time()
+        queue.Queue.put(self, item, block, timeout)
+        with self.mutex:
+            self.blocked_seconds += time.time() - start
+            self.high_water = max(self.high_water, self._qsize())
+
+    def report(self, messages):
+        messages('{} queue: at most {} of {} products waiting, producers held back {:.0f} s'.format(self.name, self.high_water, self.maxsize, self.blocked_seconds))
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Run download, extraction, and composite stages
+
+def run_pipeline(api, catalog, product_ids, directory_path, bands_list, band_set, from_zip = False, max_workers = sentinel_download.DEFAULT_MAX_WORKERS, max_per_host = sentinel_download.DEFAULT_MAX_PER_HOST, extract_workers = sentinel_safe.DEFAULT_MAX_WORKERS, composite_workers = sentinel_composite.DEFAULT_COMPOSITE_WORKERS, memory_cap_mb = sentinel_composite.DEFAULT_WORKER_MEMORY_MB, output_format = sentinel_composite.DEFAULT_OUTPUT_FORMAT, resolution = sentinel_composite.DEFAULT_RESOLUTION, resampling = sentinel_composite.DEFAULT_RESAMPLING, crop = None, band_cache_mb = 0, messages = print):
+
+    pipeline_start = time.time()
+
+    host_limiter = sentinel_download.HostLimiter(max_per_host)
+    composite_slots = max(composite_workers, 1)
+
+    download_monitor = StageMonitor('Download', max_workers)
+    extract_monitor = StageMonitor('Extraction', extract_workers)
+    composite_monitor = StageMonitor('Composite', composite_slots)
+
+    # Bounded queues between stages; download results travel to catalog (owned by this thread) through an unbounded queue
+    extract_queue = MonitoredQueue('Extraction', QUEUE_SLOTS_PER_WORKER * extract_workers)
+    composite_queue = MonitoredQueue('Composite', QUEUE_SLOTS_PER_WORKER * composite_slots)
+    results_queue = queue.Queue()
+
+    # Keep decoded band files in band cache within output directory, if it has a quota
+    band_cache = sentinel_ingest.band_cache_directory(directory_path, band_cache_mb)
+
+    # Products already downloaded that lack a composite are passed straight to extraction (any composite generated before catalog existed is recorded)
+    product_ids = list(product_ids)
+    backlog = [j for j in sentinel_ingest.composite_jobs(catalog, directory_path, bands_list, band_set, from_zip, output_format, resolution, resampling, memory_cap_mb, crop, band_cache, messages) if j['uuid'] not in product_ids]
+
+    messages('Pipeline: {} products to download, {} already downloaded products to composite'.format(len(product_ids), len(backlog)))
+
+    # Errors raised within feed and extraction threads (which would otherwise end silently), re-raised within this thread once every stage has stopped
+    stage_errors = []
+
+    #--------------------------------------------
+
+    # Download stage: download and verify each product, then pass it on to extraction (waiting while extraction queue is full)
+    def download(product_id):
+        result = sentinel_download.download_product(api, product_id, directory_path, host_limiter)
+        download_monitor.add(result['seconds'])
+        results_queue.put(result)
+
+        if result['status'] in sentinel_catalog.DOWNLOADED_STATUSES:
+            extract_queue.put(sentinel_ingest.composite_job(directory_path, result['id'], result['title'], os.path.join(directory_path, result['title'] + '.zip'), bands_list, band_set, from_zip, output_format, resolution, resampling, memory_cap_mb, crop, band_cache))
+
+    def feed():
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+                futures = [executor.submit(download, p) for p in product_ids]
+
+                # Queue backlog while downloads are under way
+                for job in backlog:
+                    extract_queue.put(job)
+
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            stage_errors.append(e)
+        finally:
+            # Tell each extraction worker no more products are coming
+            for i in range(extract_workers):
+                extract_queue.put(None)
+
+    #--------------------------------------------
+
+    # Extraction stage: extract selected band files (unless compositing straight from zip files), then pass product on to compositing
+    remaining_extractors = [extract_workers]
+    extractor_lock = threading.Lock()
+
+    def extract():
+        try:
+            while True:
+                job = extract_queue.get()
+                if job is None:
+                    break
+
+                # Once a stage has failed, drain queue without extracting, so that downloads are never held back by a full queue
+                if stage_errors:
+                    continue
+
+                try:
+                    if not from_zip:
+                        start = time.time()
+                        job['extraction'] = sentinel_safe.extract_bands(job['zip_path'], directory_path, bands_list)
+                        extract_monitor.add(time.time() - start)
+
+                    composite_queue.put(job)
+                except Exception as e:
+                    stage_errors.append(e)
+        finally:
+            # Last extraction worker to finish tells compositing stage no more products are coming
+            with extractor_lock:
+                remaining_extractors[0] -= 1
+                if remaining_extractors[0] == 0:
+                    composite_queue.put(None)
+
+    threads = [threading.Thread(target = feed, daemon = True)] + [threading.Thread(target = extract, daemon = True) for i in range(extract_workers)]
+    for t in threads:
+        t.start()
+
+    #--------------------------------------------
+
+    # Composite stage (within this thread, which owns catalog): composite each product as it arrives, several at once in worker processes if requested
+    download_results = []
+    composite_results = []
+
+    def record_downloads():
+        while True:
+            try:
+                result = results_queue.get_nowait()
+            except queue.Empty:
+                return
+            download_results.append(result)
+            catalog.record_downloads([result])
+            sentinel_download.report_download(result, messages)
+
+    def record_composite(result):
+        composite_results.append(result)
+        composite_monitor.add(result['seconds'])
+        sentinel_composite.report_composite(result, messages)
+        if result['status'] == 'composited':
+            catalog.record_composite(uuid = result['uuid'], band_set = sentinel_composite.composite_key(band_set, resolution, resampling, crop), composite_path = result['composite_raster'])
+
+    in_flight = {}
+    extraction_finished = False
+
+    with contextlib.ExitStack() as stack:
+
+        # Composite within this thread when a single worker is requested; otherwise start pool (hiding tool script from worker processes)
+        executor = None
+        if composite_workers > 1:
+            stack.enter_context(sentinel_composite.main_module_hidden())
+            executor = sentinel_composite.process_pool(composite_workers)
+            stack.callback(lambda: executor.shutdown())
+
+        while not extraction_finished or in_flight:
+            record_downloads()
+
+            # Record composites finished by worker processes; rerun on their own those left unfinished by a worker process dying, and replace broken pool
+            unfinished = []
+            for future in [f for f in in_flight if f.done()]:
+                job = in_flight.pop(future)
+                try:
+                    record_composite(future.result())
+                except concurrent.futures.process.BrokenProcessPool:
+                    unfinished.append(job)
+
+            if unfinished:
+                unfinished.extend(in_flight.values())
+                in_flight = {}
+                executor.shutdown()
+                executor = sentinel_composite.process_pool(composite_workers)
+                for job in unfinished:
+                    rerun_results = []
+                    if sentinel_composite.run_composite_pool([job], 1, memory_cap_mb, rerun_results, lambda message: None):
+                        rerun_results.append({'uuid': job['uuid'], 'composite_raster': job['composite_raster'], 'status': 'failed', 'seconds': 0.0, 'error': 'worker process died (e.g. exceeded memory cap of {} MB)'.format(memory_cap_mb)})
+                    record_composite(rerun_results[0])
+
+            # Wait for a worker process to finish when all are busy
+            if in_flight and (extraction_finished or len(in_flight) >= composite_slots):
+                concurrent.futures.wait(list(in_flight), timeout = 1, return_when = concurrent.futures.FIRST_COMPLETED)
+                continue
+
+            try:
+                job = composite_queue.get(timeout = 1)
+            except queue.Empty:
+                continue
+
+            if job is None:
+                extraction_finished = True
+                continue
+
+            # Once a stage has failed, composite nothing more, only wait for stages to stop
+            if stage_errors:
+                continue
+
+            # Record extraction in catalog, skipping product if its band files could not be extracted
+            if job['extraction'] is not None:
+                extraction = job['extraction']
+                catalog.record_extraction(uuid = job['uuid'], status = 'failed' if extraction['error'] else 'extracted')
+                sentinel_safe.report_extraction(extraction, messages)
+                if extraction['error']:
+                    continue
+
+            if executor is None:
+                record_composite(sentinel_composite.composite_product(job))
+            else:
+                in_flight[executor.submit(sentinel_composite.composite_product, job, memory_cap_mb)] = job
+
+
+    for t in threads:
+        t.join()
+    record_downloads()
+
+    # Raise first error of feed or extraction threads within this (the tool's) thread, once downloads finished so far are recorded in catalog
+    if stage_errors:
+        raise stage_errors[0]
+
+    # Keep band cache within quota, evicting band files used least recently
+    if band_cache is not None:
+        sentinel_band_cache.evict_bands(band_cache, band_cache_mb, messages)
+
+    # Add manifests of new composites to index of output directory
+    sentinel_manifest.update_index(directory_path)
+
+    #--------------------------------------------
+
+    # Report utilisation of each stage and how often a full queue held back the stage feeding it
+    wall_seconds = time.time() - pipeline_start
+
+    sentinel_download.summarize_downloads(results = download_results, wall_seconds = wall_seconds, messages = messages)
+    messages('Composited {} of {} products'.format(len([r for r in composite_results if r['status'] == 'composited']), len(composite_results)))
+
+    for monitor in [download_monitor, extract_monitor, composite_monitor]:
+        monitor.report(wall_seconds, messages)
+    for q in [extract_queue, composite_queue]:
+        q.report(messages)
+    messages('Pipeline wall time: {:.0f} s'.format(wall_seconds))
+
+    return download_results
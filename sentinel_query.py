@@ -0,0 +1,149 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_query.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinelsat Python package
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module queries Copernicus Open Access Hub for Sentinel-2 Level-1C products, folding many tiles and relative orbits into as few
+#                   requests as possible (e.g. tileid:(10SFG OR 10SGG)), and caches each response on disk keyed by its normalized query parameters.
+#                   Cached responses for date windows that had already closed when they were cached never expire; all others expire after max_age_hours.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Normalize query parameters and build cache key
+# 2. Read and write cached responses
+# 3. Run batched query
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, json, pickle, hashlib, datetime, collections
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Name of folder (within output directory) that query responses are cached to
+CACHE_FOLDER = 'query_cache'
+
+# Maximum number of tiles folded into a single request (keeps request URL well within hub limits)
+DEFAULT_BATCH_SIZE = 20
+
+# Age after which cached responses for date windows that were still open are queried again
+DEFAULT_MAX_AGE_HOURS = 1
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Normalize query parameters and build cache key
+
+def normalize_tiles(tiles):
+    # Strip whitespace and leading 'T' (e.g. ' T10SFG' -> '10SFG'), remove duplicates, and sort
+    return sorted(set(t.strip().upper().lstrip('T') for t in tiles if t and t.strip()))
+
+def normalize_orbits(orbits):
+    # Convert relative orbit numbers to integers (e.g. '070' -> 70), remove duplicates, and sort
+    return sorted(set(int(o) for o in orbits if str(o).strip()))
+
+def build_raw_query(tiles, orbits):
+    clauses = []
+    if tiles:
+        clauses.append('tileid:(' + ' OR '.join(tiles) + ')')
+    if orbits:
+        clauses.append('relativeorbitnumber:(' + ' OR '.join(str(o) for o in orbits) + ')')
+    return ' AND '.join(clauses) or None
+
+def cache_key(parameters):
+    return hashlib.sha1(json.dumps(parameters, sort_keys = True).encode('utf-8')).hexdigest()
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Read and write cached responses
+
+# Check whether date window (end date as YYYYMMDD or NOW) had already closed on the day a response was cached
+def window_closed(date_range_end, cached_on):
+    if date_range_end.upper().startswith('NOW'):
+        return False
+    return datetime.datetime.strptime(date_range_end[:8], '%Y%m%d').date() < cached_on.date()
+
+def read_cache(cache_path, date_range_end, max_age_hours):
+    if not os.path.isfile(cache_path):
+        return None
+
+    with open(cache_path, 'rb') as f:
+        entry = pickle.load(f)
+
+    # Keep responses for closed date windows forever; otherwise only while younger than max_age_hours
+    if window_closed(date_range_end, entry['cached_on']):
+        return entry['products']
+    if datetime.datetime.now() - entry['cached_on'] < datetime.timedelta(hours = max_age_hours):
+        return entry['products']
+    return None
+
+def write_cache(cache_path, parameters, products):
+    entry = {'parameters': parameters, 'cached_on': datetime.datetime.now(), 'products': products}
+
+    # Write to temporary file first so an interrupted run never leaves a truncated cache entry
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump(entry, f)
+    os.replace(cache_path + '.tmp', cache_path)
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Run batched query
+
+def query_products(api, date_range_begin, date_range_end, cloud_range_begin, cloud_range_end, cache_directory, tiles = None, orbits = None, area = None, area_relation = 'Intersects', batch_size = DEFAULT_BATCH_SIZE, max_age_hours = DEFAULT_MAX_AGE_HOURS, stats = None, messages = print):
+
+    os.makedirs(cache_directory, exist_ok = True)
+
+    tiles = normalize_tiles(tiles or [])
+    orbits = normalize_orbits(orbits or [])
+
+    # Split tiles into batches (a single batch of None when querying by area alone)
+    tile_batches = [tiles[i:i + batch_size] for i in range(0, len(tiles), batch_size)] or [None]
+
+    products = collections.OrderedDict()
+    requests_made = 0
+
+    for tile_batch in tile_batches:
+        raw = build_raw_query(tile_batch, orbits)
+
+        parameters = {'raw': raw, 'area': area, 'area_relation': area_relation if area else None, 'date': [date_range_begin, date_range_end], 'platformname': 'Sentinel-2', 'producttype': 'S2MSI1C', 'cloudcoverpercentage': [str(cloud_range_begin), str(cloud_range_end)]}
+        cache_path = os.path.join(cache_directory, cache_key(parameters) + '.pickle')
+
+        batch_products = read_cache(cache_path, date_range_end, max_age_hours)
+
+        if batch_products is None:
+            messages('Searching for Sentinel-2 Level-1C products matching query: ' + (raw or 'area of interest'))
+
+            query_arguments = {'raw': raw, 'date': (date_range_begin, date_range_end), 'platformname': 'Sentinel-2', 'producttype': 'S2MSI1C', 'cloudcoverpercentage': (cloud_range_begin, cloud_range_end)}
+            if area:
+                query_arguments.update({'area': area, 'area_relation': area_relation})
+
+            batch_products = api.query(**query_arguments)
+            requests_made += 1
+            write_cache(cache_path, parameters, batch_products)
+        else:
+            messages('Using cached query results for: ' + (raw or 'area of interest'))
+
+        products.update(batch_products)
+
+    messages('Number of query requests sent to hub: {} (of {} batches)'.format(requests_made, len(tile_batches)))
+
+    # Pass number of batches and requests back to caller (e.g. for run plan printed by sentinel_ingest)
+    if stats is not None:
+        stats.update({'batches': len(tile_batches), 'requests': requests_made})
+
+    return products
@@ -0,0 +1,123 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             sentinel_safe.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         Python standard library only
+
+# Notes:            This module is imported by the 0.2x Sentinel-2 Script Tools (it must sit in the same directory as the tool scripts); it is not intended as a stand-alone script.
+
+# Description:      This module extracts from Sentinel-2 Level-1C product zip files only the IMG_DATA band files (*Bxx.jp2) matching the user-selected bands,
+#                   plus the product and tile metadata needed for georeferencing and the tile's cloud mask, instead of the full ~700 MB SAFE directory.
+#                   Members are streamed straight from the zip file to disk, members already extracted are skipped, and several products are extracted at once.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Match band files and select zip file members matching user-selected bands
+# 2. Extract selected members from a single product
+# 3. Extract several products at once
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, shutil, zipfile, fnmatch, concurrent.futures
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Number of products extracted at once (extraction is bound by disk rather than processor)
+DEFAULT_MAX_WORKERS = 4
+
+# Metadata members kept alongside band files: product metadata, tile metadata (tile geocoding), SAFE manifest, and cloud mask (raster from processing baseline 04.00, GML polygons before)
+METADATA_PATTERNS = ['*/MTD_MSIL1C.xml', '*/GRANULE/*/MTD_TL.xml', '*/manifest.safe', '*/GRANULE/*/QI_DATA/MSK_CLASSI_B00.jp2', '*/GRANULE/*/QI_DATA/MSK_CLOUDS_B00.gml']
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Match band files and select zip file members matching user-selected bands
+
+# Return file names ending in a user-selected band number (e.g. T10SFG_20200601T184921_B02.jp2 for band 02) in a single pass, equivalent to matching each against '*' + band + '.jp2'
+def match_band_files(file_names, bands_list):
+    suffixes = tuple(str(b) + '.jp2' for b in bands_list)
+    return [f for f in file_names if f.endswith(suffixes)]
+
+def select_members(member_names, bands_list):
+
+    # Keep band files within IMG_DATA directory matching user-selected bands
+    selected = match_band_files([n for n in member_names if '/IMG_DATA/' in n], bands_list)
+
+    # Keep metadata needed for georeferencing
+    selected += [n for n in member_names if any(fnmatch.fnmatch(n, p) for p in METADATA_PATTERNS)]
+
+    return selected
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Extract selected members from a single product
+
+def extract_bands(zip_path, output_directory, bands_list):
+
+    # Create dictionary recording outcome of extraction
+    result = {'zip_path': zip_path, 'members': 0, 'skipped': 0, 'bytes': 0, 'error': None}
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            members = [zip_ref.getinfo(n) for n in select_members(zip_ref.namelist(), bands_list)]
+
+            for member in members:
+                target_path = os.path.join(output_directory, *member.filename.split('/'))
+
+                # Skip members already extracted in full (e.g. by an earlier run with a different band set)
+                if os.path.isfile(target_path) and os.path.getsize(target_path) == member.file_size:
+                    result['skipped'] += 1
+                    continue
+
+                os.makedirs(os.path.dirname(target_path), exist_ok = True)
+
+                # Stream member to a partial file and rename once complete so an interrupted extraction is never mistaken for a complete band file
+                with zip_ref.open(member) as source, open(target_path + '.partial', 'wb') as target:
+                    shutil.copyfileobj(source, target, 2 ** 20)
+                os.replace(target_path + '.partial', target_path)
+
+                result['members'] += 1
+                result['bytes'] += member.file_size
+
+    except (zipfile.BadZipFile, OSError) as e:
+        result['error'] = str(e)
+
+    return result
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Extract several products at once
+
+def report_extraction(result, messages):
+    if result['error']:
+        messages('Failed to extract bands from {}: {}'.format(os.path.basename(result['zip_path']), result['error']))
+    else:
+        messages('Extracted {} files ({:.1f} MB) from {} ({} already extracted)'.format(result['members'], result['bytes'] / 2 ** 20, os.path.basename(result['zip_path']), result['skipped']))
+
+def extract_products(zip_paths, output_directory, bands_list, max_workers = DEFAULT_MAX_WORKERS, messages = print):
+
+    results = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(extract_bands, z, output_directory, bands_list) for z in zip_paths]
+
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            report_extraction(result, messages)
+
+    return results
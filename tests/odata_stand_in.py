@@ -0,0 +1,208 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             odata_stand_in.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         Python standard library only
+
+# Notes:            This module is imported by the tests in this directory; it is not intended as a stand-alone script.
+
+# Description:      This module serves a stand-in for the OData endpoints of the Copernicus Open Access Hub used by sentinel_download.py (Products('<uuid>')?$format=json for metadata and
+#                   Products('<uuid>')/$value for the zip, with HTTP range requests) from http.server on localhost, so that sentinelsat.SentinelAPI(api_url = ...) can be pointed at it.
+#                   Each product is a synthetic SAFE zip; a product can be made to cut its first downloads off part way, to fail outright, or to publish a wrong checksum. The hub records
+#                   the number of downloads streaming at once (per server and in total) and every download request, so tests can check concurrency limits, retries, and resumed downloads.
+
+###############################################################################################
+###############################################################################################
+
+# This module contains:
+
+# 0. Set-up
+# 1. Build synthetic SAFE zips
+# 2. Record products and downloads of the stand-in hub
+# 3. Serve OData endpoints
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import io, re, json, time, hashlib, zipfile, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Size of each chunk streamed, and pause before each one (so that downloads overlap long enough for concurrency to be measured)
+STREAM_CHUNK_SIZE = 64 * 2 ** 10
+STREAM_CHUNK_SECONDS = 0.02
+
+# OData paths served (product UUID, and whether the zip itself is requested)
+PRODUCT_PATH_PATTERN = re.compile(r"^/odata/v1/Products\('(?P<uuid>[^']+)'\)(?P<value>/\$value)?(?:\?.*)?$")
+
+# Footprint published for every product (GML, as the hub publishes it)
+FOOTPRINT_GML = '<gml:Polygon xmlns:gml="http://www.opengis.net/gml"><gml:outerBoundaryIs><gml:LinearRing><gml:coordinates>38.0,-122.0 38.0,-121.0 39.0,-121.0 39.0,-122.0 38.0,-122.0</gml:coordinates></gml:LinearRing></gml:outerBoundaryIs></gml:Polygon>'
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Build synthetic SAFE zips
+
+# Return bytes of a zip holding a SAFE folder of product title, with a manifest and a granule band file of band_bytes random-looking (incompressible) bytes
+def safe_zip_bytes(title, band_bytes = 2 ** 20):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr(title + '.SAFE/manifest.safe', '<manifest/>')
+        band_data = b''.join(hashlib.sha256((title + str(i)).encode('utf-8')).digest() for i in range(band_bytes // 32))
+        zip_file.writestr(title + '.SAFE/GRANULE/L1C_T10SFG/IMG_DATA/T10SFG_B04.jp2', band_data)
+    return buffer.getvalue()
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Record products and downloads of the stand-in hub
+
+class StandInHub(object):
+    """Products served by the stand-in servers, and a record of the downloads they streamed."""
+
+    def __init__(self):
+        self.products = {}
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.active_total = 0
+        self.peak_total = 0
+        self.requests = []
+        self.servers = []
+
+    # Add product served by server (see serve), cutting off its first truncate_count downloads half way and failing its first fail_count downloads outright (HTTP 503)
+    def add_product(self, uuid, title, server, truncate_count = 0, fail_count = 0, wrong_checksum = False, band_bytes = 2 ** 20):
+        content = safe_zip_bytes(title, band_bytes)
+        md5 = hashlib.md5(b'wrong' if wrong_checksum else content).hexdigest().upper()
+        self.products[uuid] = {'title': title, 'content': content, 'md5': md5, 'server': server, 'truncate_count': truncate_count, 'fail_count': fail_count}
+        return content
+
+    # Return OData metadata of product (as served by Products('<uuid>')?$format=json)
+    def odata(self, uuid):
+        product = self.products[uuid]
+        return {'d': {
+            'Id': uuid,
+            'Name': product['title'],
+            'ContentLength': str(len(product['content'])),
+            'Checksum': {'Algorithm': 'MD5', 'Value': product['md5']},
+            'ContentDate': {'Start': '/Date(1590988161000)/', 'End': '/Date(1590988161000)/'},
+            'ContentGeometry': FOOTPRINT_GML,
+            'CreationDate': '/Date(1591009839000)/',
+            'IngestionDate': '/Date(1591009839000)/',
+            'Online': True,
+            'Attributes': {'results': []},
+            '__metadata': {'media_src': "{}/odata/v1/Products('{}')/$value".format(product['server'].url, uuid)}}}
+
+    # Record download of product starting on server (with its Range header, if any), and return whether it is to be failed or cut off
+    def start_download(self, uuid, server_url, range_header):
+        with self.lock:
+            product = self.products[uuid]
+            self.requests.append({'uuid': uuid, 'server': server_url, 'range': range_header})
+
+            if product['fail_count']:
+                product['fail_count'] -= 1
+                return 'fail'
+
+            self.active[server_url] = self.active.get(server_url, 0) + 1
+            self.peak[server_url] = max(self.peak.get(server_url, 0), self.active[server_url])
+            self.active_total += 1
+            self.peak_total = max(self.peak_total, self.active_total)
+
+            if product['truncate_count']:
+                product['truncate_count'] -= 1
+                return 'truncate'
+            return 'stream'
+
+    def finish_download(self, server_url):
+        with self.lock:
+            self.active[server_url] -= 1
+            self.active_total -= 1
+
+    # Return download requests of product
+    def product_requests(self, uuid):
+        return [r for r in self.requests if r['uuid'] == uuid]
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Serve OData endpoints
+
+class ODataHandler(BaseHTTPRequestHandler):
+    """Answer metadata and download requests of the OData endpoints from the products of the stand-in hub."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        hub = self.server.hub
+        match = PRODUCT_PATH_PATTERN.match(self.path)
+        if match is None or match.group('uuid') not in hub.products:
+            self.send_error(404)
+            return
+
+        uuid = match.group('uuid')
+
+        # Metadata
+        if not match.group('value'):
+            body = json.dumps(hub.odata(uuid)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # Zip, from the first byte requested (HTTP range requests of the form bytes=<start>-)
+        range_header = self.headers.get('Range')
+        outcome = hub.start_download(uuid, self.server.url, range_header)
+        if outcome == 'fail':
+            self.send_error(503, 'Service Unavailable')
+            return
+
+        try:
+            content = hub.products[uuid]['content']
+            start = int(re.match(r'^bytes=(\d+)-$', range_header).group(1)) if range_header else 0
+
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content) - start))
+            if start:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+            self.end_headers()
+
+            # Stream zip a chunk at a time, stopping half way (and closing connection) if download is to be cut off; download stops counting once its last byte is sent, before client can start another
+            end = start + (len(content) - start) // 2 if outcome == 'truncate' else len(content)
+            for offset in range(start, end, STREAM_CHUNK_SIZE):
+                time.sleep(STREAM_CHUNK_SECONDS)
+                self.wfile.write(content[offset:min(offset + STREAM_CHUNK_SIZE, end)])
+                self.wfile.flush()
+
+            if outcome == 'truncate':
+                self.close_connection = True
+        finally:
+            hub.finish_download(self.server.url)
+
+class ODataServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# Start a stand-in server of hub on a free port of localhost, in a background thread, and return it (its url is the api_url to give sentinelsat)
+def serve(hub):
+    server = ODataServer(('127.0.0.1', 0), ODataHandler)
+    server.hub = hub
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    hub.servers.append(server)
+    return server
@@ -0,0 +1,131 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             test_fallow_rules.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; pandas; fallow_rules.py (in parent directory of this script)
+
+# Notes:            This script is run stand-alone or by a test runner (e.g. python -m pytest tests, or python -m unittest discover tests); it is not a Script Tool.
+
+# Description:      This script checks that the whole-array harvest and fallow rules of 0.30 (fallow_rules.py) give the same harvest dates and fallow status as the row-wise rules 0.30 applied before them
+#                   (DataFrame.apply and DataFrame.iterrows, as in benchmarks/fallow_rules_benchmark.py), and the values expected by hand, on a few fields built to sit on either side of each rule:
+#                   the harvest threshold (delta NDVI strictly below it), the start of the fallow analysis timeframe, the 1403 crop type override, and the growing override thresholds.
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Apply row-wise rules
+# 2. Compare whole-array rules with row-wise rules
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, sys, unittest, numpy, pandas
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fallow_rules
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Harvest threshold (as set in 0.30 tool parameters), and start of fallow analysis timeframe
+HARVEST_VALUE_THRESHOLD = -0.2
+DATE_REQUIRED_FALLOW = 20200606
+
+# Delta NDVI of each field and date (NaN where cloudy), with crop type, sum of delta NDVI over fallow analysis timeframe, and most recent clear NDVI of each field:
+#   1 reaches harvest threshold exactly (not harvested) and is growing; 2 harvested before timeframe, fallow crop type; 3 harvested last on first day of timeframe, fallow crop type;
+#   4 harvested before timeframe, another crop type; 5 harvested last within timeframe, fallow crop type; 6 cloudy throughout, growing thresholds reached exactly; 7 without delta sum or clear NDVI
+NAN = numpy.nan
+DELTA_NDVI = pandas.DataFrame(data = [
+    [NAN, -0.2, 0.05, 0.0],
+    [-0.3, 0.1, NAN, 0.0],
+    [-0.3, -0.25, 0.1, 0.0],
+    [-0.3, 0.0, 0.0, 0.0],
+    [-0.3, 0.0, -0.4, NAN],
+    [NAN, NAN, NAN, NAN],
+    [0.0, 0.0, 0.0, 0.0]],
+    index = pandas.Index(numpy.arange(1, 8), name = 'FIELD_ID'), columns = ['delta_20200601', 'delta_20200606', 'delta_20200611', 'delta_20200616'])
+CROP_TYPES = pandas.Series([1403, 1403, 1403, 101, 1403, 1403, 1403], index = DELTA_NDVI.index)
+RECENT_DELTA_SUM = pandas.Series([0.05, 0.0, 0.0, 0.0, 0.005, 0.01, NAN], index = DELTA_NDVI.index)
+ULTIMA_NDVI_CLEAR = pandas.Series([0.3, 0.05, 0.05, 0.05, 0.5, 0.10, NAN], index = DELTA_NDVI.index)
+
+# Harvest date and fallow status (every field fallow before overrides) of each field, worked out by hand
+EXPECTED_HARVEST_DATES = ['-9999', '20200601', '20200606', '20200601', '20200611', '-9999', '-9999']
+EXPECTED_FALLOW_STATUS = ['Not_Fallow', 'Not_Fallow', 'Not_Fallow', 'Fallow', 'Fallow', 'Not_Fallow', 'Fallow']
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Apply row-wise rules (as 0.30 applied them before fallow_rules.py)
+
+def get_recent_harvest(v):
+    s = pandas.Series(v < float(HARVEST_VALUE_THRESHOLD))
+    array = s.where(s == True).last_valid_index()
+    return '-9999' if array is None else array[6:]
+
+def row_wise_rules():
+    df_rows = DELTA_NDVI.copy()
+    df_rows['Harvest_Date'] = df_rows.apply(lambda x: get_recent_harvest(x), axis = 1)
+    df_rows['Crop_Type'] = CROP_TYPES
+    df_rows['Fallow_Status'] = 'Fallow'
+    df_rows['recent_delta_sum'] = RECENT_DELTA_SUM
+
+    for index, row in df_rows.iterrows():
+        if df_rows.loc[index, 'recent_delta_sum'] >= 0.01 and ULTIMA_NDVI_CLEAR[index] >= 0.10:
+            df_rows.loc[index, 'Fallow_Status'] = 'Not_Fallow'
+        if df_rows.loc[index, 'Harvest_Date'] != '-9999' and int(df_rows.loc[index, 'Harvest_Date']) <= DATE_REQUIRED_FALLOW and df_rows.loc[index, 'Crop_Type'] == 1403:
+            df_rows.loc[index, 'Fallow_Status'] = 'Not_Fallow'
+
+    return df_rows
+
+# Apply whole-array rules, as 0.30 does
+def whole_array_rules():
+    df_arrays = DELTA_NDVI.copy()
+    df_arrays['Harvest_Date'] = fallow_rules.recent_harvest_dates(DELTA_NDVI, HARVEST_VALUE_THRESHOLD)
+    df_arrays['Crop_Type'] = CROP_TYPES
+    df_arrays['Fallow_Status'] = 'Fallow'
+    df_arrays['recent_delta_sum'] = RECENT_DELTA_SUM
+
+    not_fallow = fallow_rules.not_fallow_overrides(recent_delta_sum = df_arrays['recent_delta_sum'], ultima_ndvi_clear = ULTIMA_NDVI_CLEAR, harvest_dates = df_arrays['Harvest_Date'], crop_types = df_arrays['Crop_Type'], date_required_fallow = DATE_REQUIRED_FALLOW)
+    df_arrays.loc[not_fallow, 'Fallow_Status'] = 'Not_Fallow'
+
+    return df_arrays
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Compare whole-array rules with row-wise rules
+
+class FallowRulesTest(unittest.TestCase):
+
+    # Most recent harvest date is last date strictly below harvest threshold, identical to row-wise rule
+    def test_harvest_dates(self):
+        harvest_dates = fallow_rules.recent_harvest_dates(DELTA_NDVI, HARVEST_VALUE_THRESHOLD)
+
+        self.assertEqual(harvest_dates.tolist(), EXPECTED_HARVEST_DATES)
+        self.assertTrue(harvest_dates.equals(row_wise_rules()['Harvest_Date']))
+
+    # Fallow status is overridden for growing fields and for fields of crop type 1403 harvested on or before start of timeframe, identical to row-wise rules
+    def test_fallow_status(self):
+        df_rows = row_wise_rules()
+        df_arrays = whole_array_rules()
+
+        self.assertEqual(df_arrays['Fallow_Status'].tolist(), EXPECTED_FALLOW_STATUS)
+        self.assertTrue(df_arrays['Fallow_Status'].equals(df_rows['Fallow_Status']))
+
+    # Fields never harvested (and without delta NDVI) are never overridden by crop type 1403 alone
+    def test_crop_type_override_needs_harvest(self):
+        not_fallow = fallow_rules.not_fallow_overrides(recent_delta_sum = pandas.Series([0.0, 0.0]), ultima_ndvi_clear = pandas.Series([0.0, 0.0]), harvest_dates = pandas.Series(['-9999', '20200601']), crop_types = pandas.Series([1403, 1403]), date_required_fallow = DATE_REQUIRED_FALLOW)
+
+        self.assertEqual(not_fallow.tolist(), [False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             test_field_zones.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         NumPy; field_zones.py (in parent directory of this script)
+
+# Notes:            This script is run stand-alone or by a test runner (e.g. python -m pytest tests, or python -m unittest discover tests); it is not a Script Tool.
+
+# Description:      This script checks the zone indexes and grouped reductions of field_zones.py on a small hand-built zone index and raster (no ArcGIS needed): rows of fields looked up from object IDs
+#                   (including object ID 0, zone nodata of -1, and object IDs of no field), windows of a zone index overlapping rasters offset from it, and per-field mean, standard deviation,
+#                   and majority against values computed by hand.
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Check lookup of rows of fields
+# 2. Check windows of zone index
+# 3. Check per-field statistics
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, sys, unittest, numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import field_zones
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Object IDs of fields (a shapefile's FIDs start at 0), and zone index: zone nodata (-1) outside fields, and object IDs of no field (7 above every field, 4 between fields)
+OBJECT_IDS = [0, 3, 5]
+ZONES = numpy.array([
+    [-1, 0, 0, 3, 3],
+    [-1, 0, 0, 3, 3],
+    [5, 5, -1, 7, 4],
+    [5, 5, -1, -1, -1]], dtype = numpy.int32)
+GEOTRANSFORM = (100.0, 10.0, 0.0, 200.0, 0.0, -10.0)
+
+# Raster values on zone index's grid (NaN where nodata); cells outside every field hold 9, so that counting any of them would change every statistic
+VALUES = numpy.array([
+    [9, 1, 2, 4, 4],
+    [9, 3, numpy.nan, 4, 6],
+    [7, 7, 9, 9, 9],
+    [8, 7, 9, 9, 9]])
+
+class ArrayRaster(object):
+    """Single-band raster held in an array, read a window at a time as field_zones.RasterBands is."""
+
+    def __init__(self, values, geotransform):
+        self.values = values
+        self.geotransform = geotransform
+        self.y_size, self.x_size = values.shape
+
+    def read(self, band, x, y, columns, rows):
+        return self.values[y:y + rows, x:x + columns].copy()
+
+def zone_index():
+    return field_zones.ZoneIndex(ZONES, GEOTRANSFORM, numpy.array(OBJECT_IDS), ['A', 'B', 'C'])
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Check lookup of rows of fields
+
+class ZoneLookupTest(unittest.TestCase):
+
+    # Lookup is indexed by object ID + 1: zone nodata and object IDs of no field (between fields, or above every field) map to field count
+    def test_lookup_rows_of_object_ids(self):
+        lookup = field_zones.zone_lookup(OBJECT_IDS)
+
+        self.assertEqual(lookup.tolist(), [3, 0, 3, 3, 1, 3, 2, 3])
+
+    # Object ID 0 is a field of its own, never confused with zone nodata
+    def test_codes_keep_object_id_zero(self):
+        codes = zone_index().codes(0, 0, 5, 4)
+
+        self.assertEqual(codes.tolist(), [
+            [3, 0, 0, 1, 1],
+            [3, 0, 0, 1, 1],
+            [2, 2, 3, 3, 3],
+            [2, 2, 3, 3, 3]])
+
+    # Codes of a window are those of the same cells of the whole zone index
+    def test_codes_of_window(self):
+        self.assertEqual(zone_index().codes(1, 1, 3, 2).tolist(), [[0, 0, 1], [2, 3, 3]])
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Check windows of zone index
+
+class ZoneWindowTest(unittest.TestCase):
+
+    # Raster starting within zone index (2 columns right of and 1 row below its origin) and reaching past it: window starts at raster's origin and is clipped to zone index
+    def test_window_of_raster_within_zone_index(self):
+        window = zone_index().window(ArrayRaster(numpy.zeros((2, 10)), (120.0, 10.0, 0.0, 190.0, 0.0, -10.0)))
+
+        self.assertEqual((window.x, window.y, window.columns, window.rows), (2, 1, 3, 2))
+        self.assertEqual((window.x_offset, window.y_offset), (0, 0))
+
+    # Raster starting before zone index (2 columns left of and 2 rows above its origin): window starts at zone index's origin, offset on raster
+    def test_window_of_raster_before_zone_index(self):
+        window = zone_index().window(ArrayRaster(numpy.zeros((3, 4)), (80.0, 10.0, 0.0, 220.0, 0.0, -10.0)))
+
+        self.assertEqual((window.x, window.y, window.columns, window.rows), (0, 0, 2, 1))
+        self.assertEqual((window.x_offset, window.y_offset), (2, 2))
+        self.assertEqual(window.raster_window(0, 1), (2, 2, 2, 1))
+
+    # Raster beside zone index has no window
+    def test_window_of_raster_outside_zone_index(self):
+        self.assertIsNone(zone_index().window(ArrayRaster(numpy.zeros((4, 5)), (150.0, 10.0, 0.0, 200.0, 0.0, -10.0))))
+
+    # Strips of a window cover its rows in order, with codes of their cells
+    def test_strips_cover_window(self):
+        window = zone_index().window(ArrayRaster(numpy.zeros((4, 5)), GEOTRANSFORM))
+        strips = list(window.strips(strip_rows = 3))
+
+        self.assertEqual([(y, rows) for y, rows, codes in strips], [(0, 3), (3, 1)])
+        self.assertEqual(numpy.concatenate([codes for y, rows, codes in strips]).tolist(), zone_index().codes(0, 0, 5, 4).tolist())
+
+#----------------------------------------------------------------------------------------------
+
+# 3. Check per-field statistics
+
+class ZonalStatisticsTest(unittest.TestCase):
+
+    # Field of object ID 0 has values 1, 2, 3 (its NaN left out); of object ID 3, 4, 4, 4, 6; of object ID 5, 7, 7, 8, 7
+    def test_mean(self):
+        means = field_zones.zonal_statistics(zone_index(), ArrayRaster(VALUES, GEOTRANSFORM), 1, 'MEAN')
+
+        numpy.testing.assert_allclose(means, [2.0, 4.5, 7.25])
+
+    # Population standard deviation, as Zonal Statistics reports it
+    def test_std(self):
+        stds = field_zones.zonal_statistics(zone_index(), ArrayRaster(VALUES, GEOTRANSFORM), 1, 'STD')
+
+        numpy.testing.assert_allclose(stds, [numpy.sqrt(2.0 / 3.0), numpy.sqrt(0.75), numpy.sqrt(0.1875)])
+
+    # Most frequent value, the lowest where several are equally frequent (field of object ID 0 has 1, 2, 3 once each)
+    def test_majority(self):
+        majorities = field_zones.zonal_statistics(zone_index(), ArrayRaster(VALUES, GEOTRANSFORM), 1, 'MAJORITY')
+
+        self.assertEqual(majorities.tolist(), [1.0, 4.0, 7.0])
+
+    # Raster offset from zone index (a border of NaN around the same values) gives the same statistics
+    def test_statistics_of_offset_raster(self):
+        padded = numpy.pad(VALUES, 1, mode = 'constant', constant_values = numpy.nan)
+        raster = ArrayRaster(padded, (90.0, 10.0, 0.0, 210.0, 0.0, -10.0))
+
+        numpy.testing.assert_allclose(field_zones.zonal_statistics(zone_index(), raster, 1, 'MEAN'), [2.0, 4.5, 7.25])
+        self.assertEqual(field_zones.zonal_statistics(zone_index(), raster, 1, 'MAJORITY').tolist(), [1.0, 4.0, 7.0])
+
+    # Accumulating a strip at a time gives the same statistics as a single strip
+    def test_accumulates_strips(self):
+        window = zone_index().window(ArrayRaster(VALUES, GEOTRANSFORM))
+        accumulator = field_zones.ZonalAccumulator(len(OBJECT_IDS), majority = True)
+        for y, rows, codes in window.strips(strip_rows = 1):
+            accumulator.add(codes, VALUES[y:y + rows].copy())
+
+        numpy.testing.assert_allclose(accumulator.mean(), [2.0, 4.5, 7.25])
+        numpy.testing.assert_allclose(accumulator.std(), [numpy.sqrt(2.0 / 3.0), numpy.sqrt(0.75), numpy.sqrt(0.1875)])
+        self.assertEqual(accumulator.majority_values().tolist(), [1.0, 4.0, 7.0])
+
+    # Field without valid values (every value of field of object ID 0 NaN) has NaN statistics
+    def test_field_without_values(self):
+        values = numpy.where(ZONES == 0, numpy.nan, VALUES)
+
+        for statistics_type in ['MEAN', 'STD', 'MAJORITY']:
+            statistics = field_zones.zonal_statistics(zone_index(), ArrayRaster(values, GEOTRANSFORM), 1, statistics_type)
+            self.assertTrue(numpy.isnan(statistics[0]))
+            self.assertFalse(numpy.isnan(statistics[1:]).any())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+###############################################################################################
+###############################################################################################
+
+# Name:             test_sentinel_download.py
+# Author:           USBR
+# Created:          20261018
+# Updated:          20261018
+# Version:          Created using Python 3.6.8
+
+# Requires:         sentinelsat Python package; sentinel_download.py (in parent directory of this script) and odata_stand_in.py (in same directory as this script)
+
+# Notes:            This script is run stand-alone or by a test runner (e.g. python -m pytest tests, or python -m unittest discover tests); it is not a Script Tool.
+#                   Tests are skipped where sentinelsat is not installed.
+
+# Description:      This script points sentinelsat at stand-in OData servers on localhost (odata_stand_in.py) and checks that sentinel_download.py never streams more products at once than
+#                   its worker pool and per-host limit allow, retries products whose downloads fail or are cut off (resuming from the partial file with a range request), and
+#                   quarantines products whose checksum does not match after every attempt.
+
+###############################################################################################
+###############################################################################################
+
+# This script will:
+
+# 0. Set-up
+# 1. Check bounded concurrency
+# 2. Check retries, resumed downloads, and quarantine
+
+#----------------------------------------------------------------------------------------------
+
+# 0. Set-up
+
+# 0.0 Import necessary packages
+import os, sys, hashlib, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sentinel_download, odata_stand_in
+
+try:
+    import sentinelsat
+except ImportError:
+    sentinelsat = None
+
+#--------------------------------------------
+
+# 0.1 Assign default values
+
+# Return title of synthetic product i (tile and sensing date vary so that every title is distinct)
+def product_title(i):
+    return 'S2A_MSIL1C_202006{:02d}T184921_N0209_R070_T10SF{}_202006{:02d}T221039'.format(i + 1, 'GHJKLMNPQRSTUVWXYZ'[i], i + 1)
+
+class StandInTestCase(unittest.TestCase):
+    """Stand-in hub with two servers (two hosts, by port) and an output directory, torn down after each test."""
+
+    def setUp(self):
+        if sentinelsat is None:
+            self.skipTest('sentinelsat is not installed')
+
+        self.hub = odata_stand_in.StandInHub()
+        self.servers = [odata_stand_in.serve(self.hub), odata_stand_in.serve(self.hub)]
+        self.api = sentinelsat.SentinelAPI(None, None, api_url = self.servers[0].url + '/', show_progressbars = False)
+        self.directory_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.hub.close()
+        shutil.rmtree(self.directory_path)
+
+    def download(self, product_ids, **kwargs):
+        return {r['id']: r for r in sentinel_download.download_products(self.api, product_ids, self.directory_path, backoff_seconds = 0, messages = lambda message: None, **kwargs)}
+
+    def assertDownloaded(self, result, content):
+        self.assertEqual(result['status'], 'downloaded', result['error'])
+        with open(os.path.join(self.directory_path, result['title'] + '.zip'), 'rb') as zip_file:
+            self.assertEqual(hashlib.md5(zip_file.read()).hexdigest(), hashlib.md5(content).hexdigest())
+
+#----------------------------------------------------------------------------------------------
+
+# 1. Check bounded concurrency
+
+class BoundedConcurrencyTest(StandInTestCase):
+
+    # Products spread across two hosts never stream more than max_per_host at once from either host, nor more than max_workers at once in total
+    def test_limits_downloads_per_host_and_in_total(self):
+        contents = {'product-{}'.format(i): self.hub.add_product('product-{}'.format(i), product_title(i), self.servers[i % 2]) for i in range(8)}
+
+        results = self.download(list(contents), max_workers = 3, max_per_host = 2)
+
+        for uuid, content in contents.items():
+            self.assertDownloaded(results[uuid], content)
+        for server in self.servers:
+            self.assertLessEqual(self.hub.peak[server.url], 2)
+        self.assertLessEqual(self.hub.peak_total, 3)
+
+        # Limits are reached, so that they (not the stand-in) bound concurrency
+        self.assertEqual(self.hub.peak_total, 3)
+
+    # A single host limits downloads to max_per_host however many workers are free
+    def test_limits_downloads_to_one_host(self):
+        contents = {'product-{}'.format(i): self.hub.add_product('product-{}'.format(i), product_title(i), self.servers[0]) for i in range(5)}
+
+        results = self.download(list(contents), max_workers = 4, max_per_host = 2)
+
+        for uuid, content in contents.items():
+            self.assertDownloaded(results[uuid], content)
+        self.assertEqual(self.hub.peak[self.servers[0].url], 2)
+
+#----------------------------------------------------------------------------------------------
+
+# 2. Check retries, resumed downloads, and quarantine
+
+class RetryTest(StandInTestCase):
+
+    # Download cut off half way is retried, requesting only the bytes not yet on disk (whole chunks written before connection closed; product spans several chunks so at least one is)
+    def test_resumes_download_cut_off(self):
+        content = self.hub.add_product('cut', product_title(0), self.servers[0], truncate_count = 1, band_bytes = 4 * sentinel_download.CHUNK_SIZE)
+
+        result = self.download(['cut'])['cut']
+
+        self.assertDownloaded(result, content)
+        self.assertEqual(result['attempts'], 2)
+        self.assertGreater(result['resumed_bytes'], 0)
+        self.assertLessEqual(result['resumed_bytes'], len(content) // 2)
+        self.assertEqual([r['range'] for r in self.hub.product_requests('cut')], [None, 'bytes={}-'.format(result['resumed_bytes'])])
+
+    # Product the hub fails to serve is retried until it succeeds, or given up after max_attempts
+    def test_retries_failed_download(self):
+        content = self.hub.add_product('flaky', product_title(0), self.servers[0], fail_count = 2)
+        self.hub.add_product('down', product_title(1), self.servers[1], fail_count = 10)
+
+        results = self.download(['flaky', 'down'], max_attempts = 3)
+
+        self.assertDownloaded(results['flaky'], content)
+        self.assertEqual(results['flaky']['attempts'], 3)
+        self.assertEqual(results['down']['status'], 'failed')
+        self.assertEqual(results['down']['attempts'], 3)
+        self.assertEqual(len(self.hub.product_requests('down')), 3)
+        self.assertFalse(os.path.isfile(os.path.join(self.directory_path, product_title(1) + '.zip')))
+
+    # Product whose checksum never matches is quarantined, and never left in output directory
+    def test_quarantines_checksum_mismatch(self):
+        self.hub.add_product('corrupt', product_title(0), self.servers[0], wrong_checksum = True)
+
+        result = self.download(['corrupt'], max_attempts = 2)['corrupt']
+
+        self.assertEqual(result['status'], 'quarantined')
+        self.assertEqual(result['attempts'], 2)
+        self.assertFalse(os.path.isfile(os.path.join(self.directory_path, product_title(0) + '.zip')))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory_path, sentinel_download.QUARANTINE_FOLDER, product_title(0) + '.zip')))
+
+if __name__ == '__main__':
+    unittest.main()